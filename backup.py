@@ -0,0 +1,409 @@
+#!/usr/bin/env python3
+"""
+Online backups of the database and avatars, and restores from them.
+
+SQLite databases are copied with SQLite's online backup API,
+``BACKUP_PAGES_PER_STEP`` pages at a time. The source is only locked during
+each step, so the app keeps serving while a backup runs. When the app writes
+in the middle of a backup, SQLite starts the copy over. After
+``BACKUP_MAX_RESTARTS`` restarts, the rest is copied in a single step, which
+holds the lock until it is done. The copy is checked with
+``PRAGMA quick_check`` and then gzipped. PostgreSQL databases are dumped
+with ``pg_dump --format=custom`` and restored with ``pg_restore``.
+
+Avatars are recorded in a manifest of path, size and SHA-256 per file.
+Their contents go into a content-addressed store shared by all snapshots,
+so each backup only copies avatars that are new since the last one. The
+database is backed up first: every avatar it references was already on disk.
+
+    backups/
+        objects/ab/ab12...                       avatar contents, by SHA-256
+        20261019T020000000000Z/manifest.json   what was backed up, with checksums
+        20261019T020000000000Z/app.db.gz       or database.dump for PostgreSQL
+        20261019T020000000000Z/avatars.json    avatar manifest
+
+Snapshots beyond the newest ``BACKUP_KEEP`` are removed after each backup,
+along with objects no remaining snapshot refers to.
+
+Restore with the app stopped. The restore replaces the database and adds
+back any avatar that is missing or differs from the manifest. For SQLite,
+the database it replaces is kept next to it as ``<name>.before-restore``.
+
+Usage:
+    python backup.py create              # snapshot the database and avatars into BACKUP_DIR
+    python backup.py list                # snapshots, newest last
+    python backup.py verify <snapshot>   # check a snapshot's checksums
+    python backup.py restore <snapshot> [--force]   # --force replaces an existing database
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy.engine import make_url
+
+from config import (
+    AVATAR_DIR,
+    BACKUP_COMPRESS_LEVEL,
+    BACKUP_DIR,
+    BACKUP_KEEP,
+    BACKUP_MAX_RESTARTS,
+    BACKUP_PAGES_PER_STEP,
+    BACKUP_STEP_SLEEP_SECONDS,
+    DATABASE_URL,
+)
+
+MANIFEST = "manifest.json"
+AVATAR_MANIFEST = "avatars.json"
+SQLITE_FILE = "app.db.gz"
+POSTGRES_FILE = "database.dump"
+OBJECTS = "objects"
+
+_CHUNK = 1024 * 1024
+
+
+class BackupError(Exception):
+    pass
+
+
+class _TooManyRestarts(Exception):
+    pass
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _fsync(path: str):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def sqlite_path(database_url: str) -> Optional[str]:
+    """The file behind a SQLite URL, None for other databases"""
+    url = make_url(database_url)
+    if url.get_backend_name() != "sqlite":
+        return None
+    if not url.database or url.database == ":memory:":
+        raise BackupError("In-memory SQLite databases cannot be backed up")
+    return url.database
+
+
+def _libpq_url(database_url: str) -> str:
+    # pg_dump takes a libpq URI, without SQLAlchemy's +driver suffix
+    url = make_url(database_url).set(drivername="postgresql")
+    return url.render_as_string(hide_password=False)
+
+
+def backup_sqlite(source: str, target: str, pages: int = BACKUP_PAGES_PER_STEP,
+                  sleep: float = BACKUP_STEP_SLEEP_SECONDS, max_restarts: int = BACKUP_MAX_RESTARTS,
+                  on_step: Optional[Callable[[int, int], None]] = None) -> dict:
+    """Copy a live SQLite database to target page by page; returns page and restart counts"""
+    if not os.path.isfile(source):
+        raise BackupError(f"No database at {source}")
+    stats = {"pages": 0, "steps": 0, "restarts": 0, "finalStep": False}
+    last_remaining = None
+
+    def progress(status, remaining, total):
+        nonlocal last_remaining
+        stats["pages"] = total
+        stats["steps"] += 1
+        if last_remaining is not None and remaining > last_remaining:
+            # Another connection wrote to the source, SQLite started over
+            stats["restarts"] += 1
+            if stats["restarts"] > max_restarts:
+                raise _TooManyRestarts()
+        last_remaining = remaining
+        if on_step:
+            on_step(remaining, total)
+        if sleep and remaining:
+            # The source is unlocked between steps, give writers the time
+            time.sleep(sleep)
+
+    # A read-only connection, so the backup can never change the live database
+    source_uri = f"file:{urllib.request.pathname2url(os.path.abspath(source))}?mode=ro"
+    source_connection = sqlite3.connect(source_uri, uri=True, timeout=30)
+    target_connection = sqlite3.connect(target)
+    try:
+        try:
+            source_connection.backup(target_connection, pages=pages, progress=progress)
+        except _TooManyRestarts:
+            stats["finalStep"] = True
+            source_connection.backup(target_connection, pages=-1)
+        result = target_connection.execute("PRAGMA quick_check").fetchone()[0]
+        if result != "ok":
+            raise BackupError(f"Backup copy failed its integrity check: {result}")
+    finally:
+        target_connection.close()
+        source_connection.close()
+    return stats
+
+
+def _compress(source: str, target: str, level: int = BACKUP_COMPRESS_LEVEL):
+    with open(source, "rb") as src, gzip.open(target, "wb", compresslevel=level) as dst:
+        shutil.copyfileobj(src, dst, _CHUNK)
+    _fsync(target)
+
+
+def _object_path(backup_dir: str, sha256: str) -> str:
+    return os.path.join(backup_dir, OBJECTS, sha256[:2], sha256)
+
+
+def snapshot_avatars(avatar_dir: str, backup_dir: str) -> List[Dict]:
+    """Manifest of every avatar, storing contents not already in the object store"""
+    entries = []
+    if not os.path.isdir(avatar_dir):
+        return entries
+    for root, _, files in os.walk(avatar_dir):
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            sha256 = _sha256(path)
+            stored = _object_path(backup_dir, sha256)
+            if not os.path.exists(stored):
+                os.makedirs(os.path.dirname(stored), exist_ok=True)
+                partial = f"{stored}.partial"
+                shutil.copyfile(path, partial)
+                _fsync(partial)
+                os.replace(partial, stored)
+            entries.append({
+                "path": os.path.relpath(path, avatar_dir).replace(os.sep, "/"),
+                "size": os.path.getsize(stored),
+                "sha256": sha256,
+            })
+    entries.sort(key=lambda entry: entry["path"])
+    return entries
+
+
+def create(backup_dir: str = BACKUP_DIR, database_url: str = DATABASE_URL, avatar_dir: str = AVATAR_DIR,
+           keep: int = BACKUP_KEEP) -> str:
+    """Take a snapshot; returns its directory"""
+    name = _utcnow().strftime("%Y%m%dT%H%M%S%fZ")
+    snapshot_dir = os.path.join(backup_dir, name)
+    partial_dir = os.path.join(backup_dir, f".{name}.partial")
+    os.makedirs(partial_dir)
+    started = time.perf_counter()
+    manifest = {"name": name, "createdAt": _utcnow().isoformat()}
+
+    try:
+        source = sqlite_path(database_url)
+        if source is not None:
+            copy = os.path.join(partial_dir, "app.db")
+            manifest["database"] = {"kind": "sqlite", "file": SQLITE_FILE, "sourceBytes": os.path.getsize(source)}
+            manifest["database"].update(backup_sqlite(source, copy))
+            _compress(copy, os.path.join(partial_dir, SQLITE_FILE))
+            os.remove(copy)
+        else:
+            if shutil.which("pg_dump") is None:
+                raise BackupError("pg_dump is not installed")
+            subprocess.run(
+                ["pg_dump", "--format=custom", f"--compress={BACKUP_COMPRESS_LEVEL}", "--no-owner",
+                 f"--file={os.path.join(partial_dir, POSTGRES_FILE)}", f"--dbname={_libpq_url(database_url)}"],
+                check=True,
+            )
+            manifest["database"] = {"kind": "postgresql", "file": POSTGRES_FILE}
+        database_file = os.path.join(partial_dir, manifest["database"]["file"])
+        manifest["database"]["bytes"] = os.path.getsize(database_file)
+        manifest["database"]["sha256"] = _sha256(database_file)
+
+        avatars = snapshot_avatars(avatar_dir, backup_dir)
+        with open(os.path.join(partial_dir, AVATAR_MANIFEST), "w") as f:
+            json.dump(avatars, f, indent=1)
+        manifest["avatars"] = {"count": len(avatars), "bytes": sum(entry["size"] for entry in avatars)}
+        manifest["durationS"] = round(time.perf_counter() - started, 3)
+        with open(os.path.join(partial_dir, MANIFEST), "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(partial_dir, snapshot_dir)
+    except BaseException:
+        shutil.rmtree(partial_dir, ignore_errors=True)
+        raise
+
+    if keep > 0:
+        prune(backup_dir, keep)
+    return snapshot_dir
+
+
+def snapshots(backup_dir: str = BACKUP_DIR) -> List[str]:
+    """Completed snapshot directories, oldest first"""
+    if not os.path.isdir(backup_dir):
+        return []
+    return sorted(
+        os.path.join(backup_dir, name) for name in os.listdir(backup_dir)
+        if os.path.isfile(os.path.join(backup_dir, name, MANIFEST))
+    )
+
+
+def _read(snapshot_dir: str, name: str):
+    with open(os.path.join(snapshot_dir, name)) as f:
+        return json.load(f)
+
+
+def prune(backup_dir: str = BACKUP_DIR, keep: int = BACKUP_KEEP):
+    """Remove all but the newest keep snapshots and the avatar objects only they used"""
+    existing = snapshots(backup_dir)
+    for snapshot_dir in existing[:-keep]:
+        shutil.rmtree(snapshot_dir)
+    referenced = {entry["sha256"] for snapshot_dir in existing[-keep:] for entry in _read(snapshot_dir, AVATAR_MANIFEST)}
+    objects_dir = os.path.join(backup_dir, OBJECTS)
+    if os.path.isdir(objects_dir):
+        for root, _, files in os.walk(objects_dir):
+            for name in files:
+                if name not in referenced:
+                    os.remove(os.path.join(root, name))
+
+
+def verify(snapshot_dir: str) -> List[str]:
+    """Problems found in a snapshot, empty when every checksum matches"""
+    manifest = _read(snapshot_dir, MANIFEST)
+    backup_dir = os.path.dirname(os.path.abspath(snapshot_dir))
+    problems = []
+    database_file = os.path.join(snapshot_dir, manifest["database"]["file"])
+    if not os.path.isfile(database_file) or _sha256(database_file) != manifest["database"]["sha256"]:
+        problems.append(f"database file {manifest['database']['file']} is missing or damaged")
+    for entry in _read(snapshot_dir, AVATAR_MANIFEST):
+        stored = _object_path(backup_dir, entry["sha256"])
+        if not os.path.isfile(stored) or _sha256(stored) != entry["sha256"]:
+            problems.append(f"avatar {entry['path']} is missing or damaged")
+    return problems
+
+
+def _restore_sqlite(database_file: str, target: str, force: bool):
+    if os.path.exists(target) and not force:
+        raise BackupError(f"{target} exists, pass --force to replace it")
+    os.makedirs(os.path.dirname(os.path.abspath(target)), exist_ok=True)
+    fd, restored = tempfile.mkstemp(prefix=".restore-", dir=os.path.dirname(os.path.abspath(target)))
+    try:
+        with os.fdopen(fd, "wb") as dst, gzip.open(database_file, "rb") as src:
+            shutil.copyfileobj(src, dst, _CHUNK)
+        connection = sqlite3.connect(restored)
+        try:
+            result = connection.execute("PRAGMA quick_check").fetchone()[0]
+        finally:
+            connection.close()
+        if result != "ok":
+            raise BackupError(f"Restored database failed its integrity check: {result}")
+        _fsync(restored)
+        if os.path.exists(target):
+            os.replace(target, f"{target}.before-restore")
+        # A leftover journal would be replayed into the restored file
+        for suffix in ("-journal", "-wal", "-shm"):
+            if os.path.exists(target + suffix):
+                os.remove(target + suffix)
+        os.replace(restored, target)
+    finally:
+        if os.path.exists(restored):
+            os.remove(restored)
+
+
+def restore(snapshot_dir: str, database_url: str = DATABASE_URL, avatar_dir: str = AVATAR_DIR,
+            force: bool = False) -> dict:
+    """Put a snapshot's database and avatars back; returns how many avatars were written"""
+    problems = verify(snapshot_dir)
+    if problems:
+        raise BackupError("; ".join(problems))
+    manifest = _read(snapshot_dir, MANIFEST)
+    backup_dir = os.path.dirname(os.path.abspath(snapshot_dir))
+    database_file = os.path.join(snapshot_dir, manifest["database"]["file"])
+
+    target = sqlite_path(database_url)
+    if manifest["database"]["kind"] == "sqlite":
+        if target is None:
+            raise BackupError("A SQLite snapshot can only be restored into a SQLite database")
+        _restore_sqlite(database_file, target, force)
+    else:
+        if target is not None:
+            raise BackupError("A PostgreSQL snapshot can only be restored into PostgreSQL")
+        if shutil.which("pg_restore") is None:
+            raise BackupError("pg_restore is not installed")
+        if not force:
+            raise BackupError("pg_restore replaces existing tables, pass --force")
+        subprocess.run(
+            ["pg_restore", "--clean", "--if-exists", "--no-owner", "--single-transaction",
+             f"--dbname={_libpq_url(database_url)}", database_file],
+            check=True,
+        )
+
+    written = 0
+    for entry in _read(snapshot_dir, AVATAR_MANIFEST):
+        path = os.path.normpath(os.path.join(avatar_dir, entry["path"]))
+        if not path.startswith(os.path.normpath(avatar_dir) + os.sep):
+            raise BackupError(f"Avatar path outside the avatar directory: {entry['path']}")
+        if os.path.isfile(path) and os.path.getsize(path) == entry["size"] and _sha256(path) == entry["sha256"]:
+            continue
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.copyfile(_object_path(backup_dir, entry["sha256"]), f"{path}.partial")
+        os.replace(f"{path}.partial", path)
+        written += 1
+    return {"avatarsWritten": written}
+
+
+def _find(name: str, backup_dir: str = BACKUP_DIR) -> str:
+    """A snapshot by path or by name inside BACKUP_DIR"""
+    for candidate in (name, os.path.join(backup_dir, name)):
+        if os.path.isfile(os.path.join(candidate, MANIFEST)):
+            return candidate
+    print(f"✗ No snapshot {name}")
+    sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PBG87 backups")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("create", help="snapshot the database and avatars")
+    sub.add_parser("list", help="list snapshots")
+    verify_parser = sub.add_parser("verify", help="check a snapshot's checksums")
+    verify_parser.add_argument("snapshot")
+    restore_parser = sub.add_parser("restore", help="restore a snapshot, with the app stopped")
+    restore_parser.add_argument("snapshot")
+    restore_parser.add_argument("--force", action="store_true", help="replace an existing database")
+    args = parser.parse_args()
+
+    try:
+        if args.command == "create":
+            snapshot_dir = create()
+            manifest = _read(snapshot_dir, MANIFEST)
+            print(f"✓ {snapshot_dir}: database {manifest['database']['bytes'] / 1e6:.1f} MB compressed, "
+                  f"{manifest['avatars']['count']} avatars, {manifest['durationS']}s")
+        elif args.command == "list":
+            for snapshot_dir in snapshots():
+                manifest = _read(snapshot_dir, MANIFEST)
+                print(f"{manifest['name']}  {manifest['database']['kind']:<10} "
+                      f"{manifest['database']['bytes'] / 1e6:8.1f} MB {manifest['avatars']['count']:6} avatars")
+        elif args.command == "verify":
+            problems = verify(_find(args.snapshot))
+            for problem in problems:
+                print(f"✗ {problem}")
+            if problems:
+                sys.exit(1)
+            print("✓ Snapshot intact")
+        else:
+            result = restore(_find(args.snapshot), force=args.force)
+            print(f"✓ Restored {args.snapshot}, {result['avatarsWritten']} avatars written")
+    except (BackupError, subprocess.CalledProcessError) as e:
+        print(f"✗ {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,634 @@
+#!/usr/bin/env python3
+"""
+API Benchmark Script
+Seeds a synthetic alumni directory and drives the main endpoints in-process
+at a fixed concurrency, reporting latency percentiles, throughput and query
+counts. Results are stored under benchmarks/results so runs can be compared
+across commits.
+
+Usage:
+    python benchmark.py seed --users 100000
+    python benchmark.py run --scenario benchmarks/scenario.json
+    python benchmark.py compare
+    python benchmark.py compression --limits 20 100 500
+    python benchmark.py ids --rows 1000000
+    python benchmark.py backup --pages 64 256 -1
+
+Requires httpx (pip install httpx).
+"""
+
+import argparse
+import asyncio
+import contextvars
+import glob
+import json
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime
+
+BENCH_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks")
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+DEFAULT_DATABASE_URL = f"sqlite:///{os.path.join(BENCH_DIR, 'bench.db')}"
+DEFAULT_SCENARIO = os.path.join(BENCH_DIR, "scenario.json")
+BENCH_PASSWORD = "benchpass123"
+SEED_BATCH_SIZE = 5000
+
+DEPARTMENTS = ["Plant Breeding", "Agronomy", "Soil Science", "Entomology", "Horticulture", "Forestry"]
+CITIES = [
+    ("Lahore", "Pakistan"), ("Faisalabad", "Pakistan"), ("Karachi", "Pakistan"),
+    ("Islamabad", "Pakistan"), ("Dubai", "UAE"), ("London", "UK"), ("Toronto", "Canada"),
+]
+
+# Tiny valid JPEG header, enough for the content-type check in upload_avatar
+AVATAR_BYTES = b"\xff\xd8\xff\xe0" + b"\x00" * 2048 + b"\xff\xd9"
+
+_query_counter: contextvars.ContextVar = contextvars.ContextVar("query_counter", default=None)
+
+
+def configure_environment(database_url: str):
+    """Point the app at the benchmark database before any app module is imported"""
+    os.environ["DATABASE_URL"] = database_url
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    # Every virtual user shares one client address, which would trip the per-IP limits
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+
+
+def absolute_database_url(database_url: str) -> str:
+    """Make a relative SQLite path absolute, the run changes directory before connecting"""
+    from sqlalchemy.engine import make_url
+
+    url = make_url(database_url)
+    if url.get_backend_name() == "sqlite" and url.database and url.database != ":memory:":
+        url = url.set(database=os.path.abspath(url.database))
+    return url.render_as_string(hide_password=False)
+
+
+def git_revision() -> str:
+    try:
+        # run() has changed directory by now, ask the repository this script lives in
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).strip()
+    except Exception:
+        return "unknown"
+
+
+def percentile(sorted_values, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+# ---------------------------------------------------------------------------
+# Seeding
+# ---------------------------------------------------------------------------
+
+def seed(users: int, seed_value: int = 87):
+    """Insert a synthetic set of users and members in batches"""
+    from sqlalchemy import insert
+    from database import engine
+    from models import Base, User, Member
+    from user import get_password_hash
+    from ids import new_id
+
+    Base.metadata.create_all(bind=engine)
+    rng = random.Random(seed_value)
+    hashed_password = get_password_hash(BENCH_PASSWORD)
+
+    # Users registered by earlier runs (bench_new_*) do not count, bench_user_* are numbered from 0
+    existing = count_seeded_users()
+    if existing >= users:
+        print(f"Database already has {existing} seeded users, nothing to seed")
+        return
+
+    started = time.perf_counter()
+    for batch_start in range(existing, users, SEED_BATCH_SIZE):
+        user_rows, member_rows = [], []
+        for i in range(batch_start, min(batch_start + SEED_BATCH_SIZE, users)):
+            user_id = new_id()
+            city, country = rng.choice(CITIES)
+            user_rows.append({
+                "id": user_id,
+                "username": f"bench_user_{i}",
+                "email": f"bench_user_{i}@example.com",
+                "name": f"Bench User {i}",
+                "role": "ADMIN" if i == 0 else "USER",
+                "password": hashed_password,
+            })
+            member_rows.append({
+                "id": new_id(),
+                "user_id": user_id,
+                "registration_number": f"BENCH{i:07d}",
+                "department": rng.choice(DEPARTMENTS),
+                "address": f"{i} Canal Road",
+                "city": city,
+                "country": country,
+                "phone": f"+92300{i:07d}",
+                "bio": "Synthetic member created by benchmark.py",
+                "is_profile_complete": True,
+            })
+        with engine.begin() as conn:
+            conn.execute(insert(User), user_rows)
+            conn.execute(insert(Member), member_rows)
+        print(f"  seeded {min(batch_start + SEED_BATCH_SIZE, users)}/{users} users")
+
+    # Seeding bypasses the write paths, rebuild the denormalized directory in one pass
+    from database import SessionLocal
+    from directory import refresh_directory
+    db = SessionLocal()
+    try:
+        refresh_directory(db)
+        db.commit()
+    finally:
+        db.close()
+
+    print(f"✓ Seeded {users - existing} users in {time.perf_counter() - started:.1f}s")
+
+
+# ---------------------------------------------------------------------------
+# Load generation
+# ---------------------------------------------------------------------------
+
+class StepStats:
+    def __init__(self, name: str):
+        self.name = name
+        self.latencies_ms = []
+        self.queries = []
+        self.errors = 0
+
+    def summary(self, elapsed_s: float) -> dict:
+        latencies = sorted(self.latencies_ms)
+        count = len(latencies)
+        return {
+            "requests": count,
+            "errors": self.errors,
+            "throughput_rps": round(count / elapsed_s, 2) if elapsed_s else 0.0,
+            "p50_ms": round(percentile(latencies, 50), 3),
+            "p95_ms": round(percentile(latencies, 95), 3),
+            "p99_ms": round(percentile(latencies, 99), 3),
+            "mean_queries": round(sum(self.queries) / count, 2) if count else 0.0,
+        }
+
+
+async def _login(client, username: str) -> str:
+    response = await client.post(
+        "/api/users/token", data={"username": username, "password": BENCH_PASSWORD}
+    )
+    response.raise_for_status()
+    return response.json()["access_token"]
+
+
+def _request_for_step(step: dict, vu: int, iteration: int, token: str):
+    """Return (method, url, kwargs) for one scenario step"""
+    name = step["name"]
+    params = step.get("params", {})
+    auth = {"Authorization": f"Bearer {token}"}
+    if name == "register":
+        suffix = f"{vu}_{iteration}_{uuid.uuid4().hex[:8]}"
+        city, country = random.choice(CITIES)
+        body = {
+            "username": f"bench_new_{suffix}",
+            "email": f"bench_new_{suffix}@example.com",
+            "password": BENCH_PASSWORD,
+            "name": "Bench Registrant",
+            "registration_number": f"BNEW{suffix}",
+            "department": random.choice(DEPARTMENTS),
+            "address": "Benchmark Lane",
+            "city": city,
+            "country": country,
+        }
+        return "POST", "/api/users/register", {"json": body}
+    if name == "login":
+        return "POST", "/api/users/token", {
+            "data": {"username": f"bench_user_{vu}", "password": BENCH_PASSWORD}
+        }
+    if name == "read_members":
+        return "GET", "/api/members/", {"params": params, "headers": auth}
+    if name == "profile":
+        return "GET", "/api/users/profile", {"headers": auth}
+    if name == "upload_avatar":
+        files = {"file": ("avatar.jpg", AVATAR_BYTES, "image/jpeg")}
+        return "POST", "/api/upload/avatar", {"files": files, "headers": auth}
+    raise ValueError(f"Unknown scenario step: {name}")
+
+
+async def run_scenario(scenario: dict) -> dict:
+    import httpx
+    from sqlalchemy import event
+    from database import engine
+    import main
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _count_query(conn, cursor, statement, parameters, context, executemany):
+        counter = _query_counter.get()
+        if counter is not None:
+            counter[0] += 1
+
+    rng = random.Random(scenario.get("seed", 87))
+    steps = scenario["steps"]
+    weights = [step.get("weight", 1) for step in steps]
+    concurrency = scenario["concurrency"]
+    iterations = scenario["iterations_per_user"]
+    stats = {step["name"]: StepStats(step["name"]) for step in steps}
+    plans = [rng.choices(steps, weights=weights, k=iterations) for _ in range(concurrency)]
+
+    # Unhandled app errors are counted as failed requests instead of aborting the run
+    transport = httpx.ASGITransport(app=main.app, raise_app_exceptions=False)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        tokens = [await _login(client, f"bench_user_{vu}") for vu in range(concurrency)]
+
+        async def virtual_user(vu: int):
+            for iteration, step in enumerate(plans[vu]):
+                method, url, kwargs = _request_for_step(step, vu, iteration, tokens[vu])
+                counter = [0]
+                _query_counter.set(counter)
+                started = time.perf_counter()
+                response = await client.request(method, url, **kwargs)
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                step_stats = stats[step["name"]]
+                if response.status_code >= 400:
+                    step_stats.errors += 1
+                step_stats.latencies_ms.append(elapsed_ms)
+                step_stats.queries.append(counter[0])
+
+        started = time.perf_counter()
+        await asyncio.gather(*(virtual_user(vu) for vu in range(concurrency)))
+        elapsed_s = time.perf_counter() - started
+
+    total = sum(len(s.latencies_ms) for s in stats.values())
+    return {
+        "elapsed_s": round(elapsed_s, 3),
+        "total_requests": total,
+        "throughput_rps": round(total / elapsed_s, 2),
+        "steps": {name: s.summary(elapsed_s) for name, s in stats.items()},
+    }
+
+
+async def run_compression(limits, repeats: int) -> list:
+    """Measure wire bytes and compression CPU time for member listing pages"""
+    import httpx
+    import compression
+    import main
+
+    encodings = ["gzip"] + (["br"] if compression.brotli is not None else [])
+    rows = []
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        auth = {"Authorization": f"Bearer {await _login(client, 'bench_user_0')}"}
+        for limit in limits:
+            url = f"/api/members/?limit={limit}"
+            response = await client.get(url, headers={**auth, "Accept-Encoding": "identity"})
+            body = response.content
+            rows.append({"limit": limit, "encoding": "identity", "bytes": len(body), "cpu_ms": 0.0})
+            for encoding in encodings:
+                response = await client.get(url, headers={**auth, "Accept-Encoding": encoding})
+                started = time.process_time()
+                for _ in range(repeats):
+                    compressor = compression.Compressor(encoding)
+                    compressor.compress(body)
+                    compressor.flush()
+                cpu_ms = (time.process_time() - started) * 1000 / repeats
+                rows.append({
+                    "limit": limit,
+                    "encoding": response.headers.get("content-encoding", "identity"),
+                    "bytes": response.num_bytes_downloaded,
+                    "cpu_ms": round(cpu_ms, 3),
+                })
+    return rows
+
+
+def print_compression_report(rows: list):
+    print("-" * 56)
+    print(f"{'limit':>7}{'encoding':>10}{'bytes':>12}{'ratio':>9}{'cpu ms/page':>14}")
+    identity = {}
+    for row in rows:
+        if row["encoding"] == "identity":
+            identity[row["limit"]] = row["bytes"]
+        ratio = row["bytes"] / identity[row["limit"]] if identity.get(row["limit"]) else 1.0
+        print(f"{row['limit']:>7}{row['encoding']:>10}{row['bytes']:>12}{ratio:>9.2f}{row['cpu_ms']:>14}")
+    print("-" * 56)
+
+
+def run_id_benchmark(rows: int, lookups: int, database_url: str) -> list:
+    """Insert rows keyed by random uuid4 and by time-ordered UUIDv7 ids, then time point and keyset reads"""
+    from sqlalchemy import Column, MetaData, String, Table, create_engine, func, insert, select, text
+    from ids import IdType, new_id
+
+    rng = random.Random(87)
+    workdir = tempfile.mkdtemp(prefix="pbg87-ids-")
+    results = []
+    for kind, generate in (("uuid4", lambda: str(uuid.uuid4())), ("uuid7", new_id)):
+        sqlite = database_url.startswith("sqlite")
+        engine = create_engine(f"sqlite:///{os.path.join(workdir, kind + '.db')}" if sqlite else database_url)
+        metadata = MetaData()
+        table = Table(f"bench_ids_{kind}", metadata,
+                      Column("id", IdType, primary_key=True), Column("payload", String))
+        metadata.drop_all(engine)
+        metadata.create_all(engine)
+
+        sample = []
+        started = time.perf_counter()
+        for batch_start in range(0, rows, SEED_BATCH_SIZE):
+            batch = [{"id": generate(), "payload": "x" * 32}
+                     for _ in range(min(SEED_BATCH_SIZE, rows - batch_start))]
+            sample.extend(row["id"] for row in rng.sample(batch, max(1, lookups * len(batch) // rows)))
+            with engine.begin() as conn:
+                conn.execute(insert(table), batch)
+        insert_s = time.perf_counter() - started
+
+        rng.shuffle(sample)
+        started = time.perf_counter()
+        with engine.connect() as conn:
+            for key in sample[:lookups]:
+                conn.execute(select(table.c.payload).where(table.c.id == key)).first()
+        lookup_us = (time.perf_counter() - started) * 1e6 / min(lookups, len(sample))
+
+        # Keyset pagination straight off the primary key, the newest rows of a uuid7 table are contiguous
+        started = time.perf_counter()
+        pages = 0
+        with engine.connect() as conn:
+            cursor = sample[0]
+            for _ in range(100):
+                ids = conn.execute(
+                    select(table.c.id).where(table.c.id > cursor).order_by(table.c.id).limit(100)
+                ).scalars().all()
+                if not ids:
+                    break
+                cursor = ids[-1]
+                pages += 1
+        page_us = (time.perf_counter() - started) * 1e6 / max(pages, 1)
+
+        if sqlite:
+            engine.dispose()
+            size_mb = os.path.getsize(os.path.join(workdir, kind + ".db")) / 1e6
+        else:
+            with engine.connect() as conn:
+                size_mb = conn.execute(
+                    select(func.pg_total_relation_size(text(f"'{table.name}'::regclass")))
+                ).scalar() / 1e6
+            metadata.drop_all(engine)
+            engine.dispose()
+
+        results.append({
+            "ids": kind,
+            "rows": rows,
+            "inserts_per_s": round(rows / insert_s),
+            "lookup_us": round(lookup_us, 1),
+            "keyset_page_us": round(page_us, 1),
+            "size_mb": round(size_mb, 1),
+        })
+        print(f"  {kind}: inserted {rows} rows in {insert_s:.1f}s")
+    return results
+
+
+def print_id_report(results: list):
+    print("-" * 72)
+    print(f"{'ids':<8}{'rows':>10}{'inserts/s':>12}{'lookup us':>12}{'page us':>12}{'size MB':>10}")
+    for r in results:
+        print(f"{r['ids']:<8}{r['rows']:>10}{r['inserts_per_s']:>12}{r['lookup_us']:>12}"
+              f"{r['keyset_page_us']:>12}{r['size_mb']:>10}")
+    print("-" * 72)
+
+
+def run_backup_benchmark(database_url: str, pages_list, write_interval: float) -> list:
+    """Online backup throughput per step size, and how long app writes wait while it runs"""
+    import backup
+
+    source = backup.sqlite_path(database_url)
+    if source is None:
+        print("✗ The backup benchmark needs a SQLite database, PostgreSQL backups go through pg_dump")
+        sys.exit(1)
+    workdir = tempfile.mkdtemp(prefix="pbg87-backup-")
+    connection = sqlite3.connect(source)
+    connection.execute("CREATE TABLE IF NOT EXISTS bench_backup_writes (id INTEGER PRIMARY KEY, at REAL)")
+    connection.commit()
+    connection.close()
+
+    results = []
+    for pages in pages_list:
+        latencies = []
+        stop = threading.Event()
+
+        def writer():
+            # Stands in for the app, committing small writes throughout the backup
+            conn = sqlite3.connect(source, timeout=30)
+            while not stop.is_set():
+                started = time.perf_counter()
+                conn.execute("INSERT INTO bench_backup_writes (at) VALUES (?)", (time.time(),))
+                conn.commit()
+                latencies.append((time.perf_counter() - started) * 1000)
+                time.sleep(write_interval)
+            conn.close()
+
+        copy = os.path.join(workdir, f"copy-{pages}.db")
+        thread = threading.Thread(target=writer) if write_interval >= 0 else None
+        if thread:
+            thread.start()
+        started = time.perf_counter()
+        try:
+            stats = backup.backup_sqlite(source, copy, pages=pages, sleep=0)
+        finally:
+            stop.set()
+            if thread:
+                thread.join()
+        backup_s = time.perf_counter() - started
+
+        started = time.perf_counter()
+        backup._compress(copy, copy + ".gz")
+        gzip_s = time.perf_counter() - started
+        size = os.path.getsize(copy)
+        latencies.sort()
+        results.append({
+            "pages": pages,
+            "size_mb": round(size / 1e6, 1),
+            "backup_s": round(backup_s, 2),
+            "backup_mb_s": round(size / 1e6 / backup_s, 1),
+            "restarts": stats["restarts"],
+            "final_step": stats["finalStep"],
+            "writes": len(latencies),
+            "write_p99_ms": round(percentile(latencies, 99), 2),
+            "write_max_ms": round(latencies[-1], 2) if latencies else 0.0,
+            "gzip_mb_s": round(size / 1e6 / gzip_s, 1),
+            "gzip_ratio": round(os.path.getsize(copy + ".gz") / size, 3),
+        })
+        os.remove(copy)
+        os.remove(copy + ".gz")
+
+    connection = sqlite3.connect(source)
+    connection.execute("DROP TABLE bench_backup_writes")
+    connection.commit()
+    connection.close()
+    return results
+
+
+def print_backup_report(results: list):
+    print("-" * 96)
+    print(f"{'pages':>7}{'MB':>8}{'backup s':>10}{'MB/s':>8}{'restarts':>10}{'final':>7}"
+          f"{'writes':>8}{'p99 ms':>9}{'max ms':>9}{'gzip MB/s':>11}{'ratio':>8}")
+    for r in results:
+        print(f"{r['pages']:>7}{r['size_mb']:>8}{r['backup_s']:>10}{r['backup_mb_s']:>8}{r['restarts']:>10}"
+              f"{'yes' if r['final_step'] else 'no':>7}{r['writes']:>8}{r['write_p99_ms']:>9}{r['write_max_ms']:>9}"
+              f"{r['gzip_mb_s']:>11}{r['gzip_ratio']:>8}")
+    print("-" * 96)
+
+
+def count_seeded_users() -> int:
+    """Size of the dataset written by seed; runs are only compared at the same size"""
+    from database import SessionLocal
+    from models import User
+    db = SessionLocal()
+    try:
+        return db.query(User).filter(User.username.like("bench\\_user\\_%", escape="\\")).count()
+    finally:
+        db.close()
+
+
+# ---------------------------------------------------------------------------
+# Reporting
+# ---------------------------------------------------------------------------
+
+def print_report(result: dict):
+    print("-" * 78)
+    print(f"{'step':<16}{'reqs':>7}{'err':>6}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'queries':>9}")
+    for name, s in result["results"]["steps"].items():
+        print(
+            f"{name:<16}{s['requests']:>7}{s['errors']:>6}{s['throughput_rps']:>10}"
+            f"{s['p50_ms']:>10}{s['p95_ms']:>10}{s['p99_ms']:>10}{s['mean_queries']:>9}"
+        )
+    print("-" * 78)
+    print(f"Total: {result['results']['total_requests']} requests in "
+          f"{result['results']['elapsed_s']}s ({result['results']['throughput_rps']} req/s)")
+
+
+def load_results(scenario_name: str, seeded_users: int):
+    results = []
+    for path in sorted(glob.glob(os.path.join(RESULTS_DIR, "*.json"))):
+        with open(path) as f:
+            data = json.load(f)
+        if data.get("scenario") == scenario_name and data.get("seeded_users") == seeded_users:
+            results.append(data)
+    return results
+
+
+def compare(previous: dict, current: dict):
+    print(f"Comparing {previous['revision']} ({previous['timestamp']}) -> "
+          f"{current['revision']} ({current['timestamp']})")
+    for name, now in current["results"]["steps"].items():
+        before = previous["results"]["steps"].get(name)
+        if not before:
+            continue
+        deltas = []
+        for key in ("p50_ms", "p95_ms", "throughput_rps", "mean_queries"):
+            if before[key]:
+                deltas.append(f"{key} {((now[key] - before[key]) / before[key]) * 100:+.1f}%")
+        print(f"  {name:<16}" + ", ".join(deltas))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PBG87 backend benchmark")
+    parser.add_argument("--database-url", default=os.getenv("BENCH_DATABASE_URL", DEFAULT_DATABASE_URL))
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    seed_parser = sub.add_parser("seed", help="seed a synthetic dataset")
+    seed_parser.add_argument("--users", type=int, default=10000)
+
+    run_parser = sub.add_parser("run", help="run a load scenario")
+    run_parser.add_argument("--scenario", default=DEFAULT_SCENARIO)
+    run_parser.add_argument("--no-save", action="store_true")
+
+    compression_parser = sub.add_parser("compression", help="measure response compression per page")
+    compression_parser.add_argument("--limits", type=int, nargs="+", default=[20, 100, 500])
+    compression_parser.add_argument("--repeats", type=int, default=50)
+
+    ids_parser = sub.add_parser("ids", help="compare insert and lookup cost of uuid4 and UUIDv7 keys")
+    ids_parser.add_argument("--rows", type=int, default=1_000_000)
+    ids_parser.add_argument("--lookups", type=int, default=10_000)
+
+    backup_parser = sub.add_parser("backup", help="measure online backup throughput and write latency meanwhile")
+    backup_parser.add_argument("--pages", type=int, nargs="+", default=[64, 256, 1024, -1],
+                               help="pages copied per step, -1 for all at once")
+    backup_parser.add_argument("--write-interval", type=float, default=0.01,
+                               help="seconds between concurrent writes, negative for none")
+
+    compare_parser = sub.add_parser("compare", help="compare the last two stored runs")
+    compare_parser.add_argument("--scenario-name", default="default")
+    compare_parser.add_argument("--users", type=int, default=10000, help="size of the seeded dataset")
+
+    args = parser.parse_args()
+    args.database_url = absolute_database_url(args.database_url)
+    configure_environment(args.database_url)
+
+    if args.command == "seed":
+        seed(args.users)
+        return
+
+    if args.command == "compare":
+        runs = load_results(args.scenario_name, args.users)
+        if len(runs) < 2:
+            print("Need at least two stored runs to compare")
+            sys.exit(1)
+        compare(runs[-2], runs[-1])
+        return
+
+    if args.command == "ids":
+        # Runs in throwaway SQLite files unless --database-url points at another server
+        print_id_report(run_id_benchmark(args.rows, args.lookups, args.database_url))
+        return
+
+    if args.command == "backup":
+        print_backup_report(run_backup_benchmark(args.database_url, args.pages, args.write_interval))
+        return
+
+    if args.command == "compression":
+        print_compression_report(asyncio.run(run_compression(args.limits, args.repeats)))
+        return
+
+    with open(args.scenario) as f:
+        scenario = json.load(f)
+
+    # Avatar uploads are written relative to the working directory
+    os.chdir(tempfile.mkdtemp(prefix="pbg87-bench-"))
+
+    seeded_users = count_seeded_users()
+    if seeded_users < scenario["concurrency"]:
+        print(f"✗ Need at least {scenario['concurrency']} seeded users, found {seeded_users}. Run 'seed' first.")
+        sys.exit(1)
+
+    print(f"Running scenario '{scenario['name']}' against {seeded_users} seeded users "
+          f"({scenario['concurrency']} virtual users x {scenario['iterations_per_user']} iterations)")
+    result = {
+        "scenario": scenario["name"],
+        "seeded_users": seeded_users,
+        "revision": git_revision(),
+        "timestamp": datetime.utcnow().isoformat(),
+        "database": args.database_url.split(":", 1)[0],
+        "results": asyncio.run(run_scenario(scenario)),
+    }
+    print_report(result)
+
+    previous = load_results(result["scenario"], seeded_users)
+    if previous:
+        compare(previous[-1], result)
+
+    if not args.no_save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(
+            RESULTS_DIR,
+            f"{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}_{result['revision']}_{result['scenario']}.json",
+        )
+        with open(path, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"Results saved to {path}")
+
+
+if __name__ == "__main__":
+    main()
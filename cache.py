@@ -0,0 +1,146 @@
+"""
+Shared response cache for hot read endpoints.
+
+Responses are stored as pre-serialized bytes, usually JSON. Each cache namespace has a
+version number that write paths bump after committing; keys embed the
+current version, so one increment invalidates every cached page at once and
+stale entries simply age out of the LRU.
+
+The in-memory backend is per-process. Set ``CACHE_BACKEND=redis`` to share
+entries and versions between workers through any Redis-compatible server.
+"""
+
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+from fastapi.encoders import jsonable_encoder
+
+from config import CACHE_BACKEND, CACHE_REDIS_URL, CACHE_TTL_SECONDS, CACHE_MAX_ENTRIES, CACHE_MAX_BYTES
+
+
+def encode_json(content: Any) -> bytes:
+    """Compact JSON body for content, encoded the way FastAPI would"""
+    return json.dumps(jsonable_encoder(content), separators=(",", ":")).encode("utf-8")
+
+
+class MemoryCache:
+    """Size-bounded LRU with per-entry TTL"""
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, max_bytes: int = CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._counters = {}
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: bytes, ttl: int):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._size += len(value)
+            while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def get_counter(self, key: str) -> int:
+        with self._lock:
+            return self._counters.get(key, 0)
+
+    def incr(self, key: str) -> int:
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def _remove(self, key: str):
+        value, _ = self._entries.pop(key)
+        self._size -= len(value)
+
+
+class RedisCache:
+    """Cache backend for any client exposing Redis get/set/incr"""
+
+    def __init__(self, client: Any):
+        self.client = client
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.client.get(key)
+
+    def set(self, key: str, value: bytes, ttl: int):
+        self.client.set(key, value, ex=ttl)
+
+    def get_counter(self, key: str) -> int:
+        value = self.client.get(key)
+        return int(value) if value is not None else 0
+
+    def incr(self, key: str) -> int:
+        return self.client.incr(key)
+
+
+class ResponseCache:
+    """Versioned namespace of cached JSON responses"""
+
+    def __init__(self, namespace: str, backend, ttl: int = CACHE_TTL_SECONDS):
+        self.namespace = namespace
+        self.backend = backend
+        self.ttl = ttl
+        self.version_key = f"cache:{namespace}:version"
+
+    def scoped(self, scope: str) -> "ResponseCache":
+        """The same cache with its own keys and version, e.g. one per batch"""
+        return ResponseCache(f"{self.namespace}:{scope}", self.backend, self.ttl)
+
+    def key(self, *params) -> str:
+        """Build a key for the current version.
+
+        Take the key before querying the database: if a write bumps the
+        version in the meantime, the result is stored under the old version
+        and never served.
+        """
+        version = self.backend.get_counter(self.version_key)
+        return f"cache:{self.namespace}:v{version}:" + ":".join(str(p) for p in params)
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.backend.get(key)
+
+    def set(self, key: str, content: Any) -> bytes:
+        """Serialize content once, store it and return the bytes"""
+        return self.set_bytes(key, encode_json(content))
+
+    def set_bytes(self, key: str, body: bytes, ttl: Optional[int] = None) -> bytes:
+        """Store an already encoded body"""
+        self.backend.set(key, body, self.ttl if ttl is None else ttl)
+        return body
+
+    def invalidate(self):
+        self.backend.incr(self.version_key)
+
+
+def create_backend():
+    if CACHE_BACKEND == "redis":
+        import redis  # optional dependency, only needed for the shared backend
+        return RedisCache(redis.Redis.from_url(CACHE_REDIS_URL))
+    return MemoryCache()
+
+
+cache_backend = create_backend()
+
+# GET /api/members/ pages, scoped per batch and invalidated by every user/member write path
+directory_cache = ResponseCache("members", cache_backend)
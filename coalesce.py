@@ -0,0 +1,94 @@
+"""
+Request coalescing (single-flight) for hot read endpoints.
+
+When many identical reads arrive together, as after an announcement, the
+first one runs the queries and serializes the response while the others
+wait for it and reuse the encoded body. Flights are keyed by the versioned
+directory cache key, so a read that starts after a write has committed
+never joins a flight that started before it.
+
+Waiting requests hand their database connection back to the pool first, so
+hundreds of waiters do not hold the connections the leader needs. Flights
+are per process; each group counts how many requests it executed and how
+many were coalesced, reported by ``GET /ready``.
+"""
+
+import threading
+from typing import Callable, Dict, Optional, TypeVar
+
+from sqlalchemy.orm import Session
+
+from config import REQUEST_COALESCING_ENABLED
+
+T = TypeVar("T")
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """Runs one call per key at a time and shares its result with concurrent callers"""
+
+    def __init__(self, name: str, enabled: bool = REQUEST_COALESCING_ENABLED):
+        self.name = name
+        self.enabled = enabled
+        self.executed = 0
+        self.coalesced = 0
+        self._flights: Dict[str, _Flight] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: str, fn: Callable[[], T], db: Optional[Session] = None) -> T:
+        """Call fn, or wait for the identical call already in flight and return its result
+
+        Exceptions, including HTTPException, are raised in every caller.
+        """
+        with self._lock:
+            flight = self._flights.get(key) if self.enabled else None
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                if self.enabled:
+                    self._flights[key] = flight
+                self.executed += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            if db is not None:
+                # Give the connection back while waiting; the session reconnects if used again
+                db.rollback()
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = fn()
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+            flight.done.set()
+
+    def snapshot(self) -> dict:
+        return {"executed": self.executed, "coalesced": self.coalesced, "inFlight": len(self._flights)}
+
+
+groups: Dict[str, SingleFlight] = {}
+
+
+def group(name: str) -> SingleFlight:
+    """The process-wide flight group for one endpoint"""
+    return groups.setdefault(name, SingleFlight(name))
+
+
+def snapshot() -> dict:
+    return {name: flights.snapshot() for name, flights in groups.items()}
@@ -1,4 +1,5 @@
 import os
+import json
 
 # Environment detection
 ENVIRONMENT = os.getenv("ENVIRONMENT", "development")
@@ -10,6 +11,10 @@ DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./app.db")
 SECRET_KEY = os.environ.get("SECRET_KEY", "supersecretkey")
 ALGORITHM = os.environ.get("ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.environ.get("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.environ.get("REFRESH_TOKEN_EXPIRE_DAYS", "30"))
+
+# bcrypt work factor for new password hashes; the test suite lowers it to the minimum of 4
+BCRYPT_ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", "12"))
 
 # CORS Configuration
 if ENVIRONMENT == "production":
@@ -19,11 +24,107 @@ else:
     FRONTEND_URL = "http://localhost:3000"
     CORS_ORIGINS = "http://localhost:3000,http://localhost:3001,http://localhost:3002,http://127.0.0.1:3000,http://127.0.0.1:3001,http://127.0.0.1:3002,https://pbg-87.vercel.app,https://*.vercel.app"
 
-# Now print, after CORS_ORIGINS is defined
-print(f"Environment detected: {ENVIRONMENT}")
-print(f"CORS Origins: {CORS_ORIGINS}")
-
 # File upload configuration
 UPLOAD_DIR = "uploads"
 AVATAR_DIR = os.path.join(UPLOAD_DIR, "avatars")
-MAX_FILE_SIZE = 5 * 1024 * 1024  # 5MB 
\ No newline at end of file
+MAX_FILE_SIZE = 5 * 1024 * 1024  # 5MB
+
+# Profiling configuration
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0.01"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_ADMIN_TOKEN = os.getenv("PROFILE_ADMIN_TOKEN")  # enables the X-Profile header when set
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "100"))
+
+# Logging configuration
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.1"))
+LOG_SAMPLED_PATHS = [p.strip() for p in os.getenv("LOG_SAMPLED_PATHS", "/api/members,/uploads").split(",") if p.strip()]
+
+# Response cache configuration
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")  # memory or redis
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL", "redis://localhost:6379/0")
+CACHE_TTL_SECONDS = int(os.getenv("CACHE_TTL_SECONDS", "30"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "256"))
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+
+# Response compression configuration
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4"))
+COMPRESSION_EXCLUDED_PATHS = [p.strip() for p in os.getenv("COMPRESSION_EXCLUDED_PATHS", "/uploads").split(",") if p.strip()]
+
+# Maximum number of ids accepted by POST /api/members/batch
+MEMBER_BATCH_MAX_IDS = int(os.getenv("MEMBER_BATCH_MAX_IDS", "200"))
+
+# How long a stored Idempotency-Key response can be replayed
+IDEMPOTENCY_KEY_TTL_HOURS = int(os.getenv("IDEMPOTENCY_KEY_TTL_HOURS", "24"))
+
+# Rate limiting configuration
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")  # memory or redis
+RATE_LIMIT_REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL", "redis://localhost:6379/0")
+RATE_LIMIT_TRUST_FORWARDED = os.getenv("RATE_LIMIT_TRUST_FORWARDED", "false").lower() == "true"
+RATE_LIMIT_RULES = json.loads(os.getenv("RATE_LIMIT_RULES", json.dumps([
+    {"path": "/api/users/token", "methods": ["POST"], "per_ip": "30/minute", "per_username": "10/minute"},
+    {"path": "/api/users/register", "methods": ["POST"], "per_ip": "10/minute"},
+])))
+
+# Directory change feed configuration
+CHANGES_PAGE_SIZE = int(os.getenv("CHANGES_PAGE_SIZE", "500"))
+CHANGES_HEARTBEAT_SECONDS = float(os.getenv("CHANGES_HEARTBEAT_SECONDS", "15"))
+SNAPSHOT_CACHE_TTL_SECONDS = int(os.getenv("SNAPSHOT_CACHE_TTL_SECONDS", "3600"))
+CHANGES_RETENTION_DAYS = int(os.getenv("CHANGES_RETENTION_DAYS", "90"))
+
+# Background jobs
+TASKS_INLINE_WORKER = os.getenv("TASKS_INLINE_WORKER", "true").lower() == "true"
+TASK_MAX_ATTEMPTS = int(os.getenv("TASK_MAX_ATTEMPTS", "5"))
+TASK_RETRY_BASE_SECONDS = float(os.getenv("TASK_RETRY_BASE_SECONDS", "5"))
+TASK_POLL_SECONDS = float(os.getenv("TASK_POLL_SECONDS", "5"))
+TASK_TIMEOUT_SECONDS = int(os.getenv("TASK_TIMEOUT_SECONDS", "300"))
+
+# Connection pool monitoring
+POOL_CHECKOUT_WARN_SECONDS = float(os.getenv("POOL_CHECKOUT_WARN_SECONDS", "30"))
+POOL_CHECKOUT_STACKS = os.getenv("POOL_CHECKOUT_STACKS", "true").lower() == "true"
+
+# Alumni map
+GAZETTEER_PATH = os.getenv("GAZETTEER_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "gazetteer.csv"))
+
+# Multi-batch tenancy
+DEFAULT_BATCH = os.getenv("DEFAULT_BATCH", "87")
+BATCHES = [b.strip() for b in os.getenv("BATCHES", DEFAULT_BATCH).split(",") if b.strip()]
+BATCH_HOSTS = json.loads(os.getenv("BATCH_HOSTS", "{}"))  # {"pbg-90.example.com": "90"}
+
+# Resumable avatar uploads; keep the parts directory on the same filesystem as UPLOAD_DIR
+RESUMABLE_UPLOAD_DIR = os.getenv("RESUMABLE_UPLOAD_DIR", "upload_parts")
+RESUMABLE_UPLOAD_EXPIRY_HOURS = float(os.getenv("RESUMABLE_UPLOAD_EXPIRY_HOURS", "24"))
+
+# Adaptive concurrency limits and load shedding, per route class (see load_shedding.py)
+CONCURRENCY_LIMIT_ENABLED = os.getenv("CONCURRENCY_LIMIT_ENABLED", "true").lower() == "true"
+CONCURRENCY_CLASSES = json.loads(os.getenv("CONCURRENCY_CLASSES", json.dumps({
+    "auth": {"initial": 8, "min": 2, "max": 32, "target_ms": 1500, "priority": "high"},
+    "directory": {"initial": 32, "min": 4, "max": 128, "target_ms": 300, "priority": "high"},
+    "default": {"initial": 16, "min": 2, "max": 64, "target_ms": 500, "priority": "high"},
+    "uploads": {"initial": 8, "min": 8, "max": 8, "target_ms": None, "priority": "low"},
+    "admin": {"initial": 4, "min": 1, "max": 8, "target_ms": 3000, "priority": "low"},
+})))
+CONCURRENCY_GLOBAL_LIMIT = int(os.getenv("CONCURRENCY_GLOBAL_LIMIT", "64"))
+CONCURRENCY_SHED_LOW_PRIORITY_AT = float(os.getenv("CONCURRENCY_SHED_LOW_PRIORITY_AT", "0.75"))
+CONCURRENCY_RETRY_AFTER_SECONDS = int(os.getenv("CONCURRENCY_RETRY_AFTER_SECONDS", "2"))
+
+# Readiness probe thresholds
+READY_POOL_SATURATION = float(os.getenv("READY_POOL_SATURATION", "0.9"))
+READY_MAX_PENDING_JOBS = int(os.getenv("READY_MAX_PENDING_JOBS", "1000"))
+READY_DB_TIMEOUT_SECONDS = float(os.getenv("READY_DB_TIMEOUT_SECONDS", "2"))
+
+# Identical concurrent reads share one query and serialization (see coalesce.py)
+REQUEST_COALESCING_ENABLED = os.getenv("REQUEST_COALESCING_ENABLED", "true").lower() == "true"
+
+# Backups (see backup.py); -1 pages copies the whole SQLite database in one step
+BACKUP_DIR = os.getenv("BACKUP_DIR", "backups")
+BACKUP_PAGES_PER_STEP = int(os.getenv("BACKUP_PAGES_PER_STEP", "256"))
+BACKUP_STEP_SLEEP_SECONDS = float(os.getenv("BACKUP_STEP_SLEEP_SECONDS", "0"))
+BACKUP_MAX_RESTARTS = int(os.getenv("BACKUP_MAX_RESTARTS", "5"))
+BACKUP_COMPRESS_LEVEL = int(os.getenv("BACKUP_COMPRESS_LEVEL", "6"))
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "14"))
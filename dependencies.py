@@ -0,0 +1,37 @@
+"""
+Shared FastAPI dependencies.
+
+Every route that touches the database takes ``db: Session = Depends(get_db)``.
+FastAPI caches a dependency for the duration of a request, so a request gets
+exactly one session however many of its dependencies ask for it, and the
+session is closed when the response is done, even if the handler raised.
+Code running outside a request (streams, startup, CLIs) uses
+``session_scope()`` instead of calling ``get_db`` by hand.
+"""
+
+from contextlib import contextmanager
+from typing import Iterator
+
+from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/users/token")
+# For routes that are public but show more to some callers; None without a token
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/users/token", auto_error=False)
+
+
+@contextmanager
+def session_scope() -> Iterator[Session]:
+    """A session that is always closed, for code that is not handling a request"""
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def get_db() -> Iterator[Session]:
+    with session_scope() as db:
+        yield db
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""
+Denormalized member directory.
+
+``member_directory`` holds one flattened row per member joined to its user,
+plus a lower-cased ``search_text`` column, so directory reads are a single
+table scan with no join. Write paths call ``refresh_directory`` before
+committing; it recomputes the affected rows with INSERT ... SELECT inside
+the caller's transaction, so the read model never disagrees with the base
+tables. Each recomputed or removed row is also appended to
+``directory_changes``, which backs the incremental changes feed.
+
+Feed readers resume from the highest sequence number they have seen, so
+numbers must become visible in order. SQLite has a single writer; on
+PostgreSQL appends take a transaction-level advisory lock, which makes
+transactions that change the directory commit in sequence order.
+
+Only the latest change per member is ever read back (the feed serves current
+rows), so ``prune_changes`` drops superseded changes, and deletions older
+than ``CHANGES_RETENTION_DAYS``. It runs as a job on every start and records
+the last pruned deletion per batch in ``directory_change_horizons``; readers
+resuming from before it are told to reload the whole directory.
+
+Usage:
+    python directory.py rebuild     # backfill or repair the whole table
+    python directory.py prune       # trim the change log
+"""
+
+import asyncio
+import logging
+import sys
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, Optional, Union
+
+from sqlalchemy import Select, and_, delete, event as sa_event, exists, func, insert, literal, select, text, true
+from sqlalchemy.orm import Session, aliased
+
+from config import CHANGES_RETENTION_DAYS
+from models import DirectoryChange, DirectoryChangeHorizon, Member, MemberDirectory, User
+
+logger = logging.getLogger(__name__)
+
+
+def _search_text():
+    parts = [
+        func.coalesce(User.name, ""), User.username, Member.registration_number,
+        Member.department, Member.city, Member.country,
+    ]
+    text = parts[0]
+    for part in parts[1:]:
+        text = text + literal(" ") + part
+    return func.lower(text)
+
+
+# member_directory column -> expression over the joined base tables
+_SOURCE_COLUMNS = {
+    "member_id": Member.id,
+    "batch": Member.batch,
+    "user_id": User.id,
+    "registration_number": Member.registration_number,
+    "department": Member.department,
+    "address": Member.address,
+    "city": Member.city,
+    "country": Member.country,
+    "phone": Member.phone,
+    "avatar_url": Member.avatar_url,
+    "bio": Member.bio,
+    "is_profile_complete": Member.is_profile_complete,
+    "created_at": Member.created_at,
+    "updated_at": Member.updated_at,
+    "name": User.name,
+    "username": User.username,
+    "email": User.email,
+    "role": User.role,
+    "user_created_at": User.created_at,
+    "user_updated_at": User.updated_at,
+    "search_text": _search_text(),
+}
+
+
+class ChangeNotifier:
+    """Wakes change feed streams, across threads, after directory changes commit"""
+
+    def __init__(self):
+        self._waiters = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self) -> asyncio.Event:
+        event = asyncio.Event()
+        with self._lock:
+            self._waiters.add((asyncio.get_running_loop(), event))
+        return event
+
+    def unsubscribe(self, event: asyncio.Event):
+        with self._lock:
+            self._waiters = {(loop, e) for loop, e in self._waiters if e is not event}
+
+    def notify(self):
+        with self._lock:
+            waiters = list(self._waiters)
+        for loop, event in waiters:
+            loop.call_soon_threadsafe(event.set)
+
+
+change_notifier = ChangeNotifier()
+
+
+@sa_event.listens_for(Session, "after_commit")
+def _notify_after_commit(session):
+    if session.info.pop("directory_changed", False):
+        change_notifier.notify()
+
+
+# Any application-wide constant, pg_advisory_xact_lock keys are shared by the whole database
+CHANGE_LOG_LOCK_KEY = 870_001
+
+
+def _lock_change_log(db: Session):
+    """Hold change log appends until this transaction ends, on PostgreSQL
+
+    Sequence values are handed out at insert time but become visible at
+    commit; without the lock a reader could see seq 12 before 11 commits
+    and never ask for 11.
+    """
+    if db.get_bind().dialect.name == "postgresql":
+        db.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": CHANGE_LOG_LOCK_KEY})
+
+
+def refresh_directory(
+    db: Session,
+    member_ids: Optional[Iterable[str]] = None,
+    user_ids: Optional[Union[Iterable[str], Select]] = None,
+):
+    """Recompute directory rows for the given members or users (all rows if neither is given).
+
+    user_ids may also be a SELECT of user ids, which is run as a subquery.
+
+    Pending ORM changes are flushed first so the recomputed rows see them,
+    and every recomputed or removed row is appended to the change log. The
+    caller commits.
+    """
+    source = select(*_SOURCE_COLUMNS.values()).select_from(Member).join(User, User.id == Member.user_id)
+    stale = true()
+    if member_ids is not None:
+        member_ids = list(member_ids)
+        source = source.where(Member.id.in_(member_ids))
+        stale = and_(stale, MemberDirectory.member_id.in_(member_ids))
+    if user_ids is not None:
+        if not isinstance(user_ids, Select):
+            user_ids = list(user_ids)
+        source = source.where(User.id.in_(user_ids))
+        stale = and_(stale, MemberDirectory.user_id.in_(user_ids))
+
+    _lock_change_log(db)
+    # Read the current rows before flushing: a pending member delete cascades to its row
+    previous = db.execute(
+        select(MemberDirectory.member_id, MemberDirectory.batch, MemberDirectory.user_id).where(stale)
+    ).all()
+    db.flush()
+
+    db.execute(delete(MemberDirectory).where(stale).execution_options(synchronize_session=False))
+    db.execute(insert(MemberDirectory).from_select(list(_SOURCE_COLUMNS), source))
+    db.execute(insert(DirectoryChange).from_select(
+        ["member_id", "batch", "user_id", "op"],
+        source.with_only_columns(Member.id, Member.batch, User.id, literal("upsert")),
+    ))
+    current = set(db.scalars(select(MemberDirectory.member_id).where(stale)))
+    removed = [
+        {"member_id": member_id, "batch": batch, "user_id": user_id, "op": "delete"}
+        for member_id, batch, user_id in previous if member_id not in current
+    ]
+    if removed:
+        db.execute(insert(DirectoryChange), removed)
+    db.info["directory_changed"] = True
+
+
+def record_user_deletes(db: Session, user_ids):
+    """Log deletions for users about to be removed by a set-based DELETE"""
+    _lock_change_log(db)
+    db.execute(insert(DirectoryChange).from_select(
+        ["member_id", "batch", "user_id", "op"],
+        select(MemberDirectory.member_id, MemberDirectory.batch, MemberDirectory.user_id, literal("delete"))
+        .where(MemberDirectory.user_id.in_(user_ids)),
+    ))
+    db.info["directory_changed"] = True
+
+
+def prune_changes(db: Session, retention_days: int = CHANGES_RETENTION_DAYS) -> int:
+    """Delete change log rows the feed no longer needs and return how many; the caller commits
+
+    A change followed by a later one for the same member is never read back.
+    Deletions are kept for retention_days; the newest one pruned becomes the
+    batch's horizon, and clients that last synced before it have to reload
+    the whole directory.
+    """
+    newer = aliased(DirectoryChange)
+    superseded = db.execute(
+        delete(DirectoryChange)
+        .where(exists().where(newer.member_id == DirectoryChange.member_id, newer.seq > DirectoryChange.seq))
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    cutoff = datetime.now(timezone.utc) - timedelta(days=retention_days)
+    expired = (DirectoryChange.op == "delete", DirectoryChange.created_at < cutoff)
+    pruned = db.execute(
+        select(DirectoryChange.batch, func.max(DirectoryChange.seq)).where(*expired).group_by(DirectoryChange.batch)
+    ).all()
+    for batch, seq in pruned:
+        horizon = db.get(DirectoryChangeHorizon, batch)
+        if horizon is None:
+            db.add(DirectoryChangeHorizon(batch=batch, seq=seq))
+        else:
+            horizon.seq = max(horizon.seq, seq)
+    removed = db.execute(
+        delete(DirectoryChange).where(*expired).execution_options(synchronize_session=False)
+    ).rowcount
+    return superseded + removed
+
+
+def changes_pruned_after(db: Session, batch: str, since: int) -> bool:
+    """Whether changes after since are missing from the batch's log, so reading from it would drop deletions
+
+    since=0 never is: a client starting from scratch has nothing to delete.
+    """
+    horizon = db.execute(
+        select(DirectoryChangeHorizon.seq).where(DirectoryChangeHorizon.batch == batch)
+    ).scalar()
+    return bool(since) and horizon is not None and since < horizon
+
+
+def ensure_directory(db: Session):
+    """Backfill the directory on first start after it was introduced"""
+    has_rows = db.execute(select(MemberDirectory.member_id).limit(1)).first()
+    has_members = db.execute(select(Member.id).limit(1)).first()
+    if has_members and not has_rows:
+        logger.info("Backfilling member directory")
+        refresh_directory(db)
+        db.commit()
+
+
+def rebuild():
+    from database import SessionLocal, engine
+    from models import Base
+
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        refresh_directory(db)
+        db.commit()
+        count = db.execute(select(func.count()).select_from(MemberDirectory)).scalar()
+        print(f"✓ Member directory rebuilt with {count} rows")
+    finally:
+        db.close()
+    prune()
+
+
+def prune():
+    from dependencies import session_scope
+
+    with session_scope() as db:
+        removed = prune_changes(db)
+        db.commit()
+    print(f"✓ Removed {removed} change log rows")
+
+
+if __name__ == "__main__":
+    commands = {"rebuild": rebuild, "prune": prune}
+    if len(sys.argv) != 2 or sys.argv[1] not in commands:
+        print(__doc__)
+        sys.exit(1)
+    commands[sys.argv[1]]()
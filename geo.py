@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Alumni map: offline geocoding and geohash clusters.
+
+``Member.city`` and ``Member.country`` are free text. They are normalized
+(case, accents, punctuation, suffixes such as "City" or "Cantt") and matched
+against the gazetteer bundled in ``data/gazetteer.csv``, with no network
+access. A member whose city is not in the gazetteer is placed at their
+country's centroid when the country is known.
+
+Each located member gets a row in ``member_locations`` with its coordinates
+and a geohash. Map clusters for a viewport are one GROUP BY over a geohash
+prefix whose length follows the zoom level. Write paths call
+``locate_members`` before committing; it only re-geocodes members whose city
+or country text actually changed.
+
+Usage:
+    python geo.py rebuild      # geocode every member
+    python geo.py unmatched    # city/country values the gazetteer does not know
+"""
+
+import csv
+import re
+import sys
+import unicodedata
+from collections import Counter
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import delete, func, insert, or_, select
+from sqlalchemy.orm import Session
+
+from config import GAZETTEER_PATH
+from models import Member, MemberLocation
+
+GEOHASH_PRECISION = 8
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+# Geohash length per map zoom level (Web Mercator zoom 0-20), roughly one cell per 60-120px tile area
+_ZOOM_PRECISION = [1, 1, 2, 2, 3, 3, 3, 4, 4, 5, 5, 5, 6, 6, 7, 7, 7, 8, 8, 8, 8]
+
+_SUFFIXES = re.compile(r"\b(city|district|cantt|cantonment|division|tehsil)\b")
+
+
+class Place(NamedTuple):
+    name: str
+    country: str
+    latitude: float
+    longitude: float
+    precision: str
+
+
+def normalize(value: Optional[str]) -> str:
+    """Lower-case, strip accents and punctuation, drop administrative suffixes"""
+    if not value:
+        return ""
+    value = unicodedata.normalize("NFKD", value)
+    value = "".join(c for c in value if not unicodedata.combining(c)).lower()
+    value = re.sub(r"[^a-z0-9\s]", " ", value.replace(".", ""))
+    value = _SUFFIXES.sub(" ", value)
+    return " ".join(value.split())
+
+
+class Gazetteer:
+    def __init__(self, path: str = GAZETTEER_PATH):
+        self.countries: Dict[str, Place] = {}
+        self.cities: Dict[str, List[Place]] = {}
+        with open(path, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                # Aliases that normalize to the same key as the name must not make the city ambiguous
+                names = dict.fromkeys(normalize(n) for n in [row["name"]] + (row["aliases"] or "").split("|") if n)
+                if row["kind"] == "country":
+                    place = Place(row["name"], row["name"], float(row["latitude"]), float(row["longitude"]), "country")
+                    for name in names:
+                        self.countries[name] = place
+                else:
+                    place = Place(row["name"], row["country"], float(row["latitude"]), float(row["longitude"]), "city")
+                    for name in names:
+                        self.cities.setdefault(name, []).append(place)
+
+    def locate(self, city: Optional[str], country: Optional[str]) -> Optional[Place]:
+        country_place = self.countries.get(normalize(country))
+        # "Lahore, Punjab" or "Lahore - Pakistan": try the whole value, then its first part
+        candidates = []
+        for key in dict.fromkeys([normalize(city), normalize(re.split(r"[,/\-(]", city or "")[0])]):
+            candidates = self.cities.get(key, [])
+            if candidates:
+                break
+        if country_place is not None:
+            candidates = [c for c in candidates if c.country == country_place.name]
+        if len(candidates) == 1:
+            return candidates[0]
+        return country_place
+
+
+_gazetteer: Optional[Gazetteer] = None
+
+
+def gazetteer() -> Gazetteer:
+    global _gazetteer
+    if _gazetteer is None:
+        _gazetteer = Gazetteer()
+    return _gazetteer
+
+
+def geohash(latitude: float, longitude: float, precision: int = GEOHASH_PRECISION) -> str:
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, bit_count, even = [], 0, 0, True
+    while len(chars) < precision:
+        target, value = (lon_range, longitude) if even else (lat_range, latitude)
+        mid = (target[0] + target[1]) / 2
+        bits <<= 1
+        if value >= mid:
+            bits |= 1
+            target[0] = mid
+        else:
+            target[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_BASE32[bits])
+            bits, bit_count = 0, 0
+    return "".join(chars)
+
+
+def _source_key(city: Optional[str], country: Optional[str]) -> str:
+    return f"{normalize(city)}|{normalize(country)}"
+
+
+def locate_members(db: Session, member_ids: Optional[Iterable[str]] = None) -> int:
+    """Geocode the given members (all if None) whose location text changed; the caller commits"""
+    db.flush()
+    query = select(Member.id, Member.batch, Member.city, Member.country, MemberLocation.source_key).outerjoin(
+        MemberLocation, MemberLocation.member_id == Member.id
+    )
+    if member_ids is not None:
+        query = query.where(Member.id.in_(list(member_ids)))
+
+    rows = []
+    for member_id, batch, city, country, current_key in db.execute(query):
+        source_key = _source_key(city, country)
+        if source_key == current_key:
+            continue
+        place = gazetteer().locate(city, country)
+        rows.append({
+            "member_id": member_id,
+            "batch": batch,
+            "source_key": source_key,
+            "place": place.name if place else None,
+            "country": place.country if place else None,
+            "precision": place.precision if place else "none",
+            "latitude": place.latitude if place else None,
+            "longitude": place.longitude if place else None,
+            "geohash": geohash(place.latitude, place.longitude) if place else None,
+        })
+    if rows:
+        db.execute(delete(MemberLocation).where(MemberLocation.member_id.in_([r["member_id"] for r in rows])))
+        db.execute(insert(MemberLocation), rows)
+    return len(rows)
+
+
+def zoom_precision(zoom: int) -> int:
+    return _ZOOM_PRECISION[max(0, min(zoom, len(_ZOOM_PRECISION) - 1))]
+
+
+def clusters(db: Session, batch: str, zoom: int, bbox: Optional[Tuple[float, float, float, float]] = None) -> List[dict]:
+    """A batch's member counts per geohash cell at the zoom's precision, optionally inside (west, south, east, north)"""
+    cell = func.substr(MemberLocation.geohash, 1, zoom_precision(zoom)).label("cell")
+    query = select(
+        cell,
+        func.count().label("count"),
+        func.avg(MemberLocation.latitude).label("lat"),
+        func.avg(MemberLocation.longitude).label("lon"),
+    ).where(MemberLocation.batch == batch, MemberLocation.geohash.is_not(None))
+    if bbox is not None:
+        west, south, east, north = bbox
+        query = query.where(MemberLocation.latitude.between(south, north))
+        if west <= east:
+            query = query.where(MemberLocation.longitude.between(west, east))
+        else:  # viewport crosses the antimeridian
+            query = query.where(or_(MemberLocation.longitude >= west, MemberLocation.longitude <= east))
+    rows = db.execute(query.group_by(cell).order_by(cell)).mappings()
+    return [
+        {"geohash": r["cell"], "count": r["count"], "lat": round(r["lat"], 5), "lon": round(r["lon"], 5)}
+        for r in rows
+    ]
+
+
+def ensure_locations(db: Session):
+    """Geocode members that predate the map, on first start after it was introduced"""
+    missing = db.execute(
+        select(Member.id).outerjoin(MemberLocation, MemberLocation.member_id == Member.id)
+        .where(MemberLocation.member_id.is_(None)).limit(1)
+    ).first()
+    if missing:
+        locate_members(db)
+        db.commit()
+
+
+def rebuild():
+    from database import engine
+    from dependencies import session_scope
+    from models import Base
+
+    Base.metadata.create_all(bind=engine)
+    with session_scope() as db:
+        db.execute(delete(MemberLocation))
+        count = locate_members(db)
+        db.commit()
+        located = db.execute(
+            select(MemberLocation.precision, func.count()).group_by(MemberLocation.precision)
+        ).all()
+    print(f"✓ Geocoded {count} members: " + ", ".join(f"{n} {p}" for p, n in sorted(located)))
+
+
+def unmatched():
+    from dependencies import session_scope
+
+    with session_scope() as db:
+        rows = db.execute(
+            select(Member.city, Member.country)
+            .join(MemberLocation, MemberLocation.member_id == Member.id)
+            .where(MemberLocation.precision != "city")
+        ).all()
+    for (city, country), count in Counter(rows).most_common():
+        print(f"{count:6}  {city} / {country}")
+
+
+if __name__ == "__main__":
+    commands = {"rebuild": rebuild, "unmatched": unmatched}
+    if len(sys.argv) != 2 or sys.argv[1] not in commands:
+        print(__doc__)
+        sys.exit(1)
+    commands[sys.argv[1]]()
@@ -0,0 +1,57 @@
+"""
+Idempotency-Key support for write endpoints.
+
+The first request with a given key stores its response in the same
+transaction as the write itself. Retries with the same key and payload get
+that stored response back without redoing any work; reusing a key for a
+different payload is rejected.
+"""
+
+import hashlib
+import json
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+from sqlalchemy.orm import Session
+
+from config import IDEMPOTENCY_KEY_TTL_HOURS
+from models import IdempotencyKey
+
+REPLAYED_HEADER = "Idempotent-Replayed"
+
+
+def fingerprint(payload: dict, exclude=()) -> str:
+    """Stable hash of a request payload, leaving out secrets such as passwords"""
+    data = {k: v for k, v in payload.items() if k not in exclude}
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def _expired(record: IdempotencyKey) -> bool:
+    if record.created_at is None:
+        return False
+    created_at = record.created_at
+    if created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    return created_at < datetime.now(timezone.utc) - timedelta(hours=IDEMPOTENCY_KEY_TTL_HOURS)
+
+
+def replay(db: Session, key: str, request_hash: str) -> Optional[JSONResponse]:
+    """Return the stored response for key, or None if the request has not been seen"""
+    record = db.get(IdempotencyKey, key)
+    if record is None:
+        return None
+    if _expired(record):
+        # Deleted together with the new write's commit
+        db.delete(record)
+        db.flush()
+        return None
+    if record.request_hash != request_hash:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+    return JSONResponse(content=json.loads(record.response_body), headers={REPLAYED_HEADER: "true"})
+
+
+def store(db: Session, key: str, request_hash: str, response_json: str):
+    """Stage the response for key; it is committed with the caller's transaction"""
+    db.add(IdempotencyKey(key=key, request_hash=request_hash, response_body=response_json))
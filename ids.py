@@ -0,0 +1,92 @@
+"""
+Time-ordered primary keys.
+
+New rows get UUIDv7 ids (RFC 9562): a 48-bit millisecond timestamp followed by
+random bits. Ids created later sort later, both as 128-bit values and in
+their canonical text form, so inserts append to the right edge of the
+primary key index instead of landing on random pages, and an id works as a
+keyset cursor (``WHERE id > :last_seen ORDER BY id``).
+
+``IdType`` stores ids as native ``uuid`` (16 bytes) on PostgreSQL and as
+canonical text elsewhere; either way the application sees plain strings.
+"""
+
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Optional
+
+from sqlalchemy import String
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.types import TypeDecorator
+
+_lock = threading.Lock()
+_last_ms = 0
+_counter = 0
+
+
+def uuid7(timestamp_ms: Optional[int] = None) -> uuid.UUID:
+    """UUIDv7; ids from this process are strictly increasing, even within one millisecond"""
+    global _last_ms, _counter
+    if timestamp_ms is not None:
+        ms, rand_a = timestamp_ms, int.from_bytes(os.urandom(2), "big") & 0xFFF
+    else:
+        with _lock:
+            ms = time.time_ns() // 1_000_000
+            if ms <= _last_ms:
+                # Same millisecond (or the clock stepped back): keep ordering with the 12-bit counter
+                ms = _last_ms
+                _counter += 1
+                if _counter > 0xFFF:
+                    ms += 1
+                    _counter = 0
+            else:
+                _counter = int.from_bytes(os.urandom(2), "big") & 0x7FF  # leave headroom for increments
+            _last_ms = ms
+            rand_a = _counter
+    rand_b = int.from_bytes(os.urandom(8), "big") & ((1 << 62) - 1)
+    value = (ms & ((1 << 48) - 1)) << 80 | 0x7 << 76 | rand_a << 64 | 0b10 << 62 | rand_b
+    return uuid.UUID(int=value)
+
+
+def new_id() -> str:
+    return str(uuid7())
+
+
+def id_for_time(moment: datetime) -> str:
+    """A UUIDv7 placed at moment, for rekeying existing rows in creation order"""
+    if moment.tzinfo is None:
+        # SQLite hands back naive UTC datetimes
+        moment = moment.replace(tzinfo=timezone.utc)
+    return str(uuid7(int(moment.timestamp() * 1000)))
+
+
+def id_timestamp(value: str) -> Optional[datetime]:
+    """Creation time encoded in a UUIDv7 id, None for other id versions"""
+    parsed = uuid.UUID(value)
+    if parsed.version != 7:
+        return None
+    return datetime.fromtimestamp((parsed.int >> 80) / 1000, timezone.utc)
+
+
+class IdType(TypeDecorator):
+    """String ids, kept in a native uuid column where the database has one"""
+
+    impl = String
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == "postgresql":
+            return dialect.type_descriptor(UUID(as_uuid=False))
+        return dialect.type_descriptor(String(36))
+
+    def process_bind_param(self, value, dialect):
+        if value is None or dialect.name != "postgresql":
+            return value
+        try:
+            return str(uuid.UUID(str(value)))
+        except ValueError:
+            # A malformed id from a URL matches nothing rather than failing the query
+            return str(uuid.UUID(int=0))
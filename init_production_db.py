@@ -9,7 +9,7 @@ import sys
 from database import engine, SessionLocal
 from models import Base, User, Member
 from user import get_password_hash
-import uuid
+from ids import new_id
 
 def init_database():
     """Initialize database tables"""
@@ -50,7 +50,7 @@ def create_default_admin():
             return True
         
         # Create default admin user
-        admin_id = str(uuid.uuid4())
+        admin_id = new_id()
         admin_user = User(
             id=admin_id,
             username="admin",
@@ -62,7 +62,7 @@ def create_default_admin():
         db.add(admin_user)
         
         # Create corresponding member profile
-        member_id = str(uuid.uuid4())
+        member_id = new_id()
         admin_member = Member(
             id=member_id,
             user_id=admin_id,
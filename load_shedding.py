@@ -0,0 +1,219 @@
+"""
+Adaptive concurrency limits, load shedding and the readiness probe.
+
+Requests are grouped into route classes (password logins, directory reads,
+uploads, admin, everything else), and each class gets its own limit on
+requests in flight, so a login storm queues behind its own limit instead
+of starving directory reads. Limits adapt AIMD-style: while a class's
+requests finish under its ``target_ms``, the limit grows by about one per
+limit's worth of completions. When they run slower, it shrinks by 10%, at
+most once per target interval. A class without a ``target_ms`` keeps a
+fixed limit.
+
+A request over its class limit gets 503 with ``Retry-After`` right away
+instead of waiting for a worker. Low-priority classes are also shed once
+the whole process has ``CONCURRENCY_SHED_LOW_PRIORITY_AT`` of
+``CONCURRENCY_GLOBAL_LIMIT`` requests in flight.
+
+``GET /ready`` reports the limits and request coalescing counts with the
+database pool, worker thread and background job queue state, and answers
+503 while any of them is saturated, so a load balancer can route around a
+struggling instance.
+``GET /health`` stays a plain liveness check.
+"""
+
+import asyncio
+import logging
+import math
+import re
+import time
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from anyio import to_thread
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import func, select
+from starlette.responses import JSONResponse
+
+import coalesce
+from config import (
+    CONCURRENCY_CLASSES,
+    CONCURRENCY_GLOBAL_LIMIT,
+    CONCURRENCY_LIMIT_ENABLED,
+    CONCURRENCY_RETRY_AFTER_SECONDS,
+    CONCURRENCY_SHED_LOW_PRIORITY_AT,
+    READY_DB_TIMEOUT_SECONDS,
+    READY_MAX_PENDING_JOBS,
+    READY_POOL_SATURATION,
+)
+
+logger = logging.getLogger(__name__)
+
+# First match wins; paths matching none fall into "default"
+ROUTE_CLASSES = [
+    ("auth", {"POST"}, re.compile(r"^/api/users/(token|register|refresh)$")),
+    ("uploads", None, re.compile(r"^/api/upload/")),
+    ("admin", None, re.compile(r"/admin/")),
+    ("directory", {"GET", "HEAD"}, re.compile(r"^/api/(members|users/profile|users/me)")),
+]
+
+# Probes, static files and long-lived streams are never limited
+EXEMPT_PATHS = re.compile(r"^/(health|ready|uploads/)|^/api/members/changes/stream")
+
+
+class AdaptiveLimit:
+    """AIMD limit on concurrent requests for one route class"""
+
+    def __init__(self, name: str, initial: int, min: int, max: int,
+                 target_ms: Optional[float] = None, priority: str = "high", backoff: float = 0.9):
+        self.name = name
+        self.limit = float(initial)
+        self.min_limit = min
+        self.max_limit = max
+        self.target_ms = target_ms
+        self.priority = priority
+        self.backoff = backoff
+        self.in_flight = 0
+        self.latency_ms = 0.0
+        self.accepted = 0
+        self.rejected = 0
+        self._last_decrease = 0.0
+
+    def try_acquire(self) -> bool:
+        if self.in_flight >= int(self.limit):
+            self.rejected += 1
+            return False
+        self.in_flight += 1
+        self.accepted += 1
+        return True
+
+    def release(self, latency_ms: float):
+        was_busy = self.in_flight >= self.limit / 2
+        self.in_flight -= 1
+        self.latency_ms = latency_ms if not self.latency_ms else 0.9 * self.latency_ms + 0.1 * latency_ms
+        if self.target_ms is None:
+            return
+        now = time.monotonic()
+        if latency_ms > self.target_ms:
+            # One decrease per target interval, not one per slow request finishing together
+            if now - self._last_decrease >= self.target_ms / 1000:
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+                self._last_decrease = now
+                logger.debug("Concurrency limit lowered", extra={"route_class": self.name, "limit": int(self.limit)})
+        elif was_busy:
+            # Only grow a limit that is actually being used
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def snapshot(self) -> dict:
+        return {
+            "limit": int(self.limit),
+            "inFlight": self.in_flight,
+            "latencyMs": round(self.latency_ms, 1),
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "priority": self.priority,
+        }
+
+
+route_limits: Dict[str, AdaptiveLimit] = {
+    name: AdaptiveLimit(name, **settings) for name, settings in CONCURRENCY_CLASSES.items()
+}
+
+
+def classify(method: str, path: str) -> Optional[str]:
+    """Route class for a request, None when it is exempt"""
+    if EXEMPT_PATHS.match(path):
+        return None
+    for name, methods, pattern in ROUTE_CLASSES:
+        if (methods is None or method in methods) and pattern.search(path) and name in route_limits:
+            return name
+    return "default" if "default" in route_limits else None
+
+
+def _total_in_flight(limits: Dict[str, AdaptiveLimit]) -> int:
+    return sum(limit.in_flight for limit in limits.values())
+
+
+class AdaptiveConcurrencyMiddleware:
+    """ASGI middleware enforcing the per-class limits; all state lives on the event loop thread"""
+
+    def __init__(self, app, limits: Optional[Dict[str, AdaptiveLimit]] = None,
+                 global_limit: int = CONCURRENCY_GLOBAL_LIMIT, enabled: bool = CONCURRENCY_LIMIT_ENABLED):
+        self.app = app
+        self.limits = route_limits if limits is None else limits
+        self.shed_low_priority_at = global_limit * CONCURRENCY_SHED_LOW_PRIORITY_AT
+        self.enabled = enabled
+
+    async def __call__(self, scope, receive, send):
+        name = classify(scope["method"], scope["path"]) if self.enabled and scope["type"] == "http" else None
+        if name is None:
+            await self.app(scope, receive, send)
+            return
+
+        limit = self.limits[name]
+        shed = limit.priority == "low" and _total_in_flight(self.limits) >= self.shed_low_priority_at
+        if shed:
+            limit.rejected += 1
+        if shed or not limit.try_acquire():
+            response = JSONResponse(
+                {"detail": "Server busy, retry later"},
+                status_code=503,
+                headers={"Retry-After": str(CONCURRENCY_RETRY_AFTER_SECONDS)},
+            )
+            await response(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limit.release((time.perf_counter() - started) * 1000)
+
+
+def _database_state() -> dict:
+    from database import engine
+    from models import BackgroundJob
+
+    with engine.connect() as connection:
+        # Jobs that are due but not picked up yet, not ones scheduled for later
+        due = connection.execute(
+            select(func.count()).select_from(BackgroundJob)
+            .where(BackgroundJob.status == "pending", BackgroundJob.run_after <= datetime.now(timezone.utc))
+        ).scalar()
+    return {"dueJobs": due}
+
+
+async def readiness() -> dict:
+    """Saturation report for GET /ready; status is "ready" or "saturated" with the reasons"""
+    from database import engine
+
+    reasons = []
+    pool = engine.pool
+    report = {
+        "routeClasses": {name: limit.snapshot() for name, limit in route_limits.items()},
+        "coalescing": coalesce.snapshot(),
+    }
+
+    if hasattr(pool, "size"):
+        capacity = pool.size() + max(pool._max_overflow, 0)
+        report["pool"] = {"checkedOut": pool.checkedout(), "capacity": capacity}
+        if pool.checkedout() >= math.ceil(capacity * READY_POOL_SATURATION):
+            reasons.append("database pool saturated")
+
+    threads = to_thread.current_default_thread_limiter().statistics()
+    report["threads"] = {"busy": threads.borrowed_tokens, "total": threads.total_tokens, "waiting": threads.tasks_waiting}
+    if threads.tasks_waiting > threads.total_tokens:
+        reasons.append("worker threads saturated")
+
+    try:
+        report.update(await asyncio.wait_for(run_in_threadpool(_database_state), READY_DB_TIMEOUT_SECONDS))
+        if report["dueJobs"] > READY_MAX_PENDING_JOBS:
+            reasons.append("background job backlog")
+    except asyncio.TimeoutError:
+        reasons.append("database check timed out")
+    except Exception as e:
+        reasons.append(f"database unavailable: {type(e).__name__}")
+
+    report["status"] = "saturated" if reasons else "ready"
+    report["reasons"] = reasons
+    return report
@@ -1,35 +1,81 @@
 from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from fastapi.staticfiles import StaticFiles
 import os
+import logging
 import shutil
-from datetime import datetime
 import uuid
-from user import router as user_router, oauth2_scheme
+from sqlalchemy.orm import Session
+from user import router as user_router
 from member import router as member_router
-from config import CORS_ORIGINS, UPLOAD_DIR, AVATAR_DIR
+from resumable import router as resumable_router, replace_avatar
+from config import CORS_ORIGINS, UPLOAD_DIR, AVATAR_DIR, TASKS_INLINE_WORKER
 from startup import startup
+from database import engine
+from dependencies import get_db, oauth2_scheme
+from pool_monitor import install_pool_monitor
+from profiling import ProfilingMiddleware, ProfilingRoute, install_query_listener
+from logging_config import setup_logging, shutdown_logging, RequestContextMiddleware
+from compression import CompressionMiddleware
+from rate_limit import RateLimitMiddleware
+from load_shedding import AdaptiveConcurrencyMiddleware, readiness
+import tasks
+from tenancy import avatar_dir, avatar_filename, get_batch
+
+setup_logging()
+logger = logging.getLogger(__name__)
 
 app = FastAPI(title="PBG87 Backend API", version="1.0.0")
+app.router.route_class = ProfilingRoute
 
 @app.on_event("startup")
 async def startup_event():
     startup()
+    if TASKS_INLINE_WORKER:
+        tasks.inline_worker.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await tasks.inline_worker.stop()
+    shutdown_logging()
 
 # Get CORS origins from config
 cors_origins_list = [origin.strip() for origin in CORS_ORIGINS.split(",")]
-print(f"CORS Origins List: {cors_origins_list}")
+logger.debug("CORS origins configured", extra={"cors_origins": cors_origins_list})
+
+# Per route class concurrency limits, shedding with 503 under overload; innermost,
+# so rate-limited requests never take a slot
+app.add_middleware(AdaptiveConcurrencyMiddleware)
+
+# Reject over-limit requests before any DB or bcrypt work; added early so that
+# 429 responses still pass through CORS
+app.add_middleware(RateLimitMiddleware)
 
 # Allow CORS for frontend
 app.add_middleware(
     CORSMiddleware,
     allow_origins=cors_origins_list,
     allow_credentials=True,
-    allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
+    allow_methods=["GET", "POST", "PUT", "PATCH", "HEAD", "DELETE", "OPTIONS"],
     allow_headers=["*", "Content-Type", "Authorization", "X-Requested-With"],
-    expose_headers=["*"],
+    # Browsers only hand credentialed responses' headers to scripts when they are named
+    expose_headers=["*", "Location", "Tus-Resumable", "Upload-Offset", "Upload-Length", "Upload-Expires", "Avatar-Url"],
 )
 
+# Compress JSON responses, static uploads are served as-is
+app.add_middleware(CompressionMiddleware)
+
+# Sampled per-request profiling and slow-query capture
+app.add_middleware(ProfilingMiddleware)
+install_query_listener(engine)
+
+# Warn, with the checkout stack, about connections held past POOL_CHECKOUT_WARN_SECONDS
+install_pool_monitor(engine)
+
+# Request IDs and structured access logging
+app.add_middleware(RequestContextMiddleware)
+
 # Create uploads directory if it doesn't exist
 os.makedirs(AVATAR_DIR, exist_ok=True)
 
@@ -44,20 +90,28 @@ def read_root():
 def health_check():
     return {"status": "healthy", "message": "Backend is operational"}
 
+@app.get("/ready")
+async def readiness_check():
+    """Readiness probe: 503 while the database pool, worker threads or job queue are saturated"""
+    report = await readiness()
+    return JSONResponse(report, status_code=200 if report["status"] == "ready" else 503)
+
 # Include API routes
 app.include_router(user_router, prefix="/api/users", tags=["users"])
 app.include_router(member_router, prefix="/api/members", tags=["members"])
+app.include_router(resumable_router, prefix="/api/upload/avatar/resumable", tags=["uploads"])
 
 
 
 @app.post("/api/upload/avatar")
-async def upload_avatar(
+def upload_avatar(
     file: UploadFile = File(...),
-    token: str = Depends(oauth2_scheme)
+    token: str = Depends(oauth2_scheme),
+    batch: str = Depends(get_batch),
+    db: Session = Depends(get_db)
 ):
     """Upload avatar for the authenticated user"""
     from user import decode_access_token, get_user_by_username
-    from member import get_db
     from models import Member
     
     # Validate file type
@@ -69,9 +123,8 @@ async def upload_avatar(
         raise HTTPException(status_code=400, detail="File size must be less than 5MB")
     
     # Get user from token
-    username = decode_access_token(token)
-    db = next(get_db())
-    user = get_user_by_username(db, username)
+    username = decode_access_token(token, batch)
+    user = get_user_by_username(db, username, batch)
     if not user:
         raise HTTPException(status_code=401, detail="Invalid token")
     
@@ -80,19 +133,19 @@ async def upload_avatar(
     if not member:
         raise HTTPException(status_code=404, detail="Member profile not found")
     
-    # Generate unique filename
+    # Generate unique filename, each batch's avatars live in their own directory
     file_extension = os.path.splitext(file.filename)[1]
-    unique_filename = f"{user.id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}{file_extension}"
-    file_path = os.path.join(AVATAR_DIR, unique_filename)
+    unique_filename = avatar_filename(user.id, file_extension)
+    os.makedirs(avatar_dir(batch), exist_ok=True)
+    file_path = os.path.join(avatar_dir(batch), unique_filename)
     
     try:
         # Save file
         with open(file_path, "wb") as buffer:
             shutil.copyfileobj(file.file, buffer)
         
-        # Update member's avatar_url
-        member.avatar_url = f"/uploads/avatars/{unique_filename}"
-        db.commit()
+        # Update member's avatar_url, the replaced file is removed once this commits
+        replace_avatar(db, member, f"/uploads/avatars/{batch}/{unique_filename}", batch)
         
         return {
             "message": "Avatar uploaded successfully",
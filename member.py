@@ -1,31 +1,116 @@
-from models import Member, User
+from models import Member, User, MemberDirectory, DirectoryChange, MemberLocation
 from schemas import MemberCreate, Member as MemberSchema
-from database import SessionLocal
-from fastapi import APIRouter, Depends, HTTPException, Body
+from dependencies import get_db, oauth2_scheme, optional_oauth2_scheme, session_scope
+from fastapi import APIRouter, Depends, HTTPException, Body, Header, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlalchemy import func, select
 from sqlalchemy.orm import Session
-from typing import List, Dict, Any
-import uuid
-from fastapi.security import OAuth2PasswordBearer
+from typing import List, Dict, Any, Optional, Tuple
+import asyncio
+import json
+from ids import new_id
+import logging
+from pydantic import BaseModel
 from user import decode_access_token
+from config import MEMBER_BATCH_MAX_IDS, CHANGES_PAGE_SIZE, CHANGES_HEARTBEAT_SECONDS, SNAPSHOT_CACHE_TTL_SECONDS
+from profiling import ProfilingRoute
+from cache import directory_cache, encode_json
+import coalesce
+from directory import changes_pruned_after, refresh_directory, change_notifier
+from geo import clusters, locate_members
+import snapshot
+import tasks
+from tenancy import get_batch
 
-router = APIRouter(tags=["members"])
+router = APIRouter(tags=["members"], route_class=ProfilingRoute)
+logger = logging.getLogger(__name__)
 
-# Dependency
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+# Concurrent identical reads share one query and encoded body, see coalesce.py
+list_flights = coalesce.group("members.list")
+batch_flights = coalesce.group("members.batch")
+changes_flights = coalesce.group("members.changes")
+snapshot_flights = coalesce.group("members.snapshot")
+map_flights = coalesce.group("members.map")
+detail_flights = coalesce.group("members.detail")
+admin_flights = coalesce.group("members.admin")
+
+JSON_MEDIA_TYPE = "application/json"
+
+# Directory fields as exposed by the API, mapped to the member_directory columns they are read from
+MEMBER_FIELDS = {
+    "id": MemberDirectory.member_id,
+    "registrationNumber": MemberDirectory.registration_number,
+    "department": MemberDirectory.department,
+    "address": MemberDirectory.address,
+    "city": MemberDirectory.city,
+    "country": MemberDirectory.country,
+    "phone": MemberDirectory.phone,
+    "avatarUrl": MemberDirectory.avatar_url,
+    "bio": MemberDirectory.bio,
+    "isProfileComplete": MemberDirectory.is_profile_complete,
+    "createdAt": MemberDirectory.created_at,
+    "updatedAt": MemberDirectory.updated_at,
+}
+USER_FIELDS = {
+    "id": MemberDirectory.user_id,
+    "name": MemberDirectory.name,
+    "username": MemberDirectory.username,
+    "email": MemberDirectory.email,
+    "role": MemberDirectory.role,
+    "createdAt": MemberDirectory.user_created_at,
+    "updatedAt": MemberDirectory.user_updated_at,
+}
+
+# Named projections for the directory listing; "full" is the historical response shape
+PROJECTIONS = {
+    "card": ("id", "department", "city", "avatarUrl", "user.id", "user.name"),
+    "full": tuple(MEMBER_FIELDS) + ("user.id", "user.name", "user.username", "user.email", "user.role", "user.createdAt"),
+}
+PROJECTIONS["admin"] = PROJECTIONS["full"] + ("user.updatedAt",)
+
+def resolve_fields(view: str, fields: Optional[str]) -> Tuple[str, ...]:
+    """Turn a fields= list or a named view into a tuple of field paths"""
+    if fields:
+        requested = tuple(dict.fromkeys(f.strip() for f in fields.split(",") if f.strip()))
+        for field in requested:
+            group, _, name = field.rpartition(".")
+            allowed = {"": MEMBER_FIELDS, "user": USER_FIELDS}.get(group)
+            if allowed is None or name not in allowed:
+                raise HTTPException(status_code=400, detail=f"Unknown field: {field}")
+        return requested
+    if view not in PROJECTIONS:
+        raise HTTPException(status_code=400, detail=f"Unknown view: {view}")
+    return PROJECTIONS[view]
 
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/users/token")
+def select_directory(fields: Tuple[str, ...]):
+    """SELECT only the columns behind the requested fields from the denormalized directory"""
+    columns = []
+    for field in fields:
+        if field.startswith("user."):
+            columns.append(USER_FIELDS[field[5:]].label(field))
+        else:
+            columns.append(MEMBER_FIELDS[field].label(field))
+    return select(*columns).select_from(MemberDirectory)
+
+def serialize_directory_row(row, fields: Tuple[str, ...]) -> dict:
+    item = {}
+    for field in fields:
+        if field.startswith("user."):
+            item.setdefault("user", {})[field[5:]] = row[field]
+        else:
+            item[field] = row[field]
+    return item
 
 @router.post("/", response_model=MemberSchema)
-def create_member(member: MemberCreate, db: Session = Depends(get_db)):
-    member_id = str(uuid.uuid4())
-    db_member = Member(id=member_id, **member.dict())
+def create_member(member: MemberCreate, batch: str = Depends(get_batch), db: Session = Depends(get_db)):
+    member_id = new_id()
+    db_member = Member(id=member_id, batch=batch, **member.dict())
     db.add(db_member)
+    refresh_directory(db, member_ids=[member_id])
+    locate_members(db, member_ids=[member_id])
     db.commit()
+    directory_cache.scoped(batch).invalidate()
     db.refresh(db_member)
     return db_member
 
@@ -33,59 +118,316 @@ def create_member(member: MemberCreate, db: Session = Depends(get_db)):
 def read_members(
     skip: int = 0, 
     limit: int = 100, 
+    view: str = "full",
+    fields: Optional[str] = None,
+    q: Optional[str] = None,
+    after: Optional[str] = None,
     token: str = Depends(oauth2_scheme),
+    batch: str = Depends(get_batch),
     db: Session = Depends(get_db)
 ):
-    """Get all members with their user information (authenticated users only)"""
+    """Get all members with their user information (authenticated users only)
+
+    Use view=card|full|admin for a named projection, or fields= with a comma
+    separated list such as ``id,city,user.name`` to select individual fields.
+    q= matches name, username, registration number, department, city and country.
+    after= takes the id of the last member on the previous page and returns the
+    next page in id (creation) order, which stays fast however deep the page is.
+    """
     # Verify authentication
-    username = decode_access_token(token)
-    current_user = db.query(User).filter(User.username == username).first()
+    username = decode_access_token(token, batch)
+    current_user = db.query(User).filter(User.batch == batch, User.username == username).first()
     if not current_user:
         raise HTTPException(status_code=401, detail="Invalid authentication")
     
-    # Get all members
-    members = db.query(Member).offset(skip).limit(limit).all()
+    selected = resolve_fields(view, fields)
+    if not fields and view == "admin" and current_user.role != "ADMIN":
+        raise HTTPException(status_code=403, detail="Admin access required")
     
-    result = []
-    for member in members:
-        user = db.query(User).filter(User.id == member.user_id).first()
-        if user:
-            result.append({
-                "id": member.id,
-                "registrationNumber": member.registration_number,
-                "department": member.department,
-                "address": member.address,
-                "city": member.city,
-                "country": member.country,
-                "phone": member.phone,
-                "avatarUrl": member.avatar_url,
-                "bio": member.bio,
-                "isProfileComplete": member.is_profile_complete,
-                "createdAt": member.created_at,
-                "updatedAt": member.updated_at,
-                "user": {
-                    "id": user.id,
-                    "name": user.name,
-                    "username": user.username,
-                    "email": user.email,
-                    "role": user.role,
-                    "createdAt": user.created_at
-                }
-            })
+    # Pages are identical for every authenticated user of a batch, serve them from the batch's cache
+    cache = directory_cache.scoped(batch)
+    cache_key = cache.key(skip, limit, ",".join(selected), q or "", after or "")
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return Response(content=cached, media_type=JSON_MEDIA_TYPE, headers={"X-Cache": "HIT"})
     
-    return result
+    def fetch() -> bytes:
+        # Only the columns behind the selected fields are loaded, from a single table
+        query = select_directory(selected).where(MemberDirectory.batch == batch)
+        if q:
+            query = query.where(MemberDirectory.search_text.contains(q.lower(), autoescape=True))
+        if after is not None:
+            # Ids are time-ordered, so the primary key index serves this as a range scan
+            query = query.where(MemberDirectory.member_id > after).order_by(MemberDirectory.member_id)
+        rows = db.execute(query.offset(skip).limit(limit)).mappings()
+        return cache.set(cache_key, [serialize_directory_row(row, selected) for row in rows])
+    
+    body = list_flights.do(cache_key, fetch, db)
+    return Response(content=body, media_type=JSON_MEDIA_TYPE, headers={"X-Cache": "MISS"})
 
-@router.get("/{member_id}", response_model=dict)
-def read_member(member_id: str, db: Session = Depends(get_db)):
-    """Get a specific member with user information"""
-    member = db.query(Member).filter(Member.id == member_id).first()
-    if not member:
-        raise HTTPException(status_code=404, detail="Member not found")
+class MemberBatchRequest(BaseModel):
+    ids: List[str]
+    id_type: str = "member"  # "member" or "user"
+    view: str = "full"
+    fields: Optional[str] = None
+
+@router.post("/batch", response_model=Dict[str, dict])
+def read_members_batch(
+    request: MemberBatchRequest,
+    token: Optional[str] = Depends(optional_oauth2_scheme),
+    batch: str = Depends(get_batch),
+    db: Session = Depends(get_db)
+):
+    """Resolve many members by member or user ID in one query, keyed by the requested ID
+
+    view=admin needs an admin token, as on the directory listing.
+    """
+    if request.id_type not in ("member", "user"):
+        raise HTTPException(status_code=400, detail="id_type must be 'member' or 'user'")
+    if not request.fields and request.view == "admin":
+        if not token:
+            raise HTTPException(status_code=401, detail="Not authenticated", headers={"WWW-Authenticate": "Bearer"})
+        if require_user(token, batch, db).role != "ADMIN":
+            raise HTTPException(status_code=403, detail="Admin access required")
+    ids = list(dict.fromkeys(request.ids))
+    if len(ids) > MEMBER_BATCH_MAX_IDS:
+        raise HTTPException(status_code=400, detail=f"At most {MEMBER_BATCH_MAX_IDS} ids per request")
+    if not ids:
+        return {}
     
-    user = db.query(User).filter(User.id == member.user_id).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
+    selected = resolve_fields(request.view, request.fields)
+    key_column = MemberDirectory.member_id if request.id_type == "member" else MemberDirectory.user_id
+    query = (
+        select_directory(selected)
+        .add_columns(key_column.label("_key"))
+        .where(MemberDirectory.batch == batch, key_column.in_(ids))
+    )
+    
+    def fetch() -> bytes:
+        return encode_json({row["_key"]: serialize_directory_row(row, selected) for row in db.execute(query).mappings()})
     
+    flight_key = directory_cache.scoped(batch).key("batch", request.id_type, ",".join(selected), ",".join(sorted(ids)))
+    return Response(content=batch_flights.do(flight_key, fetch, db), media_type=JSON_MEDIA_TYPE)
+
+def require_user(token: str, batch: str, db: Session) -> User:
+    username = decode_access_token(token, batch)
+    user = db.query(User).filter(User.batch == batch, User.username == username).first()
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid authentication")
+    return user
+
+def require_retained_changes(db: Session, batch: str, since: int):
+    """410 when changes after since were pruned from the log, the client has to reload the directory"""
+    if changes_pruned_after(db, batch, since):
+        raise HTTPException(status_code=410, detail="Changes since this point were pruned, reload the directory")
+
+def fetch_changes(db: Session, batch: str, since: int, limit: int) -> List[dict]:
+    """A batch's changes after sequence number since, each with the member's current full projection"""
+    fields = PROJECTIONS["full"]
+    query = (
+        select_directory(fields)
+        .add_columns(DirectoryChange.seq, DirectoryChange.op, DirectoryChange.member_id.label("_member_id"))
+        .select_from(DirectoryChange)
+        .outerjoin(MemberDirectory, MemberDirectory.member_id == DirectoryChange.member_id)
+        .where(DirectoryChange.batch == batch, DirectoryChange.seq > since)
+        .order_by(DirectoryChange.seq)
+        .limit(limit)
+    )
+    changes = []
+    for row in db.execute(query).mappings():
+        # A later delete may already have removed the row an earlier upsert refers to
+        present = row["op"] == "upsert" and row["id"] is not None
+        changes.append({
+            "seq": row["seq"],
+            "op": "upsert" if present else "delete",
+            "memberId": row["_member_id"],
+            "member": serialize_directory_row(row, fields) if present else None,
+        })
+    return changes
+
+def _fetch_changes_in_new_session(batch: str, since: int) -> List[dict]:
+    with session_scope() as db:
+        return fetch_changes(db, batch, since, CHANGES_PAGE_SIZE)
+
+@router.get("/changes", response_model=dict)
+def read_changes(
+    since: int = 0,
+    limit: int = CHANGES_PAGE_SIZE,
+    token: str = Depends(oauth2_scheme),
+    batch: str = Depends(get_batch),
+    db: Session = Depends(get_db)
+):
+    """Directory changes after sequence number since, for clients keeping a local copy in sync
+
+    Start from since=0 (or a full listing) and pass back lastSeq to poll for more.
+    A since older than the change log retention answers 410: reload and start over.
+    """
+    require_user(token, batch, db)
+    require_retained_changes(db, batch, since)
+    limit = max(1, min(limit, CHANGES_PAGE_SIZE))
+
+    def fetch() -> bytes:
+        changes = fetch_changes(db, batch, since, limit)
+        return encode_json({"changes": changes, "lastSeq": changes[-1]["seq"] if changes else since})
+
+    flight_key = directory_cache.scoped(batch).key("changes", since, limit)
+    return Response(content=changes_flights.do(flight_key, fetch, db), media_type=JSON_MEDIA_TYPE)
+
+@router.get("/changes/stream")
+async def stream_changes(
+    request: Request,
+    since: int = 0,
+    last_event_id: Optional[str] = Header(None),
+    token: str = Depends(oauth2_scheme),
+    batch: str = Depends(get_batch),
+):
+    """Server-sent events feed of directory changes, resumable with Last-Event-ID"""
+    if last_event_id and last_event_id.isdigit():
+        since = int(last_event_id)
+
+    def authenticate():
+        with session_scope() as db:
+            require_user(token, batch, db)
+            require_retained_changes(db, batch, since)
+    await run_in_threadpool(authenticate)
+
+    async def events():
+        nonlocal since
+        wakeup = change_notifier.subscribe()
+        try:
+            yield f"retry: {int(CHANGES_HEARTBEAT_SECONDS * 1000)}\n\n"
+            while not await request.is_disconnected():
+                # Clear before reading so a commit landing mid-read still wakes the next wait
+                wakeup.clear()
+                changes = await run_in_threadpool(_fetch_changes_in_new_session, batch, since)
+                for change in changes:
+                    since = change["seq"]
+                    yield f"id: {since}\nevent: change\ndata: {json.dumps(change, default=str)}\n\n"
+                if len(changes) == CHANGES_PAGE_SIZE:
+                    continue
+                try:
+                    await asyncio.wait_for(wakeup.wait(), timeout=CHANGES_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+        finally:
+            change_notifier.unsubscribe(wakeup)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+def build_snapshot(db: Session, batch: str, since: Optional[int]) -> bytes:
+    fields = PROJECTIONS["full"]
+    # Rows read after this may already include later changes; replaying those upserts is harmless
+    version = db.execute(
+        select(func.max(DirectoryChange.seq)).where(DirectoryChange.batch == batch)
+    ).scalar() or 0
+    if since is None:
+        rows = db.execute(select_directory(fields).where(MemberDirectory.batch == batch)).mappings()
+        return snapshot.encode(
+            {"kind": "snapshot", "version": version, "fields": fields},
+            ([row[field] for field in fields] for row in rows),
+        )
+
+    # Only the latest change per member matters, so deltas never outgrow the directory
+    latest = (
+        select(DirectoryChange.member_id, func.max(DirectoryChange.seq).label("seq"))
+        .where(DirectoryChange.batch == batch, DirectoryChange.seq > since, DirectoryChange.seq <= version)
+        .group_by(DirectoryChange.member_id)
+        .subquery()
+    )
+    query = (
+        select_directory(fields)
+        .add_columns(latest.c.member_id.label("_member_id"))
+        .select_from(latest)
+        .outerjoin(MemberDirectory, MemberDirectory.member_id == latest.c.member_id)
+        .order_by(latest.c.seq)
+    )
+    rows = db.execute(query).mappings()
+    return snapshot.encode(
+        {"kind": "delta", "since": since, "version": max(version, since), "fields": fields},
+        (
+            ["delete", row["_member_id"], None] if row["id"] is None
+            else ["upsert", row["_member_id"], [row[field] for field in fields]]
+            for row in rows
+        ),
+    )
+
+@router.get("/snapshot")
+def read_snapshot(
+    since: Optional[int] = None,
+    if_none_match: Optional[str] = Header(None),
+    token: str = Depends(oauth2_scheme),
+    batch: str = Depends(get_batch),
+    db: Session = Depends(get_db)
+):
+    """Whole directory as one compact gzip blob, or with since= only what changed after that version"""
+    require_user(token, batch, db)
+    if since is not None:
+        require_retained_changes(db, batch, since)
+    cache = directory_cache.scoped(batch)
+    cache_key = cache.key("snapshot", "" if since is None else since)
+    body = cache.get(cache_key)
+    cache_status = "HIT"
+    if body is None:
+        body = snapshot_flights.do(
+            cache_key,
+            lambda: cache.set_bytes(cache_key, build_snapshot(db, batch, since), SNAPSHOT_CACHE_TTL_SECONDS),
+            db,
+        )
+        cache_status = "MISS"
+
+    version = snapshot.read_header(body)["version"]
+    etag = f'"{"delta-" + str(since) + "-" if since is not None else ""}{version}"'
+    headers = {"ETag": etag, "X-Directory-Version": str(version), "X-Cache": cache_status}
+    if if_none_match == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type=snapshot.MEDIA_TYPE, headers=headers)
+
+@router.get("/map", response_model=dict)
+def read_member_map(
+    zoom: int = 2,
+    bbox: Optional[str] = None,
+    token: str = Depends(oauth2_scheme),
+    batch: str = Depends(get_batch),
+    db: Session = Depends(get_db)
+):
+    """Member counts clustered for a map viewport
+
+    bbox= is ``west,south,east,north`` in degrees; clusters get finer as zoom
+    (0-20) grows. Members whose location could not be geocoded are counted
+    in ``unlocated``.
+    """
+    require_user(token, batch, db)
+    viewport = None
+    if bbox:
+        try:
+            viewport = tuple(float(v) for v in bbox.split(","))
+        except ValueError:
+            viewport = ()
+        if len(viewport) != 4:
+            raise HTTPException(status_code=400, detail="bbox must be west,south,east,north")
+
+    cache = directory_cache.scoped(batch)
+    cache_key = cache.key("map", zoom, ",".join(f"{v:.3f}" for v in viewport or ()))
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return Response(content=cached, media_type=JSON_MEDIA_TYPE, headers={"X-Cache": "HIT"})
+
+    def fetch() -> bytes:
+        unlocated = db.execute(
+            select(func.count()).select_from(MemberLocation)
+            .where(MemberLocation.batch == batch, MemberLocation.geohash.is_(None))
+        ).scalar()
+        result = {"zoom": zoom, "clusters": clusters(db, batch, zoom, viewport), "unlocated": unlocated}
+        return cache.set(cache_key, result)
+
+    body = map_flights.do(cache_key, fetch, db)
+    return Response(content=body, media_type=JSON_MEDIA_TYPE, headers={"X-Cache": "MISS"})
+
+def serialize_member(member: Member, user: User) -> dict:
     return {
         "id": member.id,
         "registrationNumber": member.registration_number,
@@ -109,17 +451,66 @@ def read_member(member_id: str, db: Session = Depends(get_db)):
         }
     }
 
+@router.get("/{member_id}", response_model=dict)
+def read_member(member_id: str, batch: str = Depends(get_batch), db: Session = Depends(get_db)):
+    """Get a specific member with user information"""
+    def fetch() -> bytes:
+        member = db.query(Member).filter(Member.id == member_id, Member.batch == batch).first()
+        if not member:
+            raise HTTPException(status_code=404, detail="Member not found")
+        
+        user = db.query(User).filter(User.id == member.user_id).first()
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
+        return encode_json(serialize_member(member, user))
+    
+    flight_key = directory_cache.scoped(batch).key("member", member_id)
+    return Response(content=detail_flights.do(flight_key, fetch, db), media_type=JSON_MEDIA_TYPE)
+
 @router.get("/user/{user_id}", response_model=dict)
-def read_member_by_user_id(user_id: str, db: Session = Depends(get_db)):
+def read_member_by_user_id(user_id: str, batch: str = Depends(get_batch), db: Session = Depends(get_db)):
     """Get member profile by user ID"""
-    member = db.query(Member).filter(Member.user_id == user_id).first()
-    if not member:
-        raise HTTPException(status_code=404, detail="Member profile not found")
+    def fetch() -> bytes:
+        member = db.query(Member).filter(Member.user_id == user_id, Member.batch == batch).first()
+        if not member:
+            raise HTTPException(status_code=404, detail="Member profile not found")
+        
+        user = db.query(User).filter(User.id == user_id).first()
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
+        return encode_json(serialize_member(member, user))
     
-    user = db.query(User).filter(User.id == user_id).first()
+    flight_key = directory_cache.scoped(batch).key("member-by-user", user_id)
+    return Response(content=detail_flights.do(flight_key, fetch, db), media_type=JSON_MEDIA_TYPE)
+
+# Registered before /{member_id}, which would otherwise match "profile"
+@router.put("/profile")
+def update_own_member_profile(
+    member_data: dict = Body(...),
+    token: str = Depends(oauth2_scheme),
+    batch: str = Depends(get_batch),
+    db: Session = Depends(get_db),
+):
+    username = decode_access_token(token, batch)
+    user = db.query(User).filter(User.batch == batch, User.username == username).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    
+    member = db.query(Member).filter(Member.user_id == user.id).first()
+    if not member:
+        raise HTTPException(status_code=404, detail="Member profile not found")
+    update_fields = [
+        'registration_number', 'department', 'address', 'city', 'country',
+        'phone', 'bio'
+    ]
+    for field in update_fields:
+        if field in member_data and member_data[field] is not None:
+            setattr(member, field, member_data[field])
+    member.is_profile_complete = True
+    refresh_directory(db, member_ids=[member.id])
+    locate_members(db, member_ids=[member.id])
+    db.commit()
+    directory_cache.scoped(batch).invalidate()
+    db.refresh(member)
     return {
         "id": member.id,
         "registrationNumber": member.registration_number,
@@ -144,19 +535,25 @@ def read_member_by_user_id(user_id: str, db: Session = Depends(get_db)):
     }
 
 @router.put("/{member_id}", response_model=dict)
-def update_member(member_id: str, member_data: Dict[str, Any] = Body(...), db: Session = Depends(get_db)):
+def update_member(
+    member_id: str,
+    member_data: Dict[str, Any] = Body(...),
+    batch: str = Depends(get_batch),
+    db: Session = Depends(get_db)
+):
     """Update member profile by member ID"""
     try:
-        print(f"Updating member {member_id} with data: {member_data}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Updating member", extra={"member_id": member_id, "fields": sorted(member_data)})
         
-        db_member = db.query(Member).filter(Member.id == member_id).first()
+        db_member = db.query(Member).filter(Member.id == member_id, Member.batch == batch).first()
         if not db_member:
             raise HTTPException(status_code=404, detail="Member not found")
         
         # Update member fields
         update_fields = [
             'registration_number', 'department', 'address', 'city', 'country',
-            'phone', 'avatar_url', 'bio'
+            'phone', 'bio'
         ]
         
         for field in update_fields:
@@ -164,7 +561,10 @@ def update_member(member_id: str, member_data: Dict[str, Any] = Body(...), db: S
                 setattr(db_member, field, member_data[field])
         
         db_member.is_profile_complete = True
+        refresh_directory(db, member_ids=[member_id])
+        locate_members(db, member_ids=[member_id])
         db.commit()
+        directory_cache.scoped(batch).invalidate()
         db.refresh(db_member)
         
         # Return updated member with user data
@@ -195,26 +595,31 @@ def update_member(member_id: str, member_data: Dict[str, Any] = Body(...), db: S
             }
         }
         
-        print(f"Member {member_id} updated successfully")
+        logger.info("Member updated", extra={"member_id": member_id})
         return result
         
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Error updating member {member_id}: {str(e)}")
+        logger.exception("Error updating member", extra={"member_id": member_id})
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
 @router.put("/user/{user_id}", response_model=dict)
-def update_member_by_user_id(user_id: str, member_data: dict, db: Session = Depends(get_db)):
+def update_member_by_user_id(
+    user_id: str,
+    member_data: dict,
+    batch: str = Depends(get_batch),
+    db: Session = Depends(get_db)
+):
     """Update member profile by user ID"""
-    member = db.query(Member).filter(Member.user_id == user_id).first()
+    member = db.query(Member).filter(Member.user_id == user_id, Member.batch == batch).first()
     if not member:
         raise HTTPException(status_code=404, detail="Member profile not found")
     
     # Update member fields
     update_fields = [
         'registration_number', 'department', 'address', 'city', 'country',
-        'phone', 'avatar_url', 'bio'
+        'phone', 'bio'
     ]
     
     for field in update_fields:
@@ -222,7 +627,10 @@ def update_member_by_user_id(user_id: str, member_data: dict, db: Session = Depe
             setattr(member, field, member_data[field])
     
     member.is_profile_complete = True
+    refresh_directory(db, member_ids=[member.id])
+    locate_members(db, member_ids=[member.id])
     db.commit()
+    directory_cache.scoped(batch).invalidate()
     db.refresh(member)
     
     # Return updated member with user data
@@ -251,12 +659,18 @@ def update_member_by_user_id(user_id: str, member_data: dict, db: Session = Depe
     }
 
 @router.delete("/{member_id}")
-def delete_member(member_id: str, db: Session = Depends(get_db)):
-    db_member = db.query(Member).filter(Member.id == member_id).first()
+def delete_member(member_id: str, batch: str = Depends(get_batch), db: Session = Depends(get_db)):
+    db_member = db.query(Member).filter(Member.id == member_id, Member.batch == batch).first()
     if not db_member:
         raise HTTPException(status_code=404, detail="Member not found")
+    if db_member.avatar_url:
+        tasks.enqueue(
+            db, "remove_avatar_file", avatar_url=db_member.avatar_url, user_id=db_member.user_id, batch=batch
+        )
     db.delete(db_member)
+    refresh_directory(db, member_ids=[member_id])
     db.commit()
+    directory_cache.scoped(batch).invalidate()
     return {"ok": True}
 
 @router.get("/admin/all", response_model=List[dict])
@@ -264,92 +678,29 @@ def read_all_members_admin(
     skip: int = 0, 
     limit: int = 100, 
     token: str = Depends(oauth2_scheme),
+    batch: str = Depends(get_batch),
     db: Session = Depends(get_db)
 ):
     """Get all members including admin users (admin only)"""
     # Verify authentication and admin role
-    username = decode_access_token(token)
-    current_user = db.query(User).filter(User.username == username).first()
+    username = decode_access_token(token, batch)
+    current_user = db.query(User).filter(User.batch == batch, User.username == username).first()
     if not current_user:
         raise HTTPException(status_code=401, detail="Invalid authentication")
     
     if current_user.role != "ADMIN":
         raise HTTPException(status_code=403, detail="Admin access required")
     
-    # Get all members including admin users
-    members = db.query(Member).offset(skip).limit(limit).all()
-    
-    result = []
-    for member in members:
-        user = db.query(User).filter(User.id == member.user_id).first()
-        if user:
-            result.append({
-                "id": member.id,
-                "registrationNumber": member.registration_number,
-                "department": member.department,
-                "address": member.address,
-                "city": member.city,
-                "country": member.country,
-                "phone": member.phone,
-                "avatarUrl": member.avatar_url,
-                "bio": member.bio,
-                "isProfileComplete": member.is_profile_complete,
-                "createdAt": member.created_at,
-                "updatedAt": member.updated_at,
-                "user": {
-                    "id": user.id,
-                    "name": user.name,
-                    "username": user.username,
-                    "email": user.email,
-                    "role": user.role,
-                    "createdAt": user.created_at
-                }
-            })
+    def fetch() -> bytes:
+        # Get all members including admin users
+        members = db.query(Member).filter(Member.batch == batch).offset(skip).limit(limit).all()
+        
+        result = []
+        for member in members:
+            user = db.query(User).filter(User.id == member.user_id).first()
+            if user:
+                result.append(serialize_member(member, user))
+        return encode_json(result)
     
-    return result
-
-@router.put("/profile")
-def update_own_member_profile(
-    member_data: dict = Body(...),
-    token: str = Depends(oauth2_scheme),
-    db: Session = Depends(get_db),
-):
-    username = decode_access_token(token)
-    user = db.query(User).filter(User.username == username).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    member = db.query(Member).filter(Member.user_id == user.id).first()
-    if not member:
-        raise HTTPException(status_code=404, detail="Member profile not found")
-    update_fields = [
-        'registration_number', 'department', 'address', 'city', 'country',
-        'phone', 'avatar_url', 'bio'
-    ]
-    for field in update_fields:
-        if field in member_data and member_data[field] is not None:
-            setattr(member, field, member_data[field])
-    member.is_profile_complete = True
-    db.commit()
-    db.refresh(member)
-    return {
-        "id": member.id,
-        "registrationNumber": member.registration_number,
-        "department": member.department,
-        "address": member.address,
-        "city": member.city,
-        "country": member.country,
-        "phone": member.phone,
-        "avatarUrl": member.avatar_url,
-        "bio": member.bio,
-        "isProfileComplete": member.is_profile_complete,
-        "createdAt": member.created_at,
-        "updatedAt": member.updated_at,
-        "user": {
-            "id": user.id,
-            "name": user.name,
-            "username": user.username,
-            "email": user.email,
-            "role": user.role,
-            "createdAt": user.created_at
-        }
-    } 
\ No newline at end of file
+    flight_key = directory_cache.scoped(batch).key("admin-all", skip, limit)
+    return Response(content=admin_flights.do(flight_key, fetch, db), media_type=JSON_MEDIA_TYPE)
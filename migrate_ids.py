@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Migrate user and member ids to time-ordered UUIDv7 keys.
+
+Existing random uuid4 ids are rewritten to UUIDv7 ids placed at each row's
+``created_at``, so old rows sort in creation order like new ones, and every
+foreign key is updated to match. The member directory is rebuilt at the
+end; the change log records the old ids as deleted and the new ones as
+upserted, so clients following the changes feed resync. On PostgreSQL, the
+key columns are also converted to the native ``uuid`` type.
+
+Run it with the API stopped: access tokens identify users by username and
+stay valid, but outstanding refresh tokens are carried over by user id.
+
+Usage:
+    python migrate_ids.py run            # rekey, then convert column types on PostgreSQL
+    python migrate_ids.py run --keep-ids # PostgreSQL only: convert types, rekey only ids that are not UUIDs
+"""
+
+import sys
+import uuid
+from datetime import datetime, timezone
+
+from sqlalchemy import inspect, select, text
+from sqlalchemy.orm import Session
+
+from database import engine
+from directory import prune_changes, refresh_directory
+from ids import id_for_time
+from models import Base, Member, User
+
+# Columns holding user or member ids, converted to uuid on PostgreSQL
+KEY_COLUMNS = [
+    ("users", "id"),
+    ("members", "id"),
+    ("members", "user_id"),
+    ("member_directory", "member_id"),
+    ("member_directory", "user_id"),
+    ("refresh_tokens", "user_id"),
+    ("directory_changes", "member_id"),
+    ("directory_changes", "user_id"),
+    ("member_locations", "member_id"),
+    ("avatar_uploads", "user_id"),
+]
+
+# Columns rewritten by the rekey, for user ids and member ids
+USER_ID_COLUMNS = [
+    ("users", "id"),
+    ("members", "user_id"),
+    ("refresh_tokens", "user_id"),
+    ("avatar_uploads", "user_id"),
+]
+MEMBER_ID_COLUMNS = [("members", "id"), ("member_locations", "member_id")]
+
+
+def _needs_rekey(value: str, keep_ids: bool) -> bool:
+    try:
+        parsed = uuid.UUID(value)
+    except ValueError:
+        return True
+    return not keep_ids and parsed.version != 7
+
+
+def _new_ids(rows, keep_ids: bool) -> dict:
+    now = datetime.now(timezone.utc)
+    return {
+        old_id: id_for_time(created_at or now)
+        for old_id, created_at in rows
+        if _needs_rekey(old_id, keep_ids)
+    }
+
+
+def _foreign_keys():
+    """Foreign keys pointing at users.id or members.id, as (table, name, column, referred table)"""
+    inspector = inspect(engine)
+    found = []
+    for table in ("members", "member_directory", "refresh_tokens", "member_locations", "avatar_uploads"):
+        if not inspector.has_table(table):
+            continue
+        for fk in inspector.get_foreign_keys(table):
+            if fk["referred_table"] in ("users", "members") and fk.get("name"):
+                found.append((table, fk["name"], fk["constrained_columns"][0], fk["referred_table"]))
+    return found
+
+
+def rekey(db, keep_ids: bool) -> tuple:
+    users = _new_ids(db.execute(select(User.id, User.created_at).order_by(User.created_at)).all(), keep_ids)
+    members = _new_ids(db.execute(select(Member.id, Member.created_at).order_by(Member.created_at)).all(), keep_ids)
+
+    # Plain SQL, so ids that are not UUIDs yet bind as the text they are
+    for columns, mapping in ((USER_ID_COLUMNS, users), (MEMBER_ID_COLUMNS, members)):
+        if not mapping:
+            continue
+        params = [{"old": old, "new": new} for old, new in mapping.items()]
+        for table, column in columns:
+            db.execute(text(f"UPDATE {table} SET {column} = :new WHERE {column} = :old"), params)
+    return len(users), len(members)
+
+
+def convert_column_types(connection):
+    for table, column in KEY_COLUMNS:
+        connection.execute(text(
+            f"ALTER TABLE {table} ALTER COLUMN {column} TYPE uuid USING {column}::uuid"
+        ))
+
+
+def run(keep_ids: bool):
+    postgres = engine.dialect.name == "postgresql"
+    if keep_ids and not postgres:
+        print("✗ --keep-ids only applies to PostgreSQL, where column types are converted")
+        sys.exit(1)
+
+    Base.metadata.create_all(bind=engine)
+    foreign_keys = _foreign_keys() if postgres else []
+    with engine.connect() as connection:
+        if not postgres:
+            # Keys change underneath their references; SQLite only accepts this outside a transaction
+            connection.exec_driver_sql("PRAGMA foreign_keys=OFF")
+            connection.commit()
+        db = Session(bind=connection)
+        try:
+            if postgres:
+                # Put the constraints back once both sides of every reference match
+                for table, name, _, _ in foreign_keys:
+                    db.execute(text(f"ALTER TABLE {table} DROP CONSTRAINT {name}"))
+
+            users, members = rekey(db, keep_ids)
+            # The old directory rows point at ids that no longer exist
+            refresh_directory(db)
+            prune_changes(db)
+
+            if postgres:
+                convert_column_types(db.connection())
+                for table, name, column, referred in foreign_keys:
+                    db.execute(text(
+                        f"ALTER TABLE {table} ADD CONSTRAINT {name} FOREIGN KEY ({column}) "
+                        f"REFERENCES {referred} (id) ON DELETE CASCADE"
+                    ))
+            else:
+                violations = db.execute(text("PRAGMA foreign_key_check")).all()
+                if violations:
+                    raise RuntimeError(f"Foreign key violations after rekey: {violations[:5]}")
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+            if not postgres:
+                connection.exec_driver_sql("PRAGMA foreign_keys=ON")
+
+    print(f"✓ Rekeyed {users} users and {members} members")
+    if postgres:
+        print("✓ Key columns converted to uuid")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if not args or args[0] != "run" or set(args[1:]) - {"--keep-ids"}:
+        print(__doc__)
+        sys.exit(1)
+    run(keep_ids="--keep-ids" in args)
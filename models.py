@@ -1,25 +1,37 @@
-from sqlalchemy import Column, String, Boolean, DateTime, ForeignKey
+from sqlalchemy import Column, String, Boolean, DateTime, ForeignKey, Text, Integer, Float, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from database import Base
+from ids import IdType
+from config import DEFAULT_BATCH
+
+def batch_column():
+    """Tenant key, see tenancy.py"""
+    return Column(String, nullable=False, default=DEFAULT_BATCH, server_default=DEFAULT_BATCH)
 
 class User(Base):
     __tablename__ = "users"
-    id = Column(String, primary_key=True, index=True)
+    id = Column(IdType, primary_key=True, index=True)
+    batch = batch_column()
     name = Column(String, nullable=True)
-    username = Column(String, unique=True, index=True, nullable=False)
-    email = Column(String, unique=True, index=True, nullable=False)
+    username = Column(String, nullable=False)
+    email = Column(String, nullable=False)
     password = Column(String, nullable=False)
     role = Column(String, default="USER")
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
-    member = relationship("Member", back_populates="user", uselist=False)
+    member = relationship("Member", back_populates="user", uselist=False, passive_deletes=True)
+    __table_args__ = (
+        Index("ix_users_batch_username", "batch", "username", unique=True),
+        Index("ix_users_batch_email", "batch", "email", unique=True),
+    )
 
 class Member(Base):
     __tablename__ = "members"
-    id = Column(String, primary_key=True, index=True)
-    user_id = Column(String, ForeignKey("users.id"), unique=True)
-    registration_number = Column(String, unique=True, index=True, nullable=False)
+    id = Column(IdType, primary_key=True, index=True)
+    batch = batch_column()
+    user_id = Column(IdType, ForeignKey("users.id", ondelete="CASCADE"), unique=True)
+    registration_number = Column(String, nullable=False)
     department = Column(String, nullable=False)
     address = Column(String, nullable=False)
     city = Column(String, nullable=False)
@@ -30,4 +42,116 @@ class Member(Base):
     is_profile_complete = Column(Boolean, default=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
-    user = relationship("User", back_populates="member") 
\ No newline at end of file
+    user = relationship("User", back_populates="member")
+    __table_args__ = (Index("ix_members_batch_registration_number", "batch", "registration_number", unique=True),)
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+    key = Column(String, primary_key=True)
+    request_hash = Column(String, nullable=False)
+    response_body = Column(Text, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class RefreshToken(Base):
+    __tablename__ = "refresh_tokens"
+    id = Column(String, primary_key=True, index=True)
+    user_id = Column(IdType, ForeignKey("users.id", ondelete="CASCADE"), index=True, nullable=False)
+    family_id = Column(String, index=True, nullable=False)
+    token_hash = Column(String, unique=True, index=True, nullable=False)
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+    revoked_at = Column(DateTime(timezone=True), nullable=True)
+    replaced_by = Column(String, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class MemberDirectory(Base):
+    """Flattened member + user row served by directory reads, kept in sync by directory.py"""
+    __tablename__ = "member_directory"
+    member_id = Column(IdType, ForeignKey("members.id", ondelete="CASCADE"), primary_key=True)
+    batch = batch_column()
+    user_id = Column(IdType, ForeignKey("users.id", ondelete="CASCADE"), unique=True, index=True, nullable=False)
+    registration_number = Column(String, nullable=False)
+    department = Column(String, nullable=False, index=True)
+    address = Column(String, nullable=False)
+    city = Column(String, nullable=False, index=True)
+    country = Column(String, nullable=False)
+    phone = Column(String, nullable=True)
+    avatar_url = Column(String, nullable=True)
+    bio = Column(String, nullable=True)
+    is_profile_complete = Column(Boolean, default=False)
+    created_at = Column(DateTime(timezone=True))
+    updated_at = Column(DateTime(timezone=True))
+    name = Column(String, nullable=True)
+    username = Column(String, nullable=False)
+    email = Column(String, nullable=False)
+    role = Column(String)
+    user_created_at = Column(DateTime(timezone=True))
+    user_updated_at = Column(DateTime(timezone=True))
+    search_text = Column(Text, nullable=False, default="")
+    # Listings and keyset pages scan one batch in id order
+    __table_args__ = (Index("ix_member_directory_batch_member_id", "batch", "member_id"),)
+
+class DirectoryChange(Base):
+    """Log of directory changes, read by the changes feed and trimmed by directory.prune_changes"""
+    __tablename__ = "directory_changes"
+    # Never reuse sequence numbers, clients resume from the last one they saw
+    __table_args__ = (
+        Index("ix_directory_changes_batch_seq", "batch", "seq"),
+        {"sqlite_autoincrement": True},
+    )
+    seq = Column(Integer, primary_key=True, autoincrement=True)
+    batch = batch_column()
+    member_id = Column(IdType, index=True, nullable=False)
+    user_id = Column(IdType, nullable=True)
+    op = Column(String, nullable=False)  # "upsert" or "delete"
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class DirectoryChangeHorizon(Base):
+    """Highest sequence number whose change was pruned from a batch's log, see directory.prune_changes"""
+    __tablename__ = "directory_change_horizons"
+    batch = Column(String, primary_key=True)
+    seq = Column(Integer, nullable=False)
+
+class BackgroundJob(Base):
+    """Durable record of a queued side effect, see tasks.py"""
+    __tablename__ = "background_jobs"
+    id = Column(String, primary_key=True)
+    name = Column(String, nullable=False)
+    payload = Column(Text, nullable=False, default="{}")
+    status = Column(String, nullable=False, default="pending", index=True)  # pending, running, done or failed
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False)
+    run_after = Column(DateTime(timezone=True), nullable=False)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), nullable=True)
+
+class MemberLocation(Base):
+    """Geocoded member city, maintained by geo.locate_members"""
+    __tablename__ = "member_locations"
+    member_id = Column(IdType, ForeignKey("members.id", ondelete="CASCADE"), primary_key=True)
+    batch = batch_column()
+    source_key = Column(String, nullable=False)  # normalized city and country the row was geocoded from
+    place = Column(String, nullable=True)
+    country = Column(String, nullable=True)
+    precision = Column(String, nullable=False)  # "city", "country" or "none"
+    latitude = Column(Float, nullable=True)
+    longitude = Column(Float, nullable=True)
+    geohash = Column(String, nullable=True)
+    __table_args__ = (
+        Index("ix_member_locations_batch_geohash", "batch", "geohash"),
+        Index("ix_member_locations_lat_lon", "latitude", "longitude"),
+    )
+
+class AvatarUpload(Base):
+    """Resumable avatar upload, see resumable.py"""
+    __tablename__ = "avatar_uploads"
+    id = Column(String, primary_key=True)
+    batch = batch_column()
+    user_id = Column(IdType, ForeignKey("users.id", ondelete="CASCADE"), index=True, nullable=False)
+    filename = Column(String, nullable=False)
+    content_type = Column(String, nullable=False)
+    length = Column(Integer, nullable=False)
+    received = Column(Integer, nullable=False, default=0)  # bytes on disk, the tus Upload-Offset
+    avatar_url = Column(String, nullable=True)  # set once the upload is complete
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
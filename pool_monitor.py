@@ -0,0 +1,115 @@
+"""
+Connection pool checkout tracking.
+
+Records when and where every pooled connection is checked out. A connection
+held longer than ``POOL_CHECKOUT_WARN_SECONDS`` is logged once, with the
+stack that checked it out, while it is still held, so a leaked session shows
+up in the logs long before the pool is exhausted. Connections that are
+eventually returned after a long hold are logged again with the final
+duration.
+"""
+
+import logging
+import threading
+import time
+import traceback
+from typing import Dict, List
+
+from sqlalchemy import event
+
+from config import POOL_CHECKOUT_WARN_SECONDS, POOL_CHECKOUT_STACKS
+
+logger = logging.getLogger(__name__)
+
+
+class _Checkout:
+    __slots__ = ("started", "thread", "stack", "reported")
+
+    def __init__(self, capture_stack: bool):
+        self.started = time.monotonic()
+        self.thread = threading.current_thread().name
+        self.stack = "".join(traceback.format_stack(limit=30)[:-3]) if capture_stack else None
+        self.reported = False
+
+    def held_for(self) -> float:
+        return time.monotonic() - self.started
+
+
+class CheckoutTracker:
+    def __init__(self, warn_after: float = POOL_CHECKOUT_WARN_SECONDS, capture_stacks: bool = POOL_CHECKOUT_STACKS):
+        self.warn_after = warn_after
+        self.capture_stacks = capture_stacks
+        self._checkouts: Dict[int, _Checkout] = {}
+        self._lock = threading.Lock()
+        self._watcher = None
+        self._stop = threading.Event()
+
+    def install(self, engine):
+        event.listen(engine, "checkout", self._on_checkout)
+        event.listen(engine, "checkin", self._on_checkin)
+        if self._watcher is None:
+            self._stop.clear()
+            self._watcher = threading.Thread(target=self._watch, name="pool-monitor", daemon=True)
+            self._watcher.start()
+
+    def uninstall(self, engine):
+        """Stop tracking engine and stop the watcher thread"""
+        event.remove(engine, "checkout", self._on_checkout)
+        event.remove(engine, "checkin", self._on_checkin)
+        if self._watcher is not None:
+            self._stop.set()
+            self._watcher.join()
+            self._watcher = None
+        with self._lock:
+            self._checkouts.clear()
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        with self._lock:
+            self._checkouts[id(connection_record)] = _Checkout(self.capture_stacks)
+
+    def _on_checkin(self, dbapi_connection, connection_record):
+        with self._lock:
+            checkout = self._checkouts.pop(id(connection_record), None)
+        if checkout is not None and checkout.reported:
+            logger.warning(
+                "Long-held pool connection returned",
+                extra={"held_seconds": round(checkout.held_for(), 3), "checkout_thread": checkout.thread},
+            )
+
+    def held(self) -> List[dict]:
+        """Connections currently checked out, longest held first"""
+        with self._lock:
+            checkouts = list(self._checkouts.values())
+        return sorted(
+            ({"held_seconds": round(c.held_for(), 3), "thread": c.thread, "stack": c.stack} for c in checkouts),
+            key=lambda c: c["held_seconds"],
+            reverse=True,
+        )
+
+    def check(self):
+        """Log every connection that crossed the threshold since the last check"""
+        with self._lock:
+            overdue = [c for c in self._checkouts.values() if not c.reported and c.held_for() >= self.warn_after]
+            for checkout in overdue:
+                checkout.reported = True
+        for checkout in overdue:
+            logger.warning(
+                "Pool connection held past threshold, possible leak",
+                extra={
+                    "held_seconds": round(checkout.held_for(), 3),
+                    "checkout_thread": checkout.thread,
+                    "checkout_stack": checkout.stack,
+                },
+            )
+
+    def _watch(self):
+        while not self._stop.wait(max(self.warn_after / 2, 0.1)):
+            self.check()
+
+
+pool_tracker = CheckoutTracker()
+
+
+def install_pool_monitor(engine):
+    if POOL_CHECKOUT_WARN_SECONDS > 0:
+        pool_tracker.install(engine)
@@ -0,0 +1,210 @@
+"""
+Per-request profiling and slow-query capture.
+
+A configurable fraction of requests (or any request carrying the admin
+``X-Profile`` header) has its endpoint run under a profiler. SQL statements
+slower than ``SLOW_QUERY_MS`` are recorded with their bind parameters, and
+both are written to ``PROFILE_DIR`` once the response has been sent.
+"""
+
+import asyncio
+import contextvars
+import cProfile
+import functools
+import hmac
+import json
+import os
+import random
+import re
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Callable, List, Optional
+
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+from starlette.concurrency import run_in_threadpool
+
+from config import (
+    PROFILING_ENABLED,
+    PROFILE_SAMPLE_RATE,
+    PROFILE_DIR,
+    PROFILE_ADMIN_TOKEN,
+    SLOW_QUERY_MS,
+)
+
+try:
+    from pyinstrument import Profiler as SamplingProfiler
+except ImportError:  # pyinstrument is optional, fall back to cProfile
+    SamplingProfiler = None
+
+PROFILE_HEADER = b"x-profile"
+
+_current_profile: contextvars.ContextVar[Optional["RequestProfile"]] = contextvars.ContextVar(
+    "current_profile", default=None
+)
+
+
+class RequestProfile:
+    """Profiling state collected for one sampled request"""
+
+    def __init__(self, method: str, path: str):
+        self.id = uuid.uuid4().hex[:8]
+        self.method = method
+        self.path = path
+        self.started_at = datetime.utcnow()
+        self.status_code: Optional[int] = None
+        self.duration_ms: Optional[float] = None
+        self.slow_queries: List[dict] = []
+        self.profiler: Any = None
+
+    def file_stem(self) -> str:
+        slug = re.sub(r"[^A-Za-z0-9]+", "_", self.path).strip("_") or "root"
+        return f"{self.started_at.strftime('%Y%m%d_%H%M%S')}_{self.method}_{slug}_{self.id}"
+
+    def write(self, directory: str = PROFILE_DIR):
+        """Write the profiler output and the slow-query report to disk"""
+        os.makedirs(directory, exist_ok=True)
+        stem = os.path.join(directory, self.file_stem())
+
+        if isinstance(self.profiler, cProfile.Profile):
+            self.profiler.dump_stats(f"{stem}.prof")
+        elif self.profiler is not None:
+            with open(f"{stem}.html", "w") as f:
+                f.write(self.profiler.output_html())
+
+        report = {
+            "method": self.method,
+            "path": self.path,
+            "status": self.status_code,
+            "started_at": self.started_at.isoformat(),
+            "duration_ms": self.duration_ms,
+            "slow_query_threshold_ms": SLOW_QUERY_MS,
+            "slow_queries": self.slow_queries,
+        }
+        with open(f"{stem}.json", "w") as f:
+            json.dump(report, f, indent=2, default=str)
+
+
+def _start_profiler(profile: RequestProfile, is_async: bool):
+    if SamplingProfiler is not None:
+        profile.profiler = SamplingProfiler(async_mode="enabled" if is_async else "disabled")
+        profile.profiler.start()
+    else:
+        profile.profiler = cProfile.Profile()
+        profile.profiler.enable()
+
+
+def _stop_profiler(profile: RequestProfile):
+    if isinstance(profile.profiler, cProfile.Profile):
+        profile.profiler.disable()
+    else:
+        profile.profiler.stop()
+
+
+def _profiled(endpoint: Callable) -> Callable:
+    """Wrap a route endpoint so it runs under a profiler when its request is sampled"""
+    if getattr(endpoint, "_profiled", False):
+        return endpoint
+
+    if asyncio.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def wrapper(*args, **kwargs):
+            profile = _current_profile.get()
+            if profile is None:
+                return await endpoint(*args, **kwargs)
+            _start_profiler(profile, is_async=True)
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                _stop_profiler(profile)
+    else:
+        @functools.wraps(endpoint)
+        def wrapper(*args, **kwargs):
+            profile = _current_profile.get()
+            if profile is None:
+                return endpoint(*args, **kwargs)
+            _start_profiler(profile, is_async=False)
+            try:
+                return endpoint(*args, **kwargs)
+            finally:
+                _stop_profiler(profile)
+
+    wrapper._profiled = True
+    return wrapper
+
+
+class ProfilingRoute(APIRoute):
+    """APIRoute whose endpoint can be profiled by ProfilingMiddleware"""
+
+    def __init__(self, path: str, endpoint: Callable, **kwargs):
+        super().__init__(path, _profiled(endpoint), **kwargs)
+
+
+def install_query_listener(engine):
+    """Record statements slower than SLOW_QUERY_MS on the sampled request"""
+
+    # The start time lives on the execution context, so a statement that fails
+    # (no after_cursor_execute) leaves nothing behind on the pooled connection
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._query_start_time = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, "_query_start_time", None)
+        profile = _current_profile.get()
+        if profile is None or started is None:
+            return
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if elapsed_ms >= SLOW_QUERY_MS:
+            profile.slow_queries.append({
+                "statement": statement,
+                "parameters": parameters,
+                "duration_ms": round(elapsed_ms, 3),
+            })
+
+
+def _forced_by_header(scope) -> bool:
+    if not PROFILE_ADMIN_TOKEN:
+        return False
+    for name, value in scope.get("headers", []):
+        if name == PROFILE_HEADER:
+            return hmac.compare_digest(value.decode("latin-1"), PROFILE_ADMIN_TOKEN)
+    return False
+
+
+class ProfilingMiddleware:
+    """ASGI middleware that samples requests for profiling"""
+
+    def __init__(self, app, enabled: bool = PROFILING_ENABLED, sample_rate: float = PROFILE_SAMPLE_RATE):
+        self.app = app
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+
+    def should_profile(self, scope) -> bool:
+        if _forced_by_header(scope):
+            return True
+        return self.enabled and random.random() < self.sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.should_profile(scope):
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(scope["method"], scope["path"])
+        token = _current_profile.set(profile)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                profile.status_code = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            profile.duration_ms = round((time.perf_counter() - started) * 1000, 3)
+            _current_profile.reset(token)
+            await run_in_threadpool(profile.write)
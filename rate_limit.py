@@ -0,0 +1,209 @@
+"""
+Token bucket rate limiting.
+
+Rules are configured per route (path and methods) with an optional per-IP
+and per-username limit written as ``"<requests>/<second|minute|hour>"``.
+Buckets hold up to ``<requests>`` tokens and refill continuously, so short
+bursts are allowed while the sustained rate is capped. Usernames are read
+from the form or JSON body before the request reaches the router, so
+over-limit requests are rejected with 429 and ``Retry-After`` before any
+database or bcrypt work.
+
+Buckets live in process memory by default; ``RATE_LIMIT_BACKEND=redis``
+shares them between workers.
+"""
+
+import json
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+from urllib.parse import parse_qs
+
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+
+from config import (
+    RATE_LIMIT_ENABLED,
+    RATE_LIMIT_BACKEND,
+    RATE_LIMIT_REDIS_URL,
+    RATE_LIMIT_RULES,
+    RATE_LIMIT_TRUST_FORWARDED,
+)
+
+PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+MAX_BUFFERED_BODY = 64 * 1024
+
+
+def parse_rate(rate: str) -> Tuple[int, float]:
+    """Parse "5/minute" into (capacity, tokens refilled per second)"""
+    count, _, period = rate.partition("/")
+    capacity = int(count)
+    return capacity, capacity / PERIODS[period.strip()]
+
+
+class MemoryBucketStore:
+    """Token buckets in process memory, least recently used keys are evicted"""
+
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key: str, capacity: int, refill_rate: float, now: Optional[float] = None) -> float:
+        """Take one token; return 0 if allowed, else seconds until a token is available"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            tokens, updated_at = self._buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated_at) * refill_rate)
+            if tokens >= 1:
+                tokens -= 1
+                retry_after = 0.0
+            else:
+                retry_after = (1 - tokens) / refill_rate
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return retry_after
+
+
+# KEYS[1] bucket key; ARGV capacity, refill rate, now. Returns retry-after in ms.
+TOKEN_BUCKET_SCRIPT = """
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local tokens = tonumber(bucket[1]) or capacity
+local updated_at = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated_at) * rate)
+local retry_after = 0
+if tokens >= 1 then
+  tokens = tokens - 1
+else
+  retry_after = math.ceil((1 - tokens) / rate * 1000)
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated_at', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000))
+return retry_after
+"""
+
+
+class RedisBucketStore:
+    """Token buckets shared through any client that can run Redis Lua scripts"""
+
+    def __init__(self, client):
+        self.client = client
+        self._script = client.register_script(TOKEN_BUCKET_SCRIPT)
+
+    def take(self, key: str, capacity: int, refill_rate: float, now: Optional[float] = None) -> float:
+        now = time.time() if now is None else now
+        retry_after_ms = self._script(keys=[f"ratelimit:{key}"], args=[capacity, refill_rate, now])
+        return int(retry_after_ms) / 1000
+
+
+def create_store():
+    if RATE_LIMIT_BACKEND == "redis":
+        import redis  # optional dependency, only needed for the shared backend
+        return RedisBucketStore(redis.Redis.from_url(RATE_LIMIT_REDIS_URL))
+    return MemoryBucketStore()
+
+
+class RateLimitRule:
+    def __init__(self, path: str, methods=("POST",), per_ip: Optional[str] = None,
+                 per_username: Optional[str] = None):
+        self.path = path
+        self.methods = {m.upper() for m in methods}
+        self.per_ip = parse_rate(per_ip) if per_ip else None
+        self.per_username = parse_rate(per_username) if per_username else None
+
+    def matches(self, scope) -> bool:
+        return scope["method"] in self.methods and scope["path"].rstrip("/") == self.path.rstrip("/")
+
+
+def _username_from_body(body: bytes, content_type: str) -> Optional[str]:
+    try:
+        if content_type.startswith("application/json"):
+            value = json.loads(body or b"{}").get("username")
+        elif content_type.startswith("application/x-www-form-urlencoded"):
+            value = parse_qs(body.decode("utf-8")).get("username", [None])[0]
+        else:
+            return None
+    except (ValueError, AttributeError, UnicodeDecodeError):
+        return None
+    return value.lower() if isinstance(value, str) else None
+
+
+class RateLimitMiddleware:
+    """ASGI middleware enforcing per-route token bucket limits"""
+
+    def __init__(self, app, rules=None, store=None, enabled: bool = RATE_LIMIT_ENABLED):
+        self.app = app
+        self.rules = [RateLimitRule(**rule) for rule in (RATE_LIMIT_RULES if rules is None else rules)]
+        self.store = store if store is not None else create_store()
+        self.enabled = enabled
+
+    def client_ip(self, scope, headers: Headers) -> str:
+        if RATE_LIMIT_TRUST_FORWARDED and "x-forwarded-for" in headers:
+            return headers["x-forwarded-for"].split(",")[0].strip()
+        client = scope.get("client")
+        return client[0] if client else "unknown"
+
+    async def __call__(self, scope, receive, send):
+        if not self.enabled or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        rule = next((r for r in self.rules if r.matches(scope)), None)
+        if rule is None:
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        retry_after = 0.0
+        if rule.per_ip:
+            key = f"{rule.path}:ip:{self.client_ip(scope, headers)}"
+            retry_after = self.store.take(key, *rule.per_ip)
+
+        if not retry_after and rule.per_username:
+            body, receive = await _buffer_body(receive)
+            username = _username_from_body(body, headers.get("content-type", ""))
+            if username:
+                retry_after = self.store.take(f"{rule.path}:user:{username}", *rule.per_username)
+
+        if retry_after:
+            response = JSONResponse(
+                {"detail": "Too many requests"},
+                status_code=429,
+                headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+            )
+            await response(scope, receive, send)
+            return
+
+        await self.app(scope, receive, send)
+
+
+async def _buffer_body(receive):
+    """Read the request body and return it with a receive callable that replays it"""
+    chunks = []
+    size = 0
+    more_body = True
+    while more_body:
+        message = await receive()
+        if message["type"] != "http.request":
+            break
+        chunks.append(message.get("body", b""))
+        size += len(chunks[-1])
+        more_body = message.get("more_body", False)
+        if size > MAX_BUFFERED_BODY:
+            break
+    body = b"".join(chunks)
+    replayed = False
+
+    async def replay():
+        nonlocal replayed
+        if not replayed:
+            replayed = True
+            return {"type": "http.request", "body": body, "more_body": more_body}
+        return await receive()
+
+    return body, replay
@@ -0,0 +1,101 @@
+"""
+Rotating opaque refresh tokens.
+
+Clients get a random refresh token alongside each access token and trade it
+at /api/users/refresh for a new pair, so bcrypt only runs on password
+logins. Only a SHA-256 digest of each token is stored: the tokens are
+high-entropy random strings, so a slow password hash adds nothing.
+
+Every token belongs to a family started by a password login. Redeeming a
+token revokes it, and the replacement joins the same family. If an
+already-redeemed token is presented again, it has leaked or been
+replayed, so the whole family is revoked and the user must log in again.
+Changing the password revokes all of the user's families.
+"""
+
+import hashlib
+import secrets
+from ids import new_id
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from fastapi import HTTPException
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+from config import REFRESH_TOKEN_EXPIRE_DAYS
+from models import RefreshToken, User
+
+
+def hash_token(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _as_utc(value: datetime) -> datetime:
+    # SQLite hands back naive datetimes
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def issue(db: Session, user: User, family_id: Optional[str] = None, token_id: Optional[str] = None) -> str:
+    """Stage a new refresh token for user and return its plaintext value"""
+    token = secrets.token_urlsafe(32)
+    db.add(RefreshToken(
+        id=token_id or new_id(),
+        user_id=user.id,
+        family_id=family_id or new_id(),
+        token_hash=hash_token(token),
+        expires_at=_utcnow() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS),
+    ))
+    return token
+
+
+def revoke_family(db: Session, family_id: str):
+    db.execute(
+        update(RefreshToken)
+        .where(RefreshToken.family_id == family_id, RefreshToken.revoked_at.is_(None))
+        .values(revoked_at=_utcnow())
+        .execution_options(synchronize_session=False)
+    )
+
+
+def revoke_user(db: Session, user_id: str):
+    """Revoke every family of user, e.g. after a password change"""
+    db.execute(
+        update(RefreshToken)
+        .where(RefreshToken.user_id == user_id, RefreshToken.revoked_at.is_(None))
+        .values(revoked_at=_utcnow())
+        .execution_options(synchronize_session=False)
+    )
+
+
+def rotate(db: Session, token: str):
+    """Redeem token and return (user, new refresh token); the caller commits"""
+    record = db.query(RefreshToken).filter(RefreshToken.token_hash == hash_token(token)).first()
+    if record is None:
+        raise HTTPException(status_code=401, detail="Invalid refresh token")
+
+    if _as_utc(record.expires_at) < _utcnow():
+        raise HTTPException(status_code=401, detail="Refresh token expired")
+
+    # Conditional update so two concurrent redemptions cannot both succeed
+    replacement_id = new_id()
+    redeemed = db.execute(
+        update(RefreshToken)
+        .where(RefreshToken.id == record.id, RefreshToken.revoked_at.is_(None))
+        .values(revoked_at=_utcnow(), replaced_by=replacement_id)
+        .execution_options(synchronize_session=False)
+    )
+    if redeemed.rowcount == 0:
+        revoke_family(db, record.family_id)
+        db.commit()
+        raise HTTPException(status_code=401, detail="Refresh token reuse detected, please log in again")
+
+    user = db.query(User).filter(User.id == record.user_id).first()
+    if user is None:
+        raise HTTPException(status_code=401, detail="Invalid refresh token")
+
+    return user, issue(db, user, family_id=record.family_id, token_id=replacement_id)
@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+"""
+Resumable avatar uploads, following the tus 1.0 core protocol.
+
+The client creates an upload with its total size, then sends the bytes in
+one or more PATCH requests, each written straight to a part file at the
+offset it starts from. After a dropped connection, HEAD returns how many
+bytes arrived and the client carries on from there instead of starting
+over. When the last byte lands, the part file is renamed into the avatar
+directory (atomic on one filesystem) and the member's avatar is replaced.
+
+Chunk bodies are streamed to disk without holding a database connection:
+the upload row is read before and updated after each chunk. Uploads are
+removed ``RESUMABLE_UPLOAD_EXPIRY_HOURS`` after creation by a background
+job, finished or not.
+
+    POST   /api/upload/avatar/resumable        Upload-Length, Upload-Metadata (filename, filetype)
+    HEAD   /api/upload/avatar/resumable/{id}   returns Upload-Offset and Upload-Length
+    PATCH  /api/upload/avatar/resumable/{id}   Upload-Offset, Content-Type: application/offset+octet-stream
+    DELETE /api/upload/avatar/resumable/{id}
+
+Usage:
+    python resumable.py cleanup   # remove expired uploads and orphaned part files
+"""
+
+import base64
+import os
+import re
+import sys
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from typing import Dict, Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+from starlette.requests import ClientDisconnect
+
+from cache import directory_cache
+from config import MAX_FILE_SIZE, RESUMABLE_UPLOAD_DIR, RESUMABLE_UPLOAD_EXPIRY_HOURS
+from dependencies import get_db, oauth2_scheme, session_scope
+from directory import refresh_directory
+from ids import new_id
+from models import AvatarUpload, Member, User
+from profiling import ProfilingRoute
+from tenancy import avatar_dir, avatar_filename, get_batch
+from user import decode_access_token, get_user_by_username
+import tasks
+
+TUS_VERSION = "1.0.0"
+CHUNK_CONTENT_TYPE = "application/offset+octet-stream"
+
+router = APIRouter(tags=["uploads"], route_class=ProfilingRoute)
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _as_utc(value: datetime) -> datetime:
+    # SQLite hands back naive datetimes
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def part_path(upload_id: str) -> str:
+    return os.path.join(RESUMABLE_UPLOAD_DIR, upload_id)
+
+
+def parse_metadata(header: Optional[str]) -> Dict[str, str]:
+    """Decode Upload-Metadata: comma-separated ``key base64(value)`` pairs"""
+    metadata = {}
+    for pair in (header or "").split(","):
+        key, _, value = pair.strip().partition(" ")
+        if not key:
+            continue
+        try:
+            metadata[key] = base64.b64decode(value, validate=True).decode("utf-8")
+        except (ValueError, UnicodeDecodeError):
+            raise HTTPException(status_code=400, detail="Invalid Upload-Metadata")
+    return metadata
+
+
+def upload_headers(upload: AvatarUpload) -> Dict[str, str]:
+    headers = {
+        "Tus-Resumable": TUS_VERSION,
+        "Upload-Offset": str(upload.received),
+        "Upload-Length": str(upload.length),
+        "Upload-Expires": format_datetime(_as_utc(upload.expires_at), usegmt=True),
+        "Cache-Control": "no-store",
+    }
+    if upload.avatar_url:
+        headers["Avatar-Url"] = upload.avatar_url
+    return headers
+
+
+def replace_avatar(db: Session, member: Member, avatar_url: str, batch: str):
+    """Point member at a new avatar file and commit; the replaced file is removed once this commits"""
+    if member.avatar_url and member.avatar_url != avatar_url:
+        tasks.enqueue(db, "remove_avatar_file", avatar_url=member.avatar_url, user_id=member.user_id, batch=batch)
+    member.avatar_url = avatar_url
+    refresh_directory(db, member_ids=[member.id])
+    db.commit()
+    directory_cache.scoped(batch).invalidate()
+
+
+def _current_user(db: Session, token: str, batch: str) -> User:
+    user = get_user_by_username(db, decode_access_token(token, batch), batch)
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    return user
+
+
+def _load_upload(db: Session, upload_id: str, user: User) -> AvatarUpload:
+    upload = db.get(AvatarUpload, upload_id)
+    if upload is None or upload.user_id != user.id:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return upload
+
+
+def _finish(db: Session, upload: AvatarUpload):
+    """Move the completed part file into the avatar store and make it the member's avatar"""
+    member = db.query(Member).filter(Member.user_id == upload.user_id).first()
+    if not member:
+        raise HTTPException(status_code=404, detail="Member profile not found")
+    extension = os.path.splitext(upload.filename)[1]
+    if not re.fullmatch(r"\.[A-Za-z0-9]{1,8}", extension):
+        extension = ""
+    unique_filename = avatar_filename(upload.user_id, extension)
+    os.makedirs(avatar_dir(upload.batch), exist_ok=True)
+    file_path = os.path.join(avatar_dir(upload.batch), unique_filename)
+
+    os.replace(part_path(upload.id), file_path)
+    try:
+        upload.avatar_url = f"/uploads/avatars/{upload.batch}/{unique_filename}"
+        replace_avatar(db, member, upload.avatar_url, upload.batch)
+    except Exception:
+        # Keep the bytes, the client can send the final chunk's request again
+        db.rollback()
+        os.replace(file_path, part_path(upload.id))
+        raise
+
+
+@router.post("", status_code=201)
+def create_upload(
+    upload_length: int = Header(...),
+    upload_metadata: Optional[str] = Header(None),
+    token: str = Depends(oauth2_scheme),
+    batch: str = Depends(get_batch),
+    db: Session = Depends(get_db)
+):
+    """Start a resumable avatar upload; metadata carries the base64 filename and filetype"""
+    user = _current_user(db, token, batch)
+    if upload_length <= 0 or upload_length > MAX_FILE_SIZE:
+        raise HTTPException(status_code=413, detail="File size must be less than 5MB")
+    metadata = parse_metadata(upload_metadata)
+    if not metadata.get("filetype", "").startswith("image/"):
+        raise HTTPException(status_code=400, detail="File must be an image")
+    if not db.query(Member.id).filter(Member.user_id == user.id).first():
+        raise HTTPException(status_code=404, detail="Member profile not found")
+
+    upload = AvatarUpload(
+        id=new_id(),
+        batch=batch,
+        user_id=user.id,
+        filename=os.path.basename(metadata.get("filename", "")),
+        content_type=metadata["filetype"],
+        length=upload_length,
+        received=0,
+        expires_at=_utcnow() + timedelta(hours=RESUMABLE_UPLOAD_EXPIRY_HOURS),
+    )
+    os.makedirs(RESUMABLE_UPLOAD_DIR, exist_ok=True)
+    open(part_path(upload.id), "wb").close()
+    db.add(upload)
+    tasks.enqueue(db, "expire_avatar_upload", delay=RESUMABLE_UPLOAD_EXPIRY_HOURS * 3600, upload_id=upload.id)
+    db.commit()
+    headers = upload_headers(upload)
+    headers["Location"] = f"/api/upload/avatar/resumable/{upload.id}"
+    return Response(status_code=201, headers=headers)
+
+
+@router.head("/{upload_id}")
+def read_upload_offset(
+    upload_id: str,
+    token: str = Depends(oauth2_scheme),
+    batch: str = Depends(get_batch),
+    db: Session = Depends(get_db)
+):
+    """How many bytes of the upload have arrived, to resume from"""
+    upload = _load_upload(db, upload_id, _current_user(db, token, batch))
+    return Response(status_code=200, headers=upload_headers(upload))
+
+
+def _begin_chunk(upload_id: str, token: str, batch: str, offset: int) -> AvatarUpload:
+    with session_scope() as db:
+        upload = _load_upload(db, upload_id, _current_user(db, token, batch))
+        if _as_utc(upload.expires_at) < _utcnow():
+            raise HTTPException(status_code=410, detail="Upload expired")
+        if offset != upload.received:
+            raise HTTPException(status_code=409, detail="Upload-Offset does not match", headers=upload_headers(upload))
+        return upload
+
+
+def _end_chunk(upload_id: str, offset: int, written: int) -> AvatarUpload:
+    with session_scope() as db:
+        # Conditional, so of two requests sent from the same offset only one advances it
+        moved = db.execute(
+            update(AvatarUpload)
+            .where(AvatarUpload.id == upload_id, AvatarUpload.received == offset)
+            .values(received=offset + written)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.commit()
+        upload = db.get(AvatarUpload, upload_id)
+        if not moved:
+            raise HTTPException(status_code=409, detail="Upload-Offset does not match", headers=upload_headers(upload))
+        if upload.received == upload.length and upload.avatar_url is None:
+            _finish(db, upload)
+            db.refresh(upload)
+        return upload
+
+
+@router.patch("/{upload_id}", status_code=204)
+async def upload_chunk(
+    upload_id: str,
+    request: Request,
+    upload_offset: int = Header(...),
+    content_type: Optional[str] = Header(None),
+    token: str = Depends(oauth2_scheme),
+    batch: str = Depends(get_batch),
+):
+    """Append the request body at Upload-Offset; the last chunk completes the avatar"""
+    if content_type != CHUNK_CONTENT_TYPE:
+        raise HTTPException(status_code=415, detail=f"Content-Type must be {CHUNK_CONTENT_TYPE}")
+    upload = await run_in_threadpool(_begin_chunk, upload_id, token, batch, upload_offset)
+
+    remaining = upload.length - upload_offset
+    too_large = HTTPException(status_code=413, detail="Chunk runs past Upload-Length", headers=upload_headers(upload))
+    declared = request.headers.get("content-length")
+    if declared is not None and declared.isdigit() and int(declared) > remaining:
+        raise too_large
+    written = 0
+    overflowed = False
+    part = await run_in_threadpool(open, part_path(upload_id), "r+b")
+    try:
+        part.seek(upload_offset)
+        async for chunk in request.stream():
+            if len(chunk) > remaining - written:
+                # Never write past Upload-Length, and record none of this request's bytes below
+                overflowed = True
+                break
+            await run_in_threadpool(part.write, chunk)
+            written += len(chunk)
+    except ClientDisconnect:
+        # Keep what arrived, HEAD tells the client where to resume
+        pass
+    finally:
+        # The recorded offset must never run ahead of the bytes on disk
+        await run_in_threadpool(part.flush)
+        await run_in_threadpool(os.fsync, part.fileno())
+        await run_in_threadpool(part.close)
+
+    if overflowed:
+        # Leave the offset where it was, so an oversized body can never complete the avatar
+        raise too_large
+    upload = await run_in_threadpool(_end_chunk, upload_id, upload_offset, written)
+    return Response(status_code=204, headers=upload_headers(upload))
+
+
+@router.delete("/{upload_id}", status_code=204)
+def cancel_upload(
+    upload_id: str,
+    token: str = Depends(oauth2_scheme),
+    batch: str = Depends(get_batch),
+    db: Session = Depends(get_db)
+):
+    upload = _load_upload(db, upload_id, _current_user(db, token, batch))
+    tasks.expire_avatar_upload(db, upload.id)
+    db.commit()
+    return Response(status_code=204, headers={"Tus-Resumable": TUS_VERSION})
+
+
+def cleanup():
+    """Remove expired uploads whose job was lost, and stale part files without an upload"""
+    with session_scope() as db:
+        expired = db.scalars(select(AvatarUpload.id).where(AvatarUpload.expires_at < _utcnow())).all()
+        for upload_id in expired:
+            tasks.expire_avatar_upload(db, upload_id)
+        db.commit()
+        known = set(db.scalars(select(AvatarUpload.id)))
+    orphans = 0
+    # Skip recent files, their upload may not have committed yet
+    cutoff = _utcnow().timestamp() - 3600
+    if os.path.isdir(RESUMABLE_UPLOAD_DIR):
+        for name in os.listdir(RESUMABLE_UPLOAD_DIR):
+            if name not in known and os.path.getmtime(part_path(name)) < cutoff:
+                os.remove(part_path(name))
+                orphans += 1
+    print(f"✓ Removed {len(expired)} expired uploads and {orphans} orphaned part files")
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["cleanup"]:
+        print(__doc__)
+        sys.exit(1)
+    cleanup()
@@ -0,0 +1,62 @@
+"""
+Compact binary directory snapshots for offline clients.
+
+A snapshot is a gzip file holding length-prefixed records: a 4-byte
+big-endian length followed by that many bytes of compact JSON. The first
+record is a header object (format, kind, version, fields); every following
+record is one row as a positional array in ``fields`` order, so field names
+are sent once rather than per member.
+
+Snapshot rows are plain value arrays. Delta rows are ``["upsert", memberId,
+[values...]]`` or ``["delete", memberId, null]``. ``version`` is the
+directory change sequence number the data is current to; clients pass it
+back as ``since=`` to fetch the next delta.
+"""
+
+import gzip
+import io
+import json
+import struct
+import zlib
+from typing import Iterable, Iterator, Tuple
+
+from fastapi.encoders import jsonable_encoder
+
+FORMAT_VERSION = 1
+MEDIA_TYPE = "application/gzip"
+_LENGTH = struct.Struct(">I")
+
+
+def _record(value) -> bytes:
+    data = json.dumps(jsonable_encoder(value), separators=(",", ":")).encode("utf-8")
+    return _LENGTH.pack(len(data)) + data
+
+
+def encode(header: dict, rows: Iterable) -> bytes:
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode="wb", compresslevel=9, mtime=0) as out:
+        out.write(_record({"format": FORMAT_VERSION, **header}))
+        for row in rows:
+            out.write(_record(row))
+    return buffer.getvalue()
+
+
+def decode(data: bytes) -> Tuple[dict, Iterator]:
+    """Split a snapshot into its header and an iterator over its rows"""
+    raw = gzip.decompress(data)
+    records = []
+    offset = 0
+    while offset < len(raw):
+        (length,) = _LENGTH.unpack_from(raw, offset)
+        offset += _LENGTH.size
+        records.append(json.loads(raw[offset:offset + length]))
+        offset += length
+    return records[0], iter(records[1:])
+
+
+def read_header(data: bytes) -> dict:
+    """Decompress only as much of a snapshot as the header needs"""
+    stream = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    prefix = stream.decompress(data, _LENGTH.size)
+    (length,) = _LENGTH.unpack(prefix)
+    return json.loads(stream.decompress(stream.unconsumed_tail, length))
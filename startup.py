@@ -1,48 +1,80 @@
 import os
+import logging
 from database import engine
 from models import Base
 
+logger = logging.getLogger(__name__)
+
 def init_database():
     """Initialize the database by creating all tables"""
+    from tenancy import upgrade_schema
     try:
         Base.metadata.create_all(bind=engine)
-        print("Database tables created successfully!")
-    except Exception as e:
-        print(f"Error creating database tables: {e}")
+        # Tables from before batches existed get their batch column
+        upgrade_schema(engine)
+        logger.info("Database tables created successfully")
+    except Exception:
+        logger.exception("Error creating database tables")
 
 def create_upload_directories():
     """Create necessary upload directories"""
     from config import UPLOAD_DIR, AVATAR_DIR
-    
+
     try:
         os.makedirs(AVATAR_DIR, exist_ok=True)
-        print(f"Upload directories created: {AVATAR_DIR}")
-    except Exception as e:
-        print(f"Error creating upload directories: {e}")
+        logger.info("Upload directories created", extra={"avatar_dir": AVATAR_DIR})
+    except Exception:
+        logger.exception("Error creating upload directories")
+
+def init_directory():
+    """Backfill the denormalized member directory if it is still empty"""
+    from dependencies import session_scope
+    from directory import ensure_directory
+    try:
+        with session_scope() as db:
+            ensure_directory(db)
+    except Exception:
+        logger.exception("Error backfilling member directory")
+
+def init_locations():
+    """Geocode members that have no map location yet"""
+    from dependencies import session_scope
+    from geo import ensure_locations
+    try:
+        with session_scope() as db:
+            ensure_locations(db)
+    except Exception:
+        logger.exception("Error geocoding member locations")
 
 def startup():
     """Run all startup tasks"""
-    print("Starting PBG87 Backend...")
-    print(f"Environment: {os.getenv('ENVIRONMENT', 'development')}")
-    print(f"Database URL: {os.getenv('DATABASE_URL', 'sqlite:///./app.db')}")
-    
+    from config import ENVIRONMENT, CORS_ORIGINS
+    logger.info("Starting PBG87 Backend", extra={"environment": ENVIRONMENT, "cors_origins": CORS_ORIGINS})
+
     init_database()
     create_upload_directories()
-    
-    # Check database connection and log member count
+    init_directory()
+    init_locations()
+
+    # Counting rows and trimming the change log (backfills above append to it)
+    # can be slow on a big database, leave them to background jobs
     try:
-        from database import SessionLocal
-        from models import User, Member
-        db = SessionLocal()
-        user_count = db.query(User).count()
-        member_count = db.query(Member).count()
-        admin_count = db.query(User).filter(User.role == 'ADMIN').count()
-        print(f"Database initialized with {user_count} users, {member_count} members, {admin_count} admins")
-        db.close()
-    except Exception as e:
-        print(f"Warning: Could not query database: {e}")
-    
-    print("Startup complete!")
+        from dependencies import session_scope
+        import tasks
+        with session_scope() as db:
+            tasks.enqueue(db, "log_database_counts")
+            tasks.enqueue(db, "prune_directory_changes")
+            db.commit()
+    except Exception:
+        logger.warning("Could not queue startup jobs", exc_info=True)
+
+    logger.info("Startup complete")
 
 if __name__ == "__main__":
-    startup() 
\ No newline at end of file
+    from logging_config import setup_logging
+    setup_logging()
+    startup()
+    # No API worker here, run the jobs startup queued before exiting
+    from tasks import due_jobs, run_job
+    for job_id in due_jobs():
+        run_job(job_id)
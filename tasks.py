@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+"""
+Background jobs for side effects that should not hold up a response.
+
+Handlers call ``enqueue(db, name, **payload)`` before committing. The job
+row is written in the same transaction as the change that caused it, so a
+job exists exactly when its write committed. After the commit, the job id
+is handed to the in-process worker, an asyncio task that runs handlers in
+the thread pool. Failed jobs are retried with exponential backoff until
+``TASK_MAX_ATTEMPTS``, then marked failed.
+
+Jobs are claimed with a conditional UPDATE, so the in-process worker and any
+number of ``python tasks.py work`` processes can share the table. Set
+``TASKS_INLINE_WORKER=false`` to leave all jobs to separate worker
+processes.
+
+Usage:
+    python tasks.py work            # run a worker until interrupted
+    python tasks.py status          # job counts by status
+    python tasks.py retry-failed    # give failed jobs another round of attempts
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from ids import new_id
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import event as sa_event, func, select, update
+from sqlalchemy.orm import Session
+
+from config import (
+    AVATAR_DIR,
+    DEFAULT_BATCH,
+    RESUMABLE_UPLOAD_DIR,
+    UPLOAD_DIR,
+    TASK_MAX_ATTEMPTS,
+    TASK_POLL_SECONDS,
+    TASK_RETRY_BASE_SECONDS,
+    TASK_TIMEOUT_SECONDS,
+)
+from database import SessionLocal
+from models import AvatarUpload, BackgroundJob
+
+logger = logging.getLogger(__name__)
+
+HANDLERS: Dict[str, Callable] = {}
+
+
+def task(name: str):
+    """Register a handler; it is called as handler(db, **payload) and its session is committed after"""
+    def register(handler):
+        HANDLERS[name] = handler
+        return handler
+    return register
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def enqueue(db: Session, name: str, delay: float = 0, **payload) -> str:
+    """Stage a job in the caller's transaction and return its id"""
+    if name not in HANDLERS:
+        raise ValueError(f"Unknown task: {name}")
+    job_id = new_id()
+    db.add(BackgroundJob(
+        id=job_id,
+        name=name,
+        payload=json.dumps(payload, default=str),
+        status="pending",
+        attempts=0,
+        max_attempts=TASK_MAX_ATTEMPTS,
+        run_after=_utcnow() + timedelta(seconds=delay),
+    ))
+    db.info.setdefault("enqueued_jobs", []).append(job_id)
+    return job_id
+
+
+def run_job(job_id: str) -> bool:
+    """Claim and run one due job; False if it is not due or another worker has it"""
+    db = SessionLocal()
+    try:
+        now = _utcnow()
+        claimed = db.execute(
+            update(BackgroundJob)
+            .where(BackgroundJob.id == job_id, BackgroundJob.status == "pending", BackgroundJob.run_after <= now)
+            .values(status="running", attempts=BackgroundJob.attempts + 1, updated_at=now)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.commit()
+        if not claimed:
+            return False
+
+        job = db.get(BackgroundJob, job_id)
+        try:
+            handler = HANDLERS.get(job.name)
+            if handler is None:
+                raise LookupError(f"No handler registered for {job.name}")
+            handler(db, **json.loads(job.payload))
+            job.status = "done"
+            job.last_error = None
+        except Exception as e:
+            db.rollback()
+            job = db.get(BackgroundJob, job_id)
+            job.last_error = repr(e)
+            if job.attempts >= job.max_attempts:
+                job.status = "failed"
+                logger.exception("Job failed permanently", extra={"job_id": job_id, "task": job.name})
+            else:
+                job.status = "pending"
+                job.run_after = _utcnow() + timedelta(seconds=TASK_RETRY_BASE_SECONDS * 2 ** (job.attempts - 1))
+                logger.warning("Job failed, will retry", extra={"job_id": job_id, "task": job.name, "attempts": job.attempts})
+        job.updated_at = _utcnow()
+        db.commit()
+        return True
+    finally:
+        db.close()
+
+
+def due_jobs(limit: int = 100) -> List[str]:
+    """Ids of pending jobs that are due, after returning jobs abandoned by a dead worker to the queue"""
+    db = SessionLocal()
+    try:
+        now = _utcnow()
+        db.execute(
+            update(BackgroundJob)
+            .where(BackgroundJob.status == "running",
+                   BackgroundJob.updated_at < now - timedelta(seconds=TASK_TIMEOUT_SECONDS))
+            .values(status="pending", updated_at=now)
+            .execution_options(synchronize_session=False)
+        )
+        db.commit()
+        return list(db.scalars(
+            select(BackgroundJob.id)
+            .where(BackgroundJob.status == "pending", BackgroundJob.run_after <= now)
+            .order_by(BackgroundJob.run_after)
+            .limit(limit)
+        ))
+    finally:
+        db.close()
+
+
+class InlineWorker:
+    """Runs jobs inside the API process as soon as their transaction commits"""
+
+    def __init__(self):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._task = self._loop.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._loop = self._queue = self._task = None
+
+    def submit(self, job_ids: List[str]):
+        """Thread-safe; ignored when the worker is not running, the poll picks the jobs up instead"""
+        loop, queue = self._loop, self._queue
+        if loop is None or queue is None:
+            return
+        for job_id in job_ids:
+            loop.call_soon_threadsafe(queue.put_nowait, job_id)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                job_ids = [await asyncio.wait_for(self._queue.get(), timeout=TASK_POLL_SECONDS)]
+            except asyncio.TimeoutError:
+                # Retries that came due and jobs committed by other processes
+                job_ids = await loop.run_in_executor(None, due_jobs)
+            for job_id in job_ids:
+                try:
+                    await loop.run_in_executor(None, run_job, job_id)
+                except Exception:
+                    logger.exception("Job runner error", extra={"job_id": job_id})
+
+
+inline_worker = InlineWorker()
+
+
+@sa_event.listens_for(Session, "after_commit")
+def _submit_after_commit(session):
+    job_ids = session.info.pop("enqueued_jobs", None)
+    if job_ids:
+        inline_worker.submit(job_ids)
+
+
+@sa_event.listens_for(Session, "after_rollback")
+def _discard_after_rollback(session):
+    session.info.pop("enqueued_jobs", None)
+
+
+# Job handlers
+
+@task("remove_avatar_file")
+def remove_avatar_file(db: Session, avatar_url: str, user_id: Optional[str] = None, batch: Optional[str] = None):
+    """Delete a replaced avatar from disk, only if the server stored it for that user in that batch"""
+    from tenancy import avatar_dir
+
+    if user_id is None or batch is None:
+        # Queued before jobs carried the owner; the URL alone proves nothing
+        logger.warning("Not removing avatar without an owner", extra={"avatar_url": avatar_url})
+        return
+    # /uploads/avatars/<batch>/<file>, or /uploads/avatars/<file> from before batches
+    relative = avatar_url.split("/uploads/", 1)[-1]
+    directory, filename = os.path.split(os.path.normpath(os.path.join(UPLOAD_DIR, relative)))
+    directories = {os.path.normpath(avatar_dir(batch))}
+    if batch == DEFAULT_BATCH:
+        directories.add(os.path.normpath(AVATAR_DIR))
+    path = os.path.join(directory, filename)
+    if directory in directories and filename.startswith(f"{user_id}_") and os.path.isfile(path):
+        os.remove(path)
+
+
+@task("expire_avatar_upload")
+def expire_avatar_upload(db: Session, upload_id: str):
+    """Forget a resumable upload and delete its part file, if it never completed"""
+    upload = db.get(AvatarUpload, upload_id)
+    if upload is None:
+        return
+    path = os.path.join(RESUMABLE_UPLOAD_DIR, upload_id)
+    if os.path.exists(path):
+        os.remove(path)
+    db.delete(upload)
+
+
+@task("prune_directory_changes")
+def prune_directory_changes(db: Session):
+    """Trim the directory change log, see directory.prune_changes"""
+    from directory import prune_changes
+
+    removed = prune_changes(db)
+    logger.info("Directory change log pruned", extra={"removed": removed})
+
+
+@task("log_database_counts")
+def log_database_counts(db: Session):
+    from models import User, Member
+
+    def count(*criteria, model):
+        return db.execute(select(func.count()).select_from(model).where(*criteria)).scalar()
+
+    logger.info(
+        "Database initialized",
+        extra={
+            "users": count(model=User),
+            "members": count(model=Member),
+            "admins": count(User.role == "ADMIN", model=User),
+        },
+    )
+
+
+def work():
+    logger.info("Worker started")
+    while True:
+        job_ids = due_jobs()
+        for job_id in job_ids:
+            run_job(job_id)
+        if not job_ids:
+            time.sleep(TASK_POLL_SECONDS)
+
+
+def status():
+    from database import engine
+    from models import Base
+
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        rows = db.execute(select(BackgroundJob.status, func.count()).group_by(BackgroundJob.status)).all()
+        for job_status, count in sorted(rows):
+            print(f"{job_status:10} {count}")
+    finally:
+        db.close()
+
+
+def retry_failed():
+    db = SessionLocal()
+    try:
+        result = db.execute(
+            update(BackgroundJob)
+            .where(BackgroundJob.status == "failed")
+            .values(status="pending", attempts=0, run_after=_utcnow(), updated_at=_utcnow())
+            .execution_options(synchronize_session=False)
+        )
+        db.commit()
+        print(f"✓ {result.rowcount} failed jobs queued again")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    commands = {"work": work, "status": status, "retry-failed": retry_failed}
+    if len(sys.argv) != 2 or sys.argv[1] not in commands:
+        print(__doc__)
+        sys.exit(1)
+    from logging_config import setup_logging
+    setup_logging()
+    try:
+        commands[sys.argv[1]]()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        from logging_config import shutdown_logging
+        shutdown_logging()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Batches: many graduating batches served by one deployment.
+
+Every user, member and the rows derived from them (directory, change log,
+map locations) carry a ``batch`` column, and every index those tables are
+queried through leads with it, so a batch's queries only ever read its own
+slice of each index. Usernames, emails and registration numbers are unique
+within a batch.
+
+A request's batch comes from the ``X-Batch`` header, else from its host name
+through ``BATCH_HOSTS``, else ``DEFAULT_BATCH``; batches not listed in
+``BATCHES`` are rejected. Access tokens carry the batch they were issued
+for and are refused by any other batch. Cached pages are versioned per
+batch, and avatars are stored under ``uploads/avatars/<batch>/``.
+
+Databases created before batches existed are upgraded on startup: the
+column is added with every existing row in ``DEFAULT_BATCH``.
+
+Usage:
+    python tenancy.py upgrade   # add batch columns and indexes to an existing database
+    python tenancy.py status    # users and members per batch
+"""
+
+import os
+import re
+import sys
+import uuid
+from datetime import datetime
+
+from fastapi import HTTPException, Request
+from sqlalchemy import func, inspect, select, text
+
+from config import AVATAR_DIR, BATCH_HOSTS, BATCHES, DEFAULT_BATCH
+
+BATCH_HEADER = "X-Batch"
+
+_BATCH_NAME = re.compile(r"^[A-Za-z0-9_-]{1,32}$")
+
+# Tables partitioned by batch
+TENANT_TABLES = ("users", "members", "member_directory", "directory_changes", "member_locations")
+
+# Indexes superseded by their batch-leading versions
+_REPLACED_INDEXES = (
+    "ix_users_username",
+    "ix_users_email",
+    "ix_members_registration_number",
+    "ix_member_locations_geohash",
+)
+
+for _batch in set(BATCHES + list(BATCH_HOSTS.values()) + [DEFAULT_BATCH]):
+    # Batch names end up in SQL defaults and upload paths
+    if not _BATCH_NAME.match(_batch):
+        raise ValueError(f"Invalid batch name: {_batch!r}")
+
+
+def get_batch(request: Request) -> str:
+    """FastAPI dependency resolving the batch a request is for"""
+    batch = request.headers.get(BATCH_HEADER)
+    if not batch:
+        host = request.headers.get("host", "").split(":")[0].lower()
+        batch = BATCH_HOSTS.get(host, DEFAULT_BATCH)
+    if batch not in BATCHES:
+        raise HTTPException(status_code=404, detail="Unknown batch")
+    return batch
+
+
+def avatar_dir(batch: str) -> str:
+    return os.path.join(AVATAR_DIR, batch)
+
+
+def avatar_filename(user_id: str, extension: str) -> str:
+    """Name for a new avatar file; it starts with the owner's id, which removals check"""
+    # Two uploads in the same second must not share a file
+    return f"{user_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}{extension}"
+
+
+def upgrade_schema(engine):
+    """Add batch columns and batch-leading indexes to tables created before batches existed"""
+    from models import Base
+
+    inspector = inspect(engine)
+    with engine.begin() as connection:
+        for table in TENANT_TABLES:
+            if not inspector.has_table(table):
+                continue
+            if "batch" not in {column["name"] for column in inspector.get_columns(table)}:
+                connection.execute(text(
+                    f"ALTER TABLE {table} ADD COLUMN batch VARCHAR NOT NULL DEFAULT '{DEFAULT_BATCH}'"
+                ))
+        for name in _REPLACED_INDEXES:
+            connection.execute(text(f"DROP INDEX IF EXISTS {name}"))
+        for table in TENANT_TABLES:
+            for index in Base.metadata.tables[table].indexes:
+                index.create(connection, checkfirst=True)
+
+
+def upgrade():
+    from database import engine
+    from models import Base
+
+    Base.metadata.create_all(bind=engine)
+    upgrade_schema(engine)
+    print(f"✓ Batch columns in place, existing rows belong to batch {DEFAULT_BATCH}")
+
+
+def status():
+    from dependencies import session_scope
+    from models import Member, User
+
+    with session_scope() as db:
+        users = dict(db.execute(select(User.batch, func.count()).group_by(User.batch)).all())
+        members = dict(db.execute(select(Member.batch, func.count()).group_by(Member.batch)).all())
+    for batch in sorted(set(BATCHES) | set(users) | set(members)):
+        note = "" if batch in BATCHES else "  (not in BATCHES)"
+        print(f"{batch:10} {users.get(batch, 0):8} users {members.get(batch, 0):8} members{note}")
+
+
+if __name__ == "__main__":
+    commands = {"upgrade": upgrade, "status": status}
+    if len(sys.argv) != 2 or sys.argv[1] not in commands:
+        print(__doc__)
+        sys.exit(1)
+    commands[sys.argv[1]]()
@@ -0,0 +1,111 @@
+"""
+Run the app in-process against a throwaway SQLite database and upload
+directory. The environment has to be in place before config is imported.
+
+Each process (one per xdist worker with ``-n auto``) gets its own temporary
+directory and database, so workers never share state. Tests using the
+``client`` or ``db`` fixtures run inside one transaction that is rolled back
+afterwards; tests that need the real connection pool or several threads
+define their own module-level client instead.
+"""
+
+import os
+import sys
+import tempfile
+
+WORKDIR = tempfile.mkdtemp(prefix="pbg87-test-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(WORKDIR, 'test.db')}"
+os.environ["RATE_LIMIT_ENABLED"] = "false"
+# Background jobs hold connections of their own, keep them out of the pool counts
+os.environ["TASKS_INLINE_WORKER"] = "false"
+# Minimum bcrypt cost, registrations and logins would otherwise dominate the run time
+os.environ["BCRYPT_ROUNDS"] = "4"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+from sqlalchemy import create_engine, event  # noqa: E402
+from sqlalchemy.pool import StaticPool  # noqa: E402
+
+import main  # noqa: E402
+from cache import MemoryCache, directory_cache  # noqa: E402
+from config import AVATAR_DIR, DATABASE_URL  # noqa: E402
+from database import SessionLocal, engine  # noqa: E402
+from startup import init_database  # noqa: E402
+
+# One connection to the same database for transactional tests. pysqlite only
+# starts transactions before writes and so breaks savepoints; emit BEGIN
+# ourselves, as the SQLAlchemy docs recommend.
+transactional_engine = create_engine(
+    DATABASE_URL, connect_args={"check_same_thread": False}, poolclass=StaticPool
+)
+
+
+@event.listens_for(transactional_engine, "connect")
+def _configure_sqlite(dbapi_connection, connection_record):
+    dbapi_connection.isolation_level = None
+    dbapi_connection.execute("PRAGMA foreign_keys=ON")
+
+
+@event.listens_for(transactional_engine, "begin")
+def _begin(connection):
+    connection.exec_driver_sql("BEGIN")
+
+
+@pytest.fixture(scope="session", autouse=True)
+def workdir():
+    # Upload paths are relative; change directory only once collection is done,
+    # xdist workers resolve the test paths against the working directory
+    os.chdir(WORKDIR)
+    init_database()
+    os.makedirs(AVATAR_DIR, exist_ok=True)
+    return WORKDIR
+
+
+@pytest.fixture
+def db_connection():
+    """A connection whose outer transaction is rolled back after the test
+
+    Every session the app opens joins it, and their commits only release a
+    savepoint.
+    """
+    connection = transactional_engine.connect()
+    transaction = connection.begin()
+    SessionLocal.configure(bind=connection, join_transaction_mode="create_savepoint")
+    try:
+        yield connection
+    finally:
+        SessionLocal.configure(bind=engine, join_transaction_mode="conditional_savepoint")
+        transaction.rollback()
+        connection.close()
+
+
+@pytest.fixture
+def db(db_connection):
+    with SessionLocal() as session:
+        yield session
+
+
+@pytest.fixture
+def client(db_connection, monkeypatch):
+    """The app in-process, every request inside the test's transaction"""
+    # Cached pages would outlive the rollback
+    monkeypatch.setattr(directory_cache, "backend", MemoryCache())
+    return TestClient(main.app)
+
+
+@pytest.fixture
+def register(client):
+    """Register a member and return authorization headers for them, in batch if given"""
+    def register(username, password="secret123", batch=None, **fields):
+        batch_header = {"X-Batch": batch} if batch else {}
+        response = client.post("/api/users/register", headers=batch_header, json={
+            "username": username, "email": f"{username}@example.com", "password": password,
+            "name": username.title(), "registration_number": username.upper(), "department": "Agronomy",
+            "address": "Address", "city": "Lahore", "country": "Pakistan", **fields,
+        })
+        assert response.status_code == 200, response.text
+        form = {"username": username, "password": password}
+        token = client.post("/api/users/token", data=form, headers=batch_header).json()["access_token"]
+        return {"Authorization": f"Bearer {token}", **batch_header}
+    return register
@@ -0,0 +1,484 @@
+"""
+Core API flows, in-process and rolled back after each test.
+
+Covers the checks of test_backend_api.py, which needs a running server, and
+the other main flows.
+"""
+
+import json
+import os
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.exc import IntegrityError
+
+import tasks
+import tenancy
+from config import DEFAULT_BATCH
+from directory import prune_changes
+from geo import Gazetteer, geohash, normalize
+from models import BackgroundJob, Base, DirectoryChange, Member, MemberDirectory, MemberLocation, User
+from tenancy import avatar_dir, upgrade_schema
+
+
+def test_health(client):
+    assert client.get("/health").json()["status"] == "healthy"
+    assert client.get("/ready").json()["status"] == "ready"
+
+
+def test_register_login_and_read_directory(client, register):
+    headers = register("hermetic")
+
+    profile = client.get("/api/users/profile", headers=headers).json()
+    assert profile["user"]["username"] == "hermetic"
+    assert profile["member"]["city"] == "Lahore"
+
+    members = client.get("/api/members/", headers=headers).json()
+    assert [m["user"]["username"] for m in members] == ["hermetic"]
+    detail = client.get(f"/api/members/{profile['member']['id']}").json()
+    assert detail["user"]["name"] == "Hermetic"
+
+
+def test_rejects_bad_credentials(client, register):
+    register("careful")
+    response = client.post("/api/users/token", data={"username": "careful", "password": "wrong"})
+    assert response.status_code == 400
+    assert client.get("/api/members/", headers={"Authorization": "Bearer nonsense"}).status_code == 401
+
+
+def test_each_test_starts_from_an_empty_database(client, db, register):
+    # "hermetic" registered above was rolled back, so the name is free again
+    register("hermetic")
+    assert [u.username for u in db.query(User)] == ["hermetic"]
+
+
+def test_update_own_profile(client, register):
+    headers = register("updater")
+    response = client.put("/api/users/profile", json={"name": "New Name", "email": "new@example.com"}, headers=headers)
+    assert response.status_code == 200 and response.json()["email"] == "new@example.com"
+    response = client.put("/api/members/profile", json={"city": "Multan", "bio": "Hello"}, headers=headers)
+    assert response.status_code == 200 and response.json()["isProfileComplete"] is True
+
+    profile = client.get("/api/users/profile", headers=headers).json()
+    assert profile["user"]["name"] == "New Name" and profile["member"]["city"] == "Multan"
+    member = client.get("/api/members/", headers=headers).json()[0]
+    assert member["user"]["name"] == "New Name" and member["city"] == "Multan"
+
+
+def test_update_and_delete_member(client, register):
+    headers = register("editable")
+    register("bystander")
+    member_id = client.get("/api/users/profile", headers=headers).json()["member"]["id"]
+
+    response = client.put(f"/api/members/{member_id}", json={"department": "Genetics", "phone": "+92300"})
+    assert response.status_code == 200
+    detail = client.get(f"/api/members/{member_id}").json()
+    assert detail["department"] == "Genetics" and detail["phone"] == "+92300"
+
+    assert client.delete(f"/api/members/{member_id}").json() == {"ok": True}
+    assert client.get(f"/api/members/{member_id}").status_code == 404
+    assert client.put(f"/api/members/{member_id}", json={"city": "Multan"}).status_code == 404
+    assert [m["user"]["username"] for m in client.get("/api/members/", headers=headers).json()] == ["bystander"]
+
+
+def test_upload_avatar(client, register):
+    headers = register("photographer")
+    files = {"file": ("me.png", b"\x89PNG" + bytes(32), "image/png")}
+    response = client.post("/api/upload/avatar", files=files, headers=headers)
+    assert response.status_code == 200
+    avatar_url = response.json()["avatar_url"]
+    assert avatar_url.startswith(f"/uploads/avatars/{DEFAULT_BATCH}/")
+    with open(avatar_url.lstrip("/"), "rb") as f:
+        assert f.read() == files["file"][1]
+    assert client.get("/api/users/profile", headers=headers).json()["member"]["avatarUrl"] == avatar_url
+
+    files = {"file": ("notes.txt", b"not an image", "text/plain")}
+    assert client.post("/api/upload/avatar", files=files, headers=headers).status_code == 400
+    assert client.post("/api/upload/avatar", files=files).status_code == 401
+
+
+def make_admin(db, username):
+    db.query(User).filter(User.username == username).update({"role": "ADMIN"})
+    db.commit()
+
+
+def test_member_batch_admin_view_needs_an_admin(client, db, register):
+    member_headers = register("plainmember")
+    admin_headers = register("batchadmin")
+    make_admin(db, "batchadmin")
+    member_id = client.get("/api/users/profile", headers=member_headers).json()["member"]["id"]
+    body = {"ids": [member_id], "view": "admin"}
+
+    assert client.post("/api/members/batch", json={"ids": [member_id]}).status_code == 200
+    assert client.post("/api/members/batch", json=body).status_code == 401
+    assert client.post("/api/members/batch", json=body, headers=member_headers).status_code == 403
+    response = client.post("/api/members/batch", json=body, headers=admin_headers)
+    assert response.status_code == 200 and "updatedAt" in response.json()[member_id]["user"]
+
+
+def test_admin_listings_need_an_admin(client, db, register):
+    member_headers = register("listed")
+    admin_headers = register("lister")
+    make_admin(db, "lister")
+
+    for path in ("/api/users/admin/all", "/api/members/admin/all"):
+        assert client.get(path).status_code == 401
+        assert client.get(path, headers=member_headers).status_code == 403
+        response = client.get(path, headers=admin_headers)
+        assert response.status_code == 200 and len(response.json()) == 2
+
+
+def test_bulk_actions_spare_the_admin_and_queue_avatar_removals(client, db, register):
+    admin_headers = register("bulkadmin")
+    make_admin(db, "bulkadmin")
+    register("bulkmember")
+    db.query(Member).update({"avatar_url": "/uploads/avatars/default/old.png"})
+    db.commit()
+    everyone = [u.id for u in db.query(User)]
+
+    response = client.post("/api/users/admin/bulk/role", json={"ids": everyone, "new_role": "MEMBER"}, headers=admin_headers)
+    assert response.json() == {"updated": 1}
+    assert {u.username: u.role for u in db.query(User)} == {"bulkadmin": "ADMIN", "bulkmember": "MEMBER"}
+
+    # A role filter stops matching once applied, the directory still follows
+    response = client.post("/api/users/admin/bulk/role", json={"role": "MEMBER", "new_role": "EDITOR"}, headers=admin_headers)
+    assert response.json() == {"updated": 1}
+    member = db.query(User).filter(User.username == "bulkmember").one()
+    db.refresh(member)
+    assert member.role == db.get(MemberDirectory, member.member.id).role == "EDITOR"
+
+    response = client.post("/api/users/admin/bulk/delete", json={"ids": everyone}, headers=admin_headers)
+    assert response.json() == {"deleted_users": 1, "deleted_members": 1}
+    jobs = db.query(BackgroundJob).filter(BackgroundJob.name == "remove_avatar_file").all()
+    assert [json.loads(job.payload)["avatar_url"] for job in jobs] == ["/uploads/avatars/default/old.png"]
+
+
+def registration(username, **fields):
+    return {
+        "username": username, "email": f"{username}@example.com", "password": "secret123",
+        "name": username.title(), "registration_number": username.upper(), "department": "Agronomy",
+        "address": "Address", "city": "Lahore", "country": "Pakistan", **fields,
+    }
+
+
+def test_register_reports_which_field_is_taken(client, register):
+    register("taken", email="username@example.com")
+
+    response = client.post("/api/users/register", json=registration("taken", email="fresh@example.com"))
+    assert response.status_code == 400 and response.json()["detail"] == "Username already registered"
+    # PostgreSQL and MySQL echo the duplicate value, which here contains "username"
+    response = client.post("/api/users/register", json=registration("fresh", email="username@example.com"))
+    assert response.status_code == 400 and response.json()["detail"] == "Email already registered"
+    response = client.post("/api/users/register", json=registration("fresh", registration_number="TAKEN"))
+    assert response.status_code == 400 and response.json()["detail"] == "Registration number already registered"
+
+
+def test_register_replays_an_idempotency_key(client, db):
+    headers = {"Idempotency-Key": "register-once"}
+    first = client.post("/api/users/register", json=registration("retried"), headers=headers)
+    assert first.status_code == 200 and "Idempotent-Replayed" not in first.headers
+
+    again = client.post("/api/users/register", json=registration("retried"), headers=headers)
+    assert again.status_code == 200 and again.headers["Idempotent-Replayed"] == "true"
+    assert again.json() == first.json()
+    assert db.query(User).filter(User.username == "retried").count() == 1
+
+    other = client.post("/api/users/register", json=registration("different"), headers=headers)
+    assert other.status_code == 422
+
+
+def login(client, username, password="secret123"):
+    return client.post("/api/users/token", data={"username": username, "password": password}).json()
+
+
+def refresh(client, refresh_token):
+    return client.post("/api/users/refresh", json={"refresh_token": refresh_token})
+
+
+def test_replayed_refresh_token_revokes_its_family(client, register):
+    register("rotator")
+    first = login(client, "rotator")["refresh_token"]
+    other_login = login(client, "rotator")["refresh_token"]
+
+    second = refresh(client, first)
+    assert second.status_code == 200
+    # The redeemed token comes back: its whole family goes, other logins stay
+    assert refresh(client, first).status_code == 401
+    assert refresh(client, second.json()["refresh_token"]).status_code == 401
+    assert refresh(client, other_login).status_code == 200
+
+
+def test_password_change_revokes_refresh_tokens(client, register):
+    headers = register("changer")
+    own = login(client, "changer")["refresh_token"]
+    response = client.put("/api/users/profile", json={"password": "newsecret1"}, headers=headers)
+    assert response.status_code == 200 and "password" not in response.json()
+    assert refresh(client, own).status_code == 401
+
+    user_id = response.json()["id"]
+    renewed = login(client, "changer", "newsecret1")["refresh_token"]
+    assert client.put(f"/api/users/{user_id}", json={"password": "newsecret2"}).status_code == 200
+    assert refresh(client, renewed).status_code == 401
+    assert refresh(client, login(client, "changer", "newsecret2")["refresh_token"]).status_code == 200
+
+
+def test_pruning_keeps_the_latest_change_per_member(client, db, register):
+    headers = register("stays")
+    register("leaves")
+    client.put("/api/users/profile", json={"name": "Still Here"}, headers=headers)
+    leaver = db.query(User).filter(User.username == "leaves").one()
+    client.delete(f"/api/users/{leaver.id}")
+    before = client.get("/api/members/changes", headers=headers).json()["changes"]
+
+    assert prune_changes(db) == len(before) - 2
+    db.commit()
+    after = client.get("/api/members/changes", headers=headers).json()["changes"]
+    # The feed only serves each member's latest change, nothing it returns is lost
+    assert [(c["op"], c["memberId"]) for c in after] == [(c["op"], c["memberId"]) for c in before[-2:]]
+    assert after[-1]["op"] == "delete"
+
+    # Deletions go once they are older than the retention period
+    assert prune_changes(db, retention_days=-1) == 1
+    assert db.query(DirectoryChange.op).all() == [("upsert",)]
+    db.commit()
+    # ... and clients that last synced before the deletion are told to reload
+    stale = before[0]["seq"]
+    for path in (f"/api/members/changes?since={stale}", f"/api/members/snapshot?since={stale}",
+                 f"/api/members/changes/stream?since={stale}"):
+        assert client.get(path, headers=headers).status_code == 410, path
+    last_seq = before[-1]["seq"]
+    assert client.get(f"/api/members/changes?since={last_seq}", headers=headers).json()["changes"] == []
+    assert client.get(f"/api/members/snapshot?since={last_seq}", headers=headers).status_code == 200
+    # Starting from scratch still works: there is nothing to delete locally
+    assert [c["op"] for c in client.get("/api/members/changes?since=0", headers=headers).json()["changes"]] == ["upsert"]
+
+
+def test_member_updates_cannot_point_at_an_avatar_file(client, register):
+    headers = register("pointer")
+    target = {"avatar_url": "/uploads/avatars/someone_else.png"}
+    response = client.put("/api/members/profile", json={**target, "city": "Multan"}, headers=headers)
+    assert response.status_code == 200
+    assert response.json()["city"] == "Multan" and response.json()["avatarUrl"] is None
+
+    member_id = response.json()["id"]
+    assert client.put(f"/api/members/{member_id}", json=target).json()["avatarUrl"] is None
+
+
+def test_avatar_removal_only_deletes_the_owners_files(db):
+    os.makedirs(avatar_dir(DEFAULT_BATCH), exist_ok=True)
+    os.makedirs(avatar_dir("elsewhere"), exist_ok=True)
+    paths = {
+        "own": os.path.join(avatar_dir(DEFAULT_BATCH), "owner_1.png"),
+        "other user": os.path.join(avatar_dir(DEFAULT_BATCH), "intruder_1.png"),
+        "other batch": os.path.join(avatar_dir("elsewhere"), "owner_1.png"),
+    }
+    for path in paths.values():
+        open(path, "wb").close()
+
+    for path in paths.values():
+        url = "/" + path.replace(os.sep, "/")
+        tasks.remove_avatar_file(db, url, user_id="owner", batch=DEFAULT_BATCH)
+        # Jobs from before the owner was recorded leave the file alone
+        tasks.remove_avatar_file(db, url)
+    assert {name for name, path in paths.items() if os.path.exists(path)} == {"other user", "other batch"}
+
+
+def test_replacing_an_avatar_removes_only_the_old_file(client, db, register):
+    headers = register("twice")
+
+    def upload():
+        files = {"file": ("avatar.png", b"\x89PNG" + bytes(16), "image/png")}
+        return client.post("/api/upload/avatar", files=files, headers=headers).json()["avatar_url"]
+
+    # Both land in the same second
+    first, second = upload(), upload()
+    assert first != second
+    for job in db.query(BackgroundJob).filter(BackgroundJob.name == "remove_avatar_file"):
+        tasks.remove_avatar_file(db, **json.loads(job.payload))
+    assert not os.path.exists(first.lstrip("/")) and os.path.exists(second.lstrip("/"))
+
+
+def test_failing_jobs_back_off_then_fail_until_queued_again(db, monkeypatch, capsys):
+    calls = []
+
+    def flaky(db, **payload):
+        calls.append(payload)
+        raise RuntimeError("still broken")
+
+    monkeypatch.setitem(tasks.HANDLERS, "flaky", flaky)
+    now = [datetime(2030, 1, 1, tzinfo=timezone.utc)]
+    monkeypatch.setattr(tasks, "_utcnow", lambda: now[0])
+    job_id = tasks.enqueue(db, "flaky", path="x")
+    db.commit()
+    job = db.get(BackgroundJob, job_id)
+    job.max_attempts = 3
+    db.commit()
+
+    # 5s, then 10s: each retry waits twice as long, and is not claimed early
+    for attempt, backoff in ((1, 5), (2, 10)):
+        assert tasks.run_job(job_id)
+        db.refresh(job)
+        assert (job.status, job.attempts) == ("pending", attempt)
+        assert job.last_error == "RuntimeError('still broken')"
+        assert job.run_after.replace(tzinfo=timezone.utc) == now[0] + timedelta(seconds=backoff)
+        now[0] += timedelta(seconds=backoff - 1)
+        assert not tasks.run_job(job_id)
+        now[0] += timedelta(seconds=1)
+
+    assert tasks.run_job(job_id)
+    db.refresh(job)
+    assert (job.status, job.attempts) == ("failed", 3)
+    assert calls == [{"path": "x"}] * 3
+    now[0] += timedelta(days=1)
+    assert not tasks.run_job(job_id)
+
+    tasks.retry_failed()
+    assert "1 failed jobs queued again" in capsys.readouterr().out
+    db.refresh(job)
+    assert (job.status, job.attempts) == ("pending", 0)
+    assert tasks.run_job(job_id) and len(calls) == 4
+
+
+@pytest.fixture
+def other_batch(monkeypatch):
+    """A second batch served next to DEFAULT_BATCH"""
+    monkeypatch.setattr(tenancy, "BATCHES", [DEFAULT_BATCH, "90"])
+    return "90"
+
+
+def test_tokens_only_work_in_their_own_batch(client, register, other_batch):
+    headers = register("twin")
+    assert client.get("/api/users/profile", headers=headers).status_code == 200
+    assert client.get("/api/users/profile", headers={**headers, "X-Batch": other_batch}).status_code == 401
+    # The same username is free in another batch, and its token is refused back home
+    other_headers = register("twin", batch=other_batch)
+    assert client.get("/api/users/profile", headers={**other_headers, "X-Batch": DEFAULT_BATCH}).status_code == 401
+    response = client.post("/api/users/register", json=registration("stray"), headers={"X-Batch": "unknown"})
+    assert response.status_code == 404 and response.json()["detail"] == "Unknown batch"
+
+
+def test_directory_reads_are_scoped_to_the_batch(client, register, other_batch):
+    home = register("homer")
+    away = register("visitor", batch=other_batch)
+    away_member = client.get("/api/users/profile", headers=away).json()["member"]["id"]
+
+    assert [m["user"]["username"] for m in client.get("/api/members/", headers=home).json()] == ["homer"]
+    assert [m["user"]["username"] for m in client.get("/api/members/", headers=away).json()] == ["visitor"]
+    assert client.get(f"/api/members/{away_member}").status_code == 404
+    assert client.get(f"/api/members/{away_member}", headers={"X-Batch": other_batch}).status_code == 200
+    changes = client.get("/api/members/changes", headers=home).json()["changes"]
+    assert away_member not in {c["memberId"] for c in changes}
+
+    # A write in one batch leaves the other batch's cached pages alone
+    assert client.get("/api/members/", headers=home).headers["X-Cache"] == "HIT"
+    client.put("/api/members/profile", json={"city": "Multan"}, headers=away)
+    assert client.get("/api/members/", headers=home).headers["X-Cache"] == "HIT"
+    listing = client.get("/api/members/", headers=away)
+    assert listing.headers["X-Cache"] == "MISS" and listing.json()[0]["city"] == "Multan"
+
+
+def test_avatars_are_stored_per_batch(client, register, other_batch):
+    headers = register("framed", batch=other_batch)
+    files = {"file": ("me.png", b"\x89PNG" + bytes(16), "image/png")}
+    avatar_url = client.post("/api/upload/avatar", files=files, headers=headers).json()["avatar_url"]
+    assert avatar_url.startswith(f"/uploads/avatars/{other_batch}/")
+    assert os.path.isfile(os.path.join(avatar_dir(other_batch), os.path.basename(avatar_url)))
+
+
+def test_upgrade_schema_adds_batches_to_an_old_database(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as connection:
+        # users and members as they were before batches
+        connection.execute(text(
+            "CREATE TABLE users (id VARCHAR(36) PRIMARY KEY, name VARCHAR, username VARCHAR NOT NULL, "
+            "email VARCHAR NOT NULL, password VARCHAR NOT NULL, role VARCHAR, created_at DATETIME, updated_at DATETIME)"
+        ))
+        connection.execute(text("CREATE UNIQUE INDEX ix_users_username ON users (username)"))
+        connection.execute(text("CREATE UNIQUE INDEX ix_users_email ON users (email)"))
+        connection.execute(text(
+            "INSERT INTO users (id, username, email, password) VALUES ('u1', 'veteran', 'veteran@example.com', 'x')"
+        ))
+    # As on startup: create the tables that are missing, then upgrade the old ones
+    Base.metadata.create_all(bind=engine)
+    upgrade_schema(engine)
+
+    indexes = {index["name"]: index for index in inspect(engine).get_indexes("users")}
+    assert "ix_users_username" not in indexes and "ix_users_email" not in indexes
+    assert indexes["ix_users_batch_username"]["column_names"] == ["batch", "username"]
+    assert indexes["ix_users_batch_username"]["unique"]
+    with engine.begin() as connection:
+        assert connection.execute(text("SELECT batch FROM users")).scalar() == DEFAULT_BATCH
+        connection.execute(text(
+            "INSERT INTO users (id, batch, username, email, password) "
+            "VALUES ('u2', '90', 'veteran', 'veteran@example.com', 'x')"
+        ))
+    with pytest.raises(IntegrityError), engine.begin() as connection:
+        connection.execute(text(
+            f"INSERT INTO users (id, batch, username, email, password) "
+            f"VALUES ('u3', '{DEFAULT_BATCH}', 'veteran', 'other@example.com', 'x')"
+        ))
+    engine.dispose()
+
+
+def test_gazetteer_normalizes_and_geocodes():
+    assert normalize("D.G. Khan") == "dg khan"
+    assert normalize("Lahore Cantt.") == normalize(" LAHORE city ") == "lahore"
+    assert normalize("Muzaffarābād") == "muzaffarabad"
+    assert geohash(57.64911, 10.40744, 11) == "u4pruydqqvj"
+
+    places = Gazetteer()
+    assert places.locate("Lyallpur", "Pakistan").name == "Faisalabad"
+    assert places.locate("D.G. Khan", "pk").name == "Dera Ghazi Khan"
+    assert places.locate("Lahore, Punjab", "Islamic Republic of Pakistan").name == "Lahore"
+    # Ambiguous without the country, and the country decides
+    assert places.locate("Hyderabad", None) is None
+    assert places.locate("Hyderabad", "India").country == "India"
+    # Unknown cities fall back to the country's centroid
+    assert places.locate("Nowhere", "UAE")[-1] == "country"
+    assert places.locate("Nowhere", "Atlantis") is None
+
+
+def test_locations_are_recomputed_only_when_city_or_country_changes(client, db, register, monkeypatch):
+    headers = register("traveller")
+    member_id = client.get("/api/users/profile", headers=headers).json()["member"]["id"]
+    assert db.get(MemberLocation, member_id).place == "Lahore"
+
+    lookups = []
+    locate = Gazetteer.locate
+    monkeypatch.setattr(Gazetteer, "locate", lambda self, *args: lookups.append(args) or locate(self, *args))
+    client.put(f"/api/members/{member_id}", json={"bio": "Moved?", "city": "lahore cantt"})
+    assert lookups == []
+
+    client.put(f"/api/members/{member_id}", json={"city": "Lyallpur"})
+    client.put(f"/api/members/{member_id}", json={"country": "UAE"})
+    assert lookups == [("Lyallpur", "Pakistan"), ("Lyallpur", "UAE")]
+    db.expire_all()
+    location = db.get(MemberLocation, member_id)
+    assert (location.place, location.precision) == ("United Arab Emirates", "country")
+    assert location.geohash == geohash(location.latitude, location.longitude)
+
+
+def test_map_clusters_members_by_zoom(client, register):
+    headers = register("mapper")
+    for username, city in (("lahori", "Lahore"), ("faisalabadi", "Faisalabad"), ("karachiite", "Karachi")):
+        register(username, city=city)
+    register("lost", city="Atlantis", country="Nowhere")
+
+    def clusters_at(zoom, **params):
+        response = client.get("/api/members/map", params={"zoom": zoom, **params}, headers=headers)
+        assert response.status_code == 200
+        assert response.json()["unlocated"] == 1
+        return response.json()["clusters"]
+
+    # One cell for the whole country, then Lahore and Faisalabad share a cell, then each city has its own
+    assert [c["count"] for c in clusters_at(0)] == [4]
+    assert sorted(c["count"] for c in clusters_at(5)) == [1, 3]
+    finest = {c["geohash"]: c for c in clusters_at(12)}
+    assert sorted(c["count"] for c in finest.values()) == [1, 1, 2]
+    lahore = finest[geohash(31.5204, 74.3587, 6)]
+    assert (lahore["count"], lahore["lat"], lahore["lon"]) == (2, 31.5204, 74.3587)
+
+    # Only what the viewport shows
+    assert [c["count"] for c in clusters_at(12, bbox="74,31,75,32")] == [2]
+    assert client.get("/api/members/map", params={"bbox": "74,31"}, headers=headers).status_code == 400
@@ -0,0 +1,97 @@
+"""
+Backups of a database that is being written to, and restores from them.
+"""
+
+import os
+import sqlite3
+import threading
+
+import pytest
+
+import backup
+
+
+@pytest.fixture
+def site(tmp_path):
+    """A SQLite database with a few hundred pages, and an avatar directory"""
+    database = tmp_path / "app.db"
+    connection = sqlite3.connect(database)
+    connection.execute("CREATE TABLE members (id INTEGER PRIMARY KEY, bio TEXT)")
+    connection.executemany("INSERT INTO members (bio) VALUES (?)", [("x" * 500,) for _ in range(2000)])
+    connection.commit()
+    connection.close()
+
+    avatars = tmp_path / "avatars"
+    (avatars / "87").mkdir(parents=True)
+    (avatars / "87" / "a.png").write_bytes(b"\x89PNG" + os.urandom(2000))
+    (avatars / "87" / "b.png").write_bytes(b"\x89PNG" + os.urandom(3000))
+    return {"url": f"sqlite:///{database}", "database": str(database), "avatars": str(avatars),
+            "backups": str(tmp_path / "backups")}
+
+
+def count_members(database):
+    connection = sqlite3.connect(database)
+    try:
+        return connection.execute("SELECT count(*) FROM members").fetchone()[0]
+    finally:
+        connection.close()
+
+
+def test_backup_while_writing_then_restore(site):
+    stop = threading.Event()
+    writes = []
+
+    def writer():
+        connection = sqlite3.connect(site["database"], timeout=10)
+        while not stop.is_set():
+            connection.execute("INSERT INTO members (bio) VALUES ('late')")
+            connection.commit()
+            writes.append(1)
+        connection.close()
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    try:
+        snapshot = backup.create(site["backups"], site["url"], site["avatars"])
+    finally:
+        stop.set()
+        thread.join()
+    assert writes, "the app kept writing during the backup"
+    manifest = backup._read(snapshot, backup.MANIFEST)
+    assert manifest["database"]["pages"] > 100 and manifest["avatars"]["count"] == 2
+
+    # Lose an avatar, damage another and add rows, then go back to the snapshot
+    os.remove(os.path.join(site["avatars"], "87", "a.png"))
+    with open(os.path.join(site["avatars"], "87", "b.png"), "wb") as f:
+        f.write(b"damaged")
+    with pytest.raises(backup.BackupError):
+        backup.restore(snapshot, site["url"], site["avatars"])
+
+    result = backup.restore(snapshot, site["url"], site["avatars"], force=True)
+    assert result == {"avatarsWritten": 2}
+    assert 2000 <= count_members(site["database"]) <= 2000 + len(writes)
+    assert count_members(site["database"] + ".before-restore") == 2000 + len(writes)
+    entries = {entry["path"]: entry for entry in backup._read(snapshot, backup.AVATAR_MANIFEST)}
+    assert backup._sha256(os.path.join(site["avatars"], "87", "b.png")) == entries["87/b.png"]["sha256"]
+
+
+def test_snapshots_share_avatar_objects_and_are_pruned(site):
+    first = backup.create(site["backups"], site["url"], site["avatars"], keep=0)
+    os.remove(os.path.join(site["avatars"], "87", "a.png"))
+    with open(os.path.join(site["avatars"], "87", "c.png"), "wb") as f:
+        f.write(b"new avatar")
+    second = backup.create(site["backups"], site["url"], site["avatars"], keep=0)
+
+    objects = lambda: sorted(name for _, _, files in os.walk(os.path.join(site["backups"], "objects")) for name in files)
+    assert len(objects()) == 3
+    assert backup.snapshots(site["backups"]) == [first, second]
+
+    backup.prune(site["backups"], keep=1)
+    assert backup.snapshots(site["backups"]) == [second]
+    assert len(objects()) == 2
+    assert backup.verify(second) == []
+
+    stored = backup._object_path(site["backups"], objects()[0])
+    with open(stored, "ab") as f:
+        f.write(b"bitrot")
+    assert len(backup.verify(second)) == 1
@@ -0,0 +1,71 @@
+"""
+Timings for the hot endpoints, in-process against SQLite (requires pytest-benchmark).
+
+    python -m pytest tests/test_benchmarks.py --benchmark-only
+    python -m pytest tests/test_benchmarks.py --benchmark-only --benchmark-compare
+
+Under xdist the plugin runs each benchmark once, untimed, as a plain test.
+benchmark.py remains the load test for realistic data sizes and concurrency.
+"""
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from cache import directory_cache  # noqa: E402
+from config import DEFAULT_BATCH  # noqa: E402
+
+DIRECTORY_SIZE = 20
+
+# Short runs keep the default test run fast; pass --benchmark-max-time for steadier numbers
+pytestmark = pytest.mark.benchmark(group="endpoints", max_time=0.2)
+
+
+@pytest.fixture
+def directory(client, register):
+    """A small directory and the headers of one of its members"""
+    for i in range(1, DIRECTORY_SIZE):
+        client.post("/api/users/register", json={
+            "username": f"bench{i:02d}", "email": f"bench{i:02d}@example.com", "password": "secret123",
+            "name": f"Bench {i}", "registration_number": f"BENCH{i:02d}", "department": "Agronomy",
+            "address": "Address", "city": ("Lahore", "Multan", "Karachi")[i % 3], "country": "Pakistan",
+        })
+    return register("bench00")
+
+
+def test_login(benchmark, client, register):
+    register("bencher")
+    form = {"username": "bencher", "password": "secret123"}
+    response = benchmark(client.post, "/api/users/token", data=form)
+    assert response.status_code == 200
+
+
+def test_read_members_cached(benchmark, client, directory):
+    client.get("/api/members/", headers=directory)
+    response = benchmark(client.get, "/api/members/", headers=directory)
+    assert response.headers["X-Cache"] == "HIT" and len(response.json()) == DIRECTORY_SIZE
+
+
+def test_read_members_uncached(benchmark, client, directory):
+    def read():
+        directory_cache.scoped(DEFAULT_BATCH).invalidate()
+        return client.get("/api/members/?view=card", headers=directory)
+
+    response = benchmark(read)
+    assert response.headers["X-Cache"] == "MISS" and len(response.json()) == DIRECTORY_SIZE
+
+
+def test_profile(benchmark, client, directory):
+    response = benchmark(client.get, "/api/users/profile", headers=directory)
+    assert response.json()["user"]["username"] == "bench00"
+
+
+def test_read_member(benchmark, client, directory):
+    member_id = client.get("/api/users/profile", headers=directory).json()["member"]["id"]
+    response = benchmark(client.get, f"/api/members/{member_id}")
+    assert response.status_code == 200
+
+
+def test_snapshot(benchmark, client, directory):
+    response = benchmark(client.get, "/api/members/snapshot", headers=directory)
+    assert response.status_code == 200
@@ -0,0 +1,70 @@
+"""
+Response cache behaviour, on the in-memory backend and on Redis through fakeredis.
+"""
+
+import time
+
+import pytest
+
+from cache import MemoryCache, RedisCache, ResponseCache
+
+
+class Clock:
+    """Moves time.time and time.monotonic forward, for entry expiry on both backends"""
+
+    def __init__(self, monkeypatch):
+        self.offset = 0.0
+        real_time, real_monotonic = time.time, time.monotonic
+        monkeypatch.setattr(time, "time", lambda: real_time() + self.offset)
+        monkeypatch.setattr(time, "monotonic", lambda: real_monotonic() + self.offset)
+
+    def advance(self, seconds: float):
+        self.offset += seconds
+
+
+@pytest.fixture(params=["memory", "redis"])
+def backend(request):
+    if request.param == "memory":
+        return MemoryCache(max_entries=100, max_bytes=1_000_000)
+    fakeredis = pytest.importorskip("fakeredis")
+    return RedisCache(fakeredis.FakeRedis())
+
+
+def test_get_and_set(backend):
+    assert backend.get("missing") is None
+    backend.set("key", b"value", ttl=60)
+    assert backend.get("key") == b"value"
+    backend.set("key", b"newer", ttl=60)
+    assert backend.get("key") == b"newer"
+
+
+def test_entries_expire_after_their_ttl(backend, monkeypatch):
+    clock = Clock(monkeypatch)
+    backend.set("short", b"1", ttl=5)
+    backend.set("long", b"2", ttl=60)
+    clock.advance(10)
+    assert backend.get("short") is None
+    assert backend.get("long") == b"2"
+
+
+def test_version_bump_invalidates_every_key(backend):
+    cache = ResponseCache("members", backend, ttl=60)
+    key = cache.key(0, 100)
+    assert cache.set(key, [{"id": "a"}]) == b'[{"id":"a"}]'
+    assert cache.get(key) == b'[{"id":"a"}]'
+
+    cache.invalidate()
+    assert cache.key(0, 100) != key
+    assert cache.get(cache.key(0, 100)) is None
+
+
+def test_scopes_are_invalidated_separately(backend):
+    cache = ResponseCache("members", backend, ttl=60)
+    first, second = cache.scoped("87"), cache.scoped("90")
+    first_key, second_key = first.key(0), second.key(0)
+    first.set(first_key, ["87"])
+    second.set(second_key, ["90"])
+
+    first.invalidate()
+    assert first.key(0) != first_key
+    assert second.key(0) == second_key and second.get(second_key) == b'["90"]'
@@ -0,0 +1,114 @@
+"""
+Identical concurrent reads share one query.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+import main
+import member
+from coalesce import SingleFlight
+from database import engine
+
+
+@pytest.fixture(scope="module")
+def pooled_client():
+    """Concurrent requests need the real connection pool, not the rolled-back test transaction"""
+    with TestClient(main.app) as client:
+        yield client
+
+
+@pytest.fixture
+def popular(pooled_client):
+    """A committed member, removed again after the test; yields its member id"""
+    client = pooled_client
+    client.post("/api/users/register", json={
+        "username": "popular", "email": "popular@example.com", "password": "secret123",
+        "name": "Popular", "registration_number": "PO001", "department": "Agronomy",
+        "address": "Address", "city": "Multan", "country": "Pakistan",
+    })
+    token = client.post("/api/users/token", data={"username": "popular", "password": "secret123"}).json()["access_token"]
+    profile = client.get("/api/users/profile", headers={"Authorization": f"Bearer {token}"}).json()
+    yield profile["member"]["id"]
+    client.delete(f"/api/users/{profile['user']['id']}")
+
+
+def test_single_flight_shares_results_and_errors():
+    flights = SingleFlight("test")
+    release = threading.Event()
+    calls = []
+
+    def slow(value):
+        def fn():
+            calls.append(value)
+            release.wait(5)
+            if value == "missing":
+                raise HTTPException(status_code=404)
+            return value
+        return fn
+
+    def run(key):
+        try:
+            return flights.do(key, slow(key))
+        except HTTPException as e:
+            return e.status_code
+
+    with ThreadPoolExecutor(max_workers=10) as pool:
+        results = [pool.submit(run, "a" if i < 6 else "missing") for i in range(10)]
+        time.sleep(0.2)
+        release.set()
+        results = [r.result() for r in results]
+
+    assert results == ["a"] * 6 + [404] * 4
+    assert sorted(calls) == ["a", "missing"]
+    assert flights.snapshot() == {"executed": 2, "coalesced": 8, "inFlight": 0}
+    # Once a flight has landed, the next call runs again
+    assert flights.do("a", lambda: "again") == "again"
+
+
+def test_concurrent_member_reads_run_one_query(pooled_client, popular):
+    client, member_id = pooled_client, popular
+
+    queries = []
+
+    def slow_member_query(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().startswith("SELECT") and "FROM members" in statement:
+            queries.append(statement)
+            # Hold the query until every other request has joined, however slowly a loaded machine starts them
+            deadline = time.monotonic() + 5
+            while member.detail_flights.coalesced - before["coalesced"] < 9 and time.monotonic() < deadline:
+                time.sleep(0.01)
+
+    before = member.detail_flights.snapshot()
+    event.listen(engine, "before_cursor_execute", slow_member_query)
+    try:
+        with ThreadPoolExecutor(max_workers=10) as pool:
+            responses = list(pool.map(lambda _: client.get(f"/api/members/{member_id}"), range(10)))
+    finally:
+        event.remove(engine, "before_cursor_execute", slow_member_query)
+    after = member.detail_flights.snapshot()
+
+    assert {r.status_code for r in responses} == {200}
+    assert len({r.content for r in responses}) == 1
+    assert responses[0].json()["user"]["username"] == "popular"
+    assert len(queries) == 1
+    assert after["executed"] - before["executed"] == 1
+    assert after["coalesced"] - before["coalesced"] == 9
+
+
+def test_reads_after_a_write_are_not_served_from_a_landed_flight(client, register):
+    headers = register("mover")
+    member_id = client.get("/api/users/profile", headers=headers).json()["member"]["id"]
+    assert client.get(f"/api/members/{member_id}").json()["city"] == "Lahore"
+    assert client.get("/api/users/profile", headers=headers).json()["member"]["city"] == "Lahore"
+
+    client.put("/api/members/profile", json={"city": "Karachi"}, headers=headers)
+    # Flight keys carry the batch's cache version, which the write bumped
+    assert client.get(f"/api/members/{member_id}").json()["city"] == "Karachi"
+    assert client.get("/api/users/profile", headers=headers).json()["member"]["city"] == "Karachi"
@@ -0,0 +1,101 @@
+"""
+Response compression negotiated through Accept-Encoding.
+"""
+
+import gzip
+
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import Response, StreamingResponse
+from fastapi.testclient import TestClient
+
+import compression
+from compression import CompressionMiddleware, negotiate_encoding
+
+PAGE = b'{"members": [' + b'{"city": "Lahore"},' * 200 + b"{}]}"
+
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+
+    @app.get("/page")
+    def page():
+        return Response(PAGE, media_type="application/json")
+
+    @app.get("/small")
+    def small():
+        return Response(b'{"ok": true}', media_type="application/json")
+
+    @app.get("/uploads/avatar.png")
+    def avatar():
+        return Response(b"\x89PNG" + bytes(4096), media_type="image/png")
+
+    @app.get("/api/photo")
+    def photo():
+        return Response(b"\x89PNG" + bytes(4096), media_type="image/png")
+
+    @app.get("/stream")
+    def stream():
+        return StreamingResponse(iter([b"data: x\n\n" * 200] * 2), media_type="text/event-stream")
+
+    @app.get("/chunks")
+    def chunks():
+        return StreamingResponse(iter([PAGE, PAGE]), media_type="application/json")
+
+    return TestClient(CompressionMiddleware(app, minimum_size=1024, excluded_paths=["/uploads"]))
+
+
+def raw_get(client, path, accept_encoding="gzip"):
+    """Headers and the body as sent, before httpx decodes it"""
+    with client.stream("GET", path, headers={"Accept-Encoding": accept_encoding}) as response:
+        return response.headers, b"".join(response.iter_raw())
+
+
+@pytest.mark.parametrize("header, with_brotli, expected", [
+    ("gzip, deflate, br", True, "br"),
+    ("gzip, deflate, br", False, "gzip"),
+    ("br;q=0, gzip", True, "gzip"),
+    ("gzip;q=0", False, None),
+    ("GZIP;q=0.5", False, "gzip"),
+    ("*", True, "br"),
+    ("*;q=0", False, None),
+    ("*, gzip;q=0", False, None),
+    ("identity", True, None),
+    ("", True, None),
+    ("gzip;q=nonsense", False, None),
+])
+def test_negotiation(monkeypatch, header, with_brotli, expected):
+    monkeypatch.setattr(compression, "brotli", compression.brotli if with_brotli else None)
+    if with_brotli and compression.brotli is None:
+        pytest.skip("brotli is not installed")
+    assert negotiate_encoding(header) == expected
+
+
+def test_large_bodies_are_compressed_with_a_correct_length(client):
+    headers, body = raw_get(client, "/page")
+    assert headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in headers["Vary"]
+    assert int(headers["Content-Length"]) == len(body) < len(PAGE)
+    assert gzip.decompress(body) == PAGE
+
+
+def test_streamed_bodies_are_compressed_without_a_length(client):
+    headers, body = raw_get(client, "/chunks")
+    assert headers["Content-Encoding"] == "gzip" and "Content-Length" not in headers
+    assert gzip.decompress(body) == PAGE * 2
+
+
+def test_passthrough(client):
+    # Too small to be worth it
+    headers, body = raw_get(client, "/small")
+    assert "Content-Encoding" not in headers and body == b'{"ok": true}'
+    # Not accepted by the client
+    headers, body = raw_get(client, "/page", accept_encoding="identity")
+    assert "Content-Encoding" not in headers and body == PAGE
+    assert int(headers["Content-Length"]) == len(PAGE)
+    # Static uploads, images anywhere, and event streams
+    for path in ("/uploads/avatar.png", "/api/photo", "/stream"):
+        headers, body = raw_get(client, path)
+        assert "Content-Encoding" not in headers, path
+    assert body.startswith(b"data: x")
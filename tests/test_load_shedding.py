@@ -0,0 +1,138 @@
+"""
+Adaptive concurrency limits, load shedding and the readiness probe.
+"""
+
+import asyncio
+import time
+
+import httpx
+from fastapi.testclient import TestClient
+
+import load_shedding
+import main
+import tasks
+from database import SessionLocal, engine
+from load_shedding import AdaptiveConcurrencyMiddleware, AdaptiveLimit
+from models import BackgroundJob
+
+
+def held_app(release: asyncio.Event):
+    """An app whose requests stay in flight until release is set"""
+    async def app(scope, receive, send):
+        await release.wait()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+    return app
+
+
+def test_over_limit_requests_get_503_with_retry_after():
+    async def scenario():
+        release = asyncio.Event()
+        limits = {"directory": AdaptiveLimit("directory", initial=2, min=2, max=2)}
+        app = AdaptiveConcurrencyMiddleware(held_app(release), limits=limits, enabled=True)
+        async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+            held = [asyncio.create_task(client.get("/api/members/")) for _ in range(2)]
+            await asyncio.sleep(0.05)
+            rejected = await client.get("/api/members/")
+            # Probes are never limited
+            release.set()
+            assert (await client.get("/health")).status_code == 200
+            return rejected, [r.status_code for r in await asyncio.gather(*held)], limits["directory"]
+
+    rejected, held, limit = asyncio.run(scenario())
+    assert rejected.status_code == 503
+    assert rejected.headers["Retry-After"] == str(load_shedding.CONCURRENCY_RETRY_AFTER_SECONDS)
+    assert held == [200, 200]
+    assert (limit.accepted, limit.rejected, limit.in_flight) == (2, 1, 0)
+
+
+def test_low_priority_requests_are_shed_first():
+    async def scenario():
+        release = asyncio.Event()
+        limits = {
+            "directory": AdaptiveLimit("directory", initial=8, min=8, max=8),
+            "uploads": AdaptiveLimit("uploads", initial=8, min=8, max=8, priority="low"),
+        }
+        # 0.75 of 4: low priority is shed from 3 requests in flight
+        app = AdaptiveConcurrencyMiddleware(held_app(release), limits=limits, global_limit=4, enabled=True)
+        async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+            held = [asyncio.create_task(client.get("/api/members/")) for _ in range(2)]
+            await asyncio.sleep(0.05)
+            held.append(asyncio.create_task(client.post("/api/upload/avatar")))
+            await asyncio.sleep(0.05)
+            held.append(asyncio.create_task(client.get("/api/members/")))
+            await asyncio.sleep(0.05)
+            shed = await client.post("/api/upload/avatar")
+            release.set()
+            return shed, [r.status_code for r in await asyncio.gather(*held)]
+
+    shed, held = asyncio.run(scenario())
+    assert shed.status_code == 503 and "Retry-After" in shed.headers
+    assert held == [200, 200, 200, 200]
+
+
+def test_limit_shrinks_once_per_interval_and_grows_only_while_busy(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    limit = AdaptiveLimit("directory", initial=10, min=2, max=20, target_ms=100)
+    for _ in range(10):
+        assert limit.try_acquire()
+    assert not limit.try_acquire()
+
+    # Slow requests finishing together cost one decrease
+    for _ in range(3):
+        limit.release(250)
+    assert limit.limit == 9.0
+    now[0] += 0.1
+    limit.release(250)
+    assert limit.limit == 9.0 * 0.9
+
+    # Fast completions grow the limit while it is at least half used
+    busy = limit.limit
+    limit.release(10)
+    assert limit.limit == busy + 1 / busy
+    # ... and not when it is mostly idle
+    while limit.in_flight:
+        limit.release(10)
+    idle = limit.limit
+    limit.try_acquire()
+    limit.release(10)
+    assert limit.limit == idle
+
+    # Never below the minimum
+    for _ in range(50):
+        now[0] += 1
+        limit.try_acquire()
+        limit.release(1000)
+    assert limit.limit == 2
+
+
+def test_ready_reports_a_saturated_pool(monkeypatch):
+    client = TestClient(main.app)
+    assert client.get("/ready").json()["status"] == "ready"
+
+    monkeypatch.setattr(load_shedding, "READY_POOL_SATURATION", 0.01)
+    with engine.connect():
+        response = client.get("/ready")
+    assert response.status_code == 503
+    assert response.json()["status"] == "saturated"
+    assert "database pool saturated" in response.json()["reasons"]
+
+
+def test_ready_reports_a_job_backlog(monkeypatch):
+    client = TestClient(main.app)
+    monkeypatch.setattr(load_shedding, "READY_MAX_PENDING_JOBS", 1)
+    db = SessionLocal()
+    try:
+        # Due but unclaimed: the inline worker is off in tests
+        for _ in range(2):
+            tasks.enqueue(db, "log_database_counts")
+        db.commit()
+        response = client.get("/ready")
+    finally:
+        db.query(BackgroundJob).filter(BackgroundJob.name == "log_database_counts").delete()
+        db.commit()
+        db.close()
+    assert response.status_code == 503
+    assert response.json()["dueJobs"] >= 2
+    assert response.json()["reasons"] == ["background job backlog"]
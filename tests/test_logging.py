@@ -0,0 +1,90 @@
+"""
+Structured logging through the background queue, request IDs and access
+log sampling.
+"""
+
+import io
+import json
+import logging
+import sys
+
+import pytest
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+
+import logging_config
+from logging_config import RequestContextMiddleware, setup_logging, shutdown_logging
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(logging_config, "LOG_SAMPLED_PATHS", ["/api/members"])
+    app = FastAPI()
+
+    @app.get("/api/members/")
+    def members():
+        logging.getLogger("test.members").info("listing members", extra={"page": 1})
+        return []
+
+    @app.get("/api/members/broken")
+    def broken():
+        raise HTTPException(status_code=503)
+
+    @app.get("/api/users/profile")
+    def profile():
+        return {}
+
+    return TestClient(RequestContextMiddleware(app))
+
+
+@pytest.fixture
+def stdout(monkeypatch):
+    """Run setup_logging afresh into a buffer, and put the session's logging back after"""
+    root = logging.getLogger()
+    monkeypatch.setattr(root, "handlers", list(root.handlers))
+    monkeypatch.setattr(root, "level", root.level)
+    monkeypatch.setattr(logging_config, "_listener", None)
+    buffer = io.StringIO()
+    monkeypatch.setattr(sys, "stdout", buffer)
+    setup_logging("INFO")
+    yield buffer
+    shutdown_logging()
+
+
+def test_queued_records_are_json_with_the_request_id(client, stdout):
+    response = client.get("/api/users/profile", headers={"X-Request-ID": "req-123"})
+    assert response.headers["X-Request-ID"] == "req-123"
+    generated = client.get("/api/users/profile").headers["X-Request-ID"]
+    # The listener thread writes the queued records out when it stops
+    shutdown_logging()
+
+    lines = [json.loads(line) for line in stdout.getvalue().splitlines()]
+    access = [line for line in lines if line["logger"] == "access"]
+    assert [line["request_id"] for line in access] == ["req-123", generated]
+    assert access[0]["message"] == "request completed"
+    assert (access[0]["level"], access[0]["path"], access[0]["status"]) == ("INFO", "/api/users/profile", 200)
+    assert access[0]["duration_ms"] >= 0 and access[0]["timestamp"].endswith("+00:00")
+
+
+def test_records_from_handlers_carry_their_request_id(client, stdout):
+    client.get("/api/members/", headers={"X-Request-ID": "listing"})
+    shutdown_logging()
+
+    lines = [json.loads(line) for line in stdout.getvalue().splitlines()]
+    (record,) = [line for line in lines if line["logger"] == "test.members"]
+    assert (record["message"], record["page"], record["request_id"]) == ("listing members", 1, "listing")
+
+
+def test_sampled_routes_log_a_fraction_of_requests(client, caplog, monkeypatch):
+    monkeypatch.setattr(logging_config, "LOG_SAMPLE_RATE", 0.5)
+    draws = iter([0.9, 0.1, 0.9])
+    monkeypatch.setattr(logging_config.random, "random", lambda: next(draws))
+
+    with caplog.at_level(logging.INFO, logger="access"):
+        client.get("/api/members/")  # 0.9: skipped
+        client.get("/api/members/")  # 0.1: logged
+        client.get("/api/users/profile")  # not sampled, always logged
+        client.get("/api/members/broken")  # server errors are always logged
+        client.get("/api/members/")  # 0.9: skipped
+    logged = [(r.path, r.status) for r in caplog.records if r.name == "access"]
+    assert logged == [("/api/members/", 200), ("/api/users/profile", 200), ("/api/members/broken", 503)]
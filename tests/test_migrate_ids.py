@@ -0,0 +1,60 @@
+"""
+Rekeying a database with uuid4 ids, on a private SQLite file.
+"""
+
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session
+
+import migrate_ids
+from models import AvatarUpload, Base, Member, MemberLocation, RefreshToken, User
+
+
+@pytest.fixture
+def legacy_engine(tmp_path, monkeypatch):
+    """A database whose rows still have random uuid4 keys, with a row in every table that references them"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+
+    @event.listens_for(engine, "connect")
+    def _foreign_keys(dbapi_connection, connection_record):
+        dbapi_connection.execute("PRAGMA foreign_keys=ON")
+
+    Base.metadata.create_all(bind=engine)
+    created_at = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    user_id, member_id = str(uuid.uuid4()), str(uuid.uuid4())
+    with Session(engine) as db:
+        db.add(User(id=user_id, username="legacy", email="legacy@example.com", password="x", created_at=created_at))
+        db.add(Member(
+            id=member_id, user_id=user_id, registration_number="LEG001", department="Agronomy",
+            address="Address", city="Lahore", country="Pakistan", created_at=created_at,
+        ))
+        db.flush()
+        db.add(MemberLocation(member_id=member_id, source_key="lahore|pakistan", precision="city"))
+        db.add(RefreshToken(
+            id=str(uuid.uuid4()), user_id=user_id, family_id="family", token_hash="hash",
+            expires_at=created_at + timedelta(days=30),
+        ))
+        db.add(AvatarUpload(
+            id="upload", user_id=user_id, filename="me.png", content_type="image/png",
+            length=10, received=0, expires_at=created_at + timedelta(days=1),
+        ))
+        db.commit()
+    monkeypatch.setattr(migrate_ids, "engine", engine)
+    yield engine
+    engine.dispose()
+
+
+def test_rekey_follows_every_reference(legacy_engine):
+    # Raises if any reference was left pointing at an old id
+    migrate_ids.run(keep_ids=False)
+
+    with Session(legacy_engine) as db:
+        user, member = db.query(User).one(), db.query(Member).one()
+        assert uuid.UUID(user.id).version == 7 and uuid.UUID(member.id).version == 7
+        assert member.user_id == user.id
+        assert db.query(MemberLocation).one().member_id == member.id
+        assert db.query(AvatarUpload).one().user_id == user.id
+        assert db.query(RefreshToken).one().user_id == user.id
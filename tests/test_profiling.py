@@ -0,0 +1,28 @@
+"""
+Slow-query capture survives failing statements.
+"""
+
+import pytest
+from sqlalchemy import create_engine, exc, text
+
+import profiling
+
+
+def test_failed_statement_leaves_no_timing_behind(monkeypatch):
+    engine = create_engine("sqlite://")
+    profiling.install_query_listener(engine)
+    monkeypatch.setattr(profiling, "SLOW_QUERY_MS", 0)
+    profile = profiling.RequestProfile("GET", "/test")
+    token = profiling._current_profile.set(profile)
+    try:
+        with engine.connect() as conn:
+            with pytest.raises(exc.OperationalError):
+                conn.execute(text("SELECT * FROM missing_table"))
+            conn.execute(text("SELECT 1"))
+            assert not any(key for key in conn.info if "start" in key)
+    finally:
+        profiling._current_profile.reset(token)
+        engine.dispose()
+
+    assert [q["statement"] for q in profile.slow_queries] == ["SELECT 1"]
+    assert profile.slow_queries[0]["duration_ms"] < 100
@@ -0,0 +1,79 @@
+"""
+Token bucket rate limiting, on the in-memory store and on the Redis Lua
+script through fakeredis.
+"""
+
+import pytest
+from fastapi import FastAPI, Form
+from fastapi.testclient import TestClient
+
+from rate_limit import MemoryBucketStore, RateLimitMiddleware, RedisBucketStore
+
+
+@pytest.fixture(params=["memory", "redis"])
+def store(request):
+    if request.param == "memory":
+        return MemoryBucketStore()
+    fakeredis = pytest.importorskip("fakeredis")
+    # fakeredis runs Lua scripts through lupa
+    pytest.importorskip("lupa")
+    return RedisBucketStore(fakeredis.FakeRedis())
+
+
+def login_client(store, **limits):
+    app = FastAPI()
+
+    @app.post("/token")
+    def token(username: str = Form(...)):
+        return {"username": username}
+
+    @app.get("/token")
+    def unlimited():
+        return {}
+
+    rules = [{"path": "/token", "methods": ["POST"], **limits}]
+    return TestClient(RateLimitMiddleware(app, rules=rules, store=store, enabled=True))
+
+
+def test_bucket_allows_a_burst_then_refills(store):
+    # 2 requests per second: a burst of two, then one token every half second
+    assert store.take("key", 2, 2.0, now=100.0) == 0
+    assert store.take("key", 2, 2.0, now=100.0) == 0
+    assert store.take("key", 2, 2.0, now=100.0) == pytest.approx(0.5)
+    assert store.take("key", 2, 2.0, now=100.25) == pytest.approx(0.25)
+    assert store.take("key", 2, 2.0, now=100.5) == 0
+    # Buckets are independent and never fill beyond their capacity
+    assert store.take("other", 2, 2.0, now=100.5) == 0
+    assert [store.take("idle", 1, 1.0, now=t) for t in (0.0, 1000.0, 1000.0)] == [0, 0, pytest.approx(1.0)]
+
+
+def test_per_ip_limit_returns_429_with_retry_after(store):
+    client = login_client(store, per_ip="2/minute")
+    assert [client.post("/token", data={"username": "a"}).status_code for _ in range(2)] == [200, 200]
+
+    response = client.post("/token", data={"username": "b"})
+    assert response.status_code == 429
+    assert response.json() == {"detail": "Too many requests"}
+    # One token every 30 seconds
+    assert 29 <= int(response.headers["Retry-After"]) <= 30
+    # Other methods on the path are not limited
+    assert client.get("/token").status_code == 200
+
+
+def test_per_username_limit_applies_across_clients(store):
+    client = login_client(store, per_ip="100/minute", per_username="2/minute")
+    for _ in range(2):
+        response = client.post("/token", data={"username": "Target"})
+        # The buffered body still reaches the endpoint
+        assert response.json() == {"username": "Target"}
+
+    # Usernames are case-insensitive
+    assert client.post("/token", data={"username": "target"}).status_code == 429
+    assert client.post("/token", json={"username": "TARGET"}).status_code == 429
+    assert client.post("/token", data={"username": "bystander"}).status_code == 200
+
+
+def test_disabled_middleware_passes_everything(store):
+    client = login_client(store, per_ip="1/minute")
+    client.app.enabled = False
+    assert {client.post("/token", data={"username": "a"}).status_code for _ in range(3)} == {200}
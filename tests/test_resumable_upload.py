@@ -0,0 +1,130 @@
+"""
+Resumable avatar uploads survive dropped connections.
+
+Interrupted requests are driven through the ASGI app directly, so the body
+can stop partway and end in a disconnect, as a phone losing signal would.
+Each test runs in a rolled-back transaction, see conftest.py.
+"""
+
+import asyncio
+import base64
+import os
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import main
+import resumable
+from dependencies import session_scope
+from models import AvatarUpload
+
+PHOTO = b"\x89PNG" + os.urandom(300_000)
+
+
+@pytest.fixture
+def auth_headers(register):
+    return register("resumer")
+
+
+def metadata(**values):
+    return ",".join(f"{k} {base64.b64encode(v.encode()).decode()}" for k, v in values.items())
+
+
+def create(client, auth_headers, length=len(PHOTO), filetype="image/png"):
+    return client.post("/api/upload/avatar/resumable", headers={
+        **auth_headers,
+        "Upload-Length": str(length),
+        "Upload-Metadata": metadata(filename="phone.png", filetype=filetype),
+    })
+
+
+def patch(client, auth_headers, location, offset, chunk):
+    return client.patch(location, content=chunk, headers={
+        **auth_headers,
+        "Upload-Offset": str(offset),
+        "Content-Type": resumable.CHUNK_CONTENT_TYPE,
+    })
+
+
+def patch_interrupted(location, auth_headers, offset, chunk, delivered):
+    """Send chunk but drop the connection after the first delivered bytes"""
+    messages = [
+        {"type": "http.request", "body": chunk[:delivered], "more_body": True},
+        {"type": "http.disconnect"},
+    ]
+
+    async def receive():
+        return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+    async def send(message):
+        pass
+
+    headers = {
+        **auth_headers,
+        "Upload-Offset": str(offset),
+        "Content-Type": resumable.CHUNK_CONTENT_TYPE,
+        "Content-Length": str(len(chunk)),
+    }
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": "PATCH", "scheme": "http", "path": location, "raw_path": location.encode(),
+        "query_string": b"", "root_path": "", "client": ("127.0.0.1", 50000), "server": ("testserver", 80),
+        "headers": [(k.lower().encode(), v.encode()) for k, v in headers.items()],
+    }
+    asyncio.run(main.app(scope, receive, send))
+
+
+def test_upload_resumes_after_dropped_connection(client, auth_headers):
+    created = create(client, auth_headers)
+    assert created.status_code == 201
+    location = created.headers["Location"]
+    assert created.headers["Upload-Offset"] == "0"
+
+    first = patch(client, auth_headers, location, 0, PHOTO[:100_000])
+    assert first.status_code == 204 and first.headers["Upload-Offset"] == "100000"
+
+    # The connection drops 50000 bytes into the second chunk
+    patch_interrupted(location, auth_headers, 100_000, PHOTO[100_000:], delivered=50_000)
+    offset = int(client.head(location, headers=auth_headers).headers["Upload-Offset"])
+    assert offset == 150_000
+
+    # A retry from the stale offset is refused rather than corrupting the file
+    stale = patch(client, auth_headers, location, 100_000, PHOTO[100_000:])
+    assert stale.status_code == 409 and stale.headers["Upload-Offset"] == "150000"
+
+    last = patch(client, auth_headers, location, offset, PHOTO[offset:])
+    assert last.status_code == 204
+    avatar_url = last.headers["Avatar-Url"]
+    with open("." + avatar_url, "rb") as f:
+        assert f.read() == PHOTO
+    assert not os.path.exists(resumable.part_path(location.rsplit("/", 1)[1]))
+    assert client.get("/api/users/profile", headers=auth_headers).json()["member"]["avatarUrl"] == avatar_url
+
+
+def test_rejects_oversized_and_non_image_uploads(client, auth_headers):
+    assert create(client, auth_headers, length=6 * 1024 * 1024).status_code == 413
+    assert create(client, auth_headers, filetype="text/plain").status_code == 400
+
+    avatar_url = client.get("/api/users/profile", headers=auth_headers).json()["member"]["avatarUrl"]
+    location = create(client, auth_headers, length=10).headers["Location"]
+    response = patch(client, auth_headers, location, 0, b"x" * 20)
+    assert response.status_code == 413 and response.headers["Upload-Offset"] == "0"
+    # Without a Content-Length the overflow is only seen partway through the body
+    response = patch(client, auth_headers, location, 0, iter([b"x" * 6, b"x" * 6]))
+    assert response.status_code == 413 and response.headers["Upload-Offset"] == "0"
+    assert client.head(location, headers=auth_headers).headers["Upload-Offset"] == "0"
+    assert client.get("/api/users/profile", headers=auth_headers).json()["member"]["avatarUrl"] == avatar_url
+
+
+def test_expired_upload_is_removed(client, auth_headers):
+    location = create(client, auth_headers).headers["Location"]
+    upload_id = location.rsplit("/", 1)[1]
+    patch(client, auth_headers, location, 0, PHOTO[:1000])
+    with session_scope() as db:
+        db.get(AvatarUpload, upload_id).expires_at = datetime.now(timezone.utc) - timedelta(minutes=1)
+        db.commit()
+
+    assert patch(client, auth_headers, location, 1000, PHOTO[1000:2000]).status_code == 410
+    resumable.cleanup()
+    assert client.head(location, headers=auth_headers).status_code == 404
+    assert not os.path.exists(resumable.part_path(upload_id))
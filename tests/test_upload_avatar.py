@@ -0,0 +1,95 @@
+"""
+Avatar uploads must return their database connection to the pool.
+
+Runs the app in-process against the real connection pool rather than the
+rolled-back transaction of conftest.py: python -m pytest tests
+"""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+
+import main
+from database import engine
+from pool_monitor import CheckoutTracker
+
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(main.app) as client:
+        yield client
+
+
+@pytest.fixture(scope="module")
+def auth_headers(client):
+    client.post("/api/users/register", json={
+        "username": "uploader", "email": "uploader@example.com", "password": "secret123",
+        "name": "Uploader", "registration_number": "UP001", "department": "Agronomy",
+        "address": "Address", "city": "Faisalabad", "country": "Pakistan",
+    })
+    token = client.post("/api/users/token", data={"username": "uploader", "password": "secret123"}).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    yield headers
+    # Committed through the real pool, remove it so later rolled-back tests start empty
+    user_id = client.get("/api/users/me", headers=headers).json()["id"]
+    client.delete(f"/api/users/{user_id}")
+
+
+def test_upload_avatar_does_not_exhaust_pool(client, auth_headers):
+    # More uploads than the pool can hold at once (pool_size + max_overflow), several in flight
+    uploads = (engine.pool.size() + engine.pool._max_overflow) * 3
+
+    def upload(i):
+        return client.post(
+            "/api/upload/avatar",
+            files={"file": (f"avatar{i}.png", b"\x89PNG" + bytes(64), "image/png")},
+            headers=auth_headers,
+        ).status_code
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        statuses = list(pool.map(upload, range(uploads)))
+
+    assert statuses == [200] * uploads
+    assert engine.pool.checkedout() == 0
+
+
+def test_rejected_upload_returns_connection(client, auth_headers):
+    response = client.post(
+        "/api/upload/avatar",
+        files={"file": ("notes.txt", b"not an image", "text/plain")},
+        headers=auth_headers,
+    )
+    assert response.status_code == 400
+    assert engine.pool.checkedout() == 0
+
+
+@pytest.fixture
+def tracked_engine():
+    """A private engine with a tracker that reports at once, removed again afterwards"""
+    private_engine = create_engine("sqlite://")
+    tracker = CheckoutTracker(warn_after=0, capture_stacks=True)
+    tracker.install(private_engine)
+    try:
+        yield private_engine, tracker
+    finally:
+        tracker.uninstall(private_engine)
+        private_engine.dispose()
+
+
+def test_tracker_reports_held_connection_with_stack(tracked_engine, caplog):
+    private_engine, tracker = tracked_engine
+    connection = private_engine.connect()
+    try:
+        with caplog.at_level(logging.WARNING, logger="pool_monitor"):
+            tracker.check()
+        held = tracker.held()
+    finally:
+        connection.close()
+
+    assert held and "test_tracker_reports_held_connection_with_stack" in held[0]["stack"]
+    record = next(r for r in caplog.records if "possible leak" in r.getMessage())
+    assert "test_tracker_reports_held_connection_with_stack" in record.checkout_stack
+    assert tracker.held() == []
@@ -1,30 +1,35 @@
 from models import User, Member
 from schemas import UserCreate, User as UserSchema, MemberCreate
-from database import SessionLocal
-from fastapi import APIRouter, Depends, HTTPException, status, Body
-from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
+from dependencies import get_db, oauth2_scheme
+from fastapi import APIRouter, Depends, HTTPException, status, Body, Header, Response
+from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
-from typing import Optional
+from typing import Optional, List
+from sqlalchemy import update, delete, select
+from sqlalchemy.exc import IntegrityError
 from passlib.context import CryptContext
 from datetime import datetime, timedelta
 import jwt
 import os
-import uuid
-from config import SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES
+from ids import new_id
+from config import SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES, DEFAULT_BATCH, BCRYPT_ROUNDS
+from profiling import ProfilingRoute
+from cache import directory_cache, encode_json
+import coalesce
+import idempotency
+import refresh_tokens
+import tasks
+from directory import refresh_directory, record_user_deletes
+from geo import locate_members
+from tenancy import get_batch
 
-router = APIRouter(tags=["users"])
+router = APIRouter(tags=["users"], route_class=ProfilingRoute)
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/users/token")
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
 
-# Dependency
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+# Concurrent profile reads by the same user share one query, see coalesce.py
+profile_flights = coalesce.group("users.profile")
 
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
@@ -32,11 +37,11 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password):
     return pwd_context.hash(password)
 
-def get_user_by_username(db: Session, username: str):
-    return db.query(User).filter(User.username == username).first()
+def get_user_by_username(db: Session, username: str, batch: str):
+    return db.query(User).filter(User.batch == batch, User.username == username).first()
 
-def get_user_by_email(db: Session, email: str):
-    return db.query(User).filter(User.email == email).first()
+def get_user_by_email(db: Session, email: str, batch: str):
+    return db.query(User).filter(User.batch == batch, User.email == email).first()
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -45,12 +50,16 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def decode_access_token(token: str):
+def decode_access_token(token: str, batch: str):
+    """Username the token was issued to, if it was issued for batch"""
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
         if username is None:
             raise HTTPException(status_code=401, detail="Invalid token")
+        # Tokens issued before batches existed belong to the default batch
+        if payload.get("batch", DEFAULT_BATCH) != batch:
+            raise HTTPException(status_code=401, detail="Invalid token")
         return username
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expired")
@@ -72,35 +81,63 @@ class UserRegistrationRequest(BaseModel):
     phone: Optional[str] = None
     bio: Optional[str] = None
 
+# Identifiers of the unique constraints register can hit, as the drivers name them:
+# SQLite reports "table.column", PostgreSQL and MySQL the index name. Matching
+# bare words would also match the duplicate value echoed in the message.
+REGISTRATION_CONFLICTS = (
+    (("users.username", "ix_users_batch_username", "ix_users_username"), "Username already registered"),
+    (("users.email", "ix_users_batch_email", "ix_users_email"), "Email already registered"),
+    (
+        ("members.registration_number", "ix_members_batch_registration_number", "ix_members_registration_number"),
+        "Registration number already registered",
+    ),
+)
+
+def registration_conflict_detail(error: IntegrityError) -> str:
+    """Map a unique constraint violation from register to a client-facing message"""
+    message = str(error.orig).lower()
+    for identifiers, detail in REGISTRATION_CONFLICTS:
+        if any(identifier in message for identifier in identifiers):
+            return detail
+    return "User already registered"
+
 @router.post("/register", response_model=UserSchema)
-def register(user_data: UserRegistrationRequest, db: Session = Depends(get_db)):
-    # Check if username already exists
-    db_user = get_user_by_username(db, user_data.username)
-    if db_user:
-        raise HTTPException(status_code=400, detail="Username already registered")
-    
-    # Check if email already exists
-    db_user = get_user_by_email(db, user_data.email)
-    if db_user:
-        raise HTTPException(status_code=400, detail="Email already registered")
+def register(
+    user_data: UserRegistrationRequest,
+    idempotency_key: Optional[str] = Header(None),
+    batch: str = Depends(get_batch),
+    db: Session = Depends(get_db)
+):
+    """Create a user and their member profile in a single transaction.
+
+    Duplicates are detected by the unique constraints rather than pre-check
+    queries. Clients may send an Idempotency-Key header to safely retry.
+    """
+    if idempotency_key:
+        stored_key = f"register:{batch}:{idempotency_key}"
+        request_hash = idempotency.fingerprint(user_data.dict(), exclude=("password",))
+        replayed = idempotency.replay(db, stored_key, request_hash)
+        if replayed is not None:
+            return replayed
     
     # Create user
-    user_id = str(uuid.uuid4())
+    user_id = new_id()
     hashed_password = get_password_hash(user_data.password)
     db_user = User(
         id=user_id,
+        batch=batch,
         username=user_data.username,
         email=user_data.email,
         name=user_data.name,
         role=user_data.role,
         password=hashed_password
     )
-    db.add(db_user)
     
     # Create member profile
-    member_id = str(uuid.uuid4())
+    member_id = new_id()
     db_member = Member(
         id=member_id,
+        batch=batch,
         user_id=user_id,
         registration_number=user_data.registration_number,
         department=user_data.department,
@@ -111,91 +148,148 @@ def register(user_data: UserRegistrationRequest, db: Session = Depends(get_db)):
         bio=user_data.bio,
         is_profile_complete=True  # Since we're creating it with all required fields
     )
-    db.add(db_member)
+    db_user.member = db_member
+    db.add(db_user)
     
-    db.commit()
-    db.refresh(db_user)
-    db.refresh(db_member)
+    # Everything the response needs is already in memory, no refresh after commit
+    response = UserSchema.from_orm(db_user)
+    if idempotency_key:
+        idempotency.store(db, stored_key, request_hash, response.json())
     
-    return db_user
+    try:
+        refresh_directory(db, member_ids=[member_id])
+        locate_members(db, member_ids=[member_id])
+        db.commit()
+    except IntegrityError as e:
+        db.rollback()
+        if idempotency_key:
+            # A concurrent retry with the same key may have won the race
+            replayed = idempotency.replay(db, stored_key, request_hash)
+            if replayed is not None:
+                return replayed
+        raise HTTPException(status_code=400, detail=registration_conflict_detail(e))
+    directory_cache.scoped(batch).invalidate()
+    
+    return response
 
 class Token(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: Optional[str] = None
     user: UserSchema
 
 @router.post("/token", response_model=Token)
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = get_user_by_username(db, form_data.username)
+def login(
+    form_data: OAuth2PasswordRequestForm = Depends(),
+    batch: str = Depends(get_batch),
+    db: Session = Depends(get_db)
+):
+    user = get_user_by_username(db, form_data.username, batch)
     if not user or not verify_password(form_data.password, user.password):
         raise HTTPException(status_code=400, detail="Incorrect username or password")
     
-    access_token = create_access_token(data={"sub": user.username})
+    access_token = create_access_token(data={"sub": user.username, "batch": user.batch})
+    refresh_token = refresh_tokens.issue(db, user)
+    db.commit()
     return {
         "access_token": access_token, 
         "token_type": "bearer",
+        "refresh_token": refresh_token,
+        "user": user
+    }
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
+@router.post("/refresh", response_model=Token)
+def refresh(request: RefreshRequest, db: Session = Depends(get_db)):
+    """Exchange a refresh token for a new access token and a rotated refresh token"""
+    user, refresh_token = refresh_tokens.rotate(db, request.refresh_token)
+    access_token = create_access_token(data={"sub": user.username, "batch": user.batch})
+    db.commit()
+    return {
+        "access_token": access_token,
+        "token_type": "bearer",
+        "refresh_token": refresh_token,
         "user": user
     }
 
 @router.get("/me", response_model=UserSchema)
-def read_users_me(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    username = decode_access_token(token)
-    user = get_user_by_username(db, username)
+def read_users_me(
+    token: str = Depends(oauth2_scheme),
+    batch: str = Depends(get_batch),
+    db: Session = Depends(get_db)
+):
+    username = decode_access_token(token, batch)
+    user = get_user_by_username(db, username, batch)
     if user:
         return user
     raise HTTPException(status_code=401, detail="Invalid token")
 
 @router.get("/profile", response_model=dict)
-def get_user_profile(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    username = decode_access_token(token)
-    user = get_user_by_username(db, username)
-    if not user:
-        raise HTTPException(status_code=401, detail="Invalid token")
+def get_user_profile(
+    token: str = Depends(oauth2_scheme),
+    batch: str = Depends(get_batch),
+    db: Session = Depends(get_db)
+):
+    username = decode_access_token(token, batch)
+
+    def fetch() -> bytes:
+        user = get_user_by_username(db, username, batch)
+        if not user:
+            raise HTTPException(status_code=401, detail="Invalid token")
     
-    # Get member profile
-    member = db.query(Member).filter(Member.user_id == user.id).first()
+        # Get member profile
+        member = db.query(Member).filter(Member.user_id == user.id).first()
     
-    # Prepare member data if it exists
-    member_data = None
-    if member:
-        member_data = {
-            "id": member.id,
-            "registrationNumber": member.registration_number,
-            "department": member.department,
-            "address": member.address,
-            "city": member.city,
-            "country": member.country,
-            "phone": member.phone,
-            "bio": member.bio,
-            "avatarUrl": member.avatar_url,
-            "isProfileComplete": member.is_profile_complete,
-            "createdAt": member.created_at,
-            "updatedAt": member.updated_at
-        }
+        # Prepare member data if it exists
+        member_data = None
+        if member:
+            member_data = {
+                "id": member.id,
+                "registrationNumber": member.registration_number,
+                "department": member.department,
+                "address": member.address,
+                "city": member.city,
+                "country": member.country,
+                "phone": member.phone,
+                "bio": member.bio,
+                "avatarUrl": member.avatar_url,
+                "isProfileComplete": member.is_profile_complete,
+                "createdAt": member.created_at,
+                "updatedAt": member.updated_at
+            }
     
-    return {
-        "user": {
-            "id": user.id,
-            "username": user.username,
-            "email": user.email,
-            "name": user.name,
-            "role": user.role,
-            "created_at": user.created_at
-        },
-        "member": member_data
-    }
+        return encode_json({
+            "user": {
+                "id": user.id,
+                "username": user.username,
+                "email": user.email,
+                "name": user.name,
+                "role": user.role,
+                "created_at": user.created_at
+            },
+            "member": member_data
+        })
+
+    flight_key = directory_cache.scoped(batch).key("profile", username)
+    return Response(content=profile_flights.do(flight_key, fetch, db), media_type="application/json")
 
 @router.delete("/{user_id}")
-def delete_user(user_id: str, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.id == user_id).first()
+def delete_user(user_id: str, batch: str = Depends(get_batch), db: Session = Depends(get_db)):
+    user = db.query(User).filter(User.id == user_id, User.batch == batch).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     # Delete member profile if exists
     member = db.query(Member).filter(Member.user_id == user_id).first()
     if member:
+        if member.avatar_url:
+            tasks.enqueue(db, "remove_avatar_file", avatar_url=member.avatar_url, user_id=user_id, batch=batch)
         db.delete(member)
     db.delete(user)
+    refresh_directory(db, user_ids=[user_id])
     db.commit()
+    directory_cache.scoped(batch).invalidate()
     return {"ok": True}
 
 class UserUpdateRequest(BaseModel):
@@ -205,28 +299,69 @@ class UserUpdateRequest(BaseModel):
     email: Optional[str] = None
     role: Optional[str] = None
 
+# Registered before /{user_id}, which would otherwise match "profile"
+@router.put("/profile", response_model=UserSchema)
+def update_own_user_profile(
+    update: UserUpdateRequest = Body(...),
+    token: str = Depends(oauth2_scheme),
+    batch: str = Depends(get_batch),
+    db: Session = Depends(get_db),
+):
+    username = decode_access_token(token, batch)
+    user = get_user_by_username(db, username, batch)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    if update.username:
+        if db.query(User).filter(User.batch == batch, User.username == update.username, User.id != user.id).first():
+            raise HTTPException(status_code=400, detail="Username already taken")
+        user.username = update.username
+    if update.password:
+        user.password = get_password_hash(update.password)
+        # Sessions started with the old password must not outlive it
+        refresh_tokens.revoke_user(db, user.id)
+    if update.name:
+        user.name = update.name
+    if update.email:
+        if db.query(User).filter(User.batch == batch, User.email == update.email, User.id != user.id).first():
+            raise HTTPException(status_code=400, detail="Email already taken")
+        user.email = update.email
+    refresh_directory(db, user_ids=[user.id])
+    db.commit()
+    directory_cache.scoped(batch).invalidate()
+    db.refresh(user)
+    return user
+
 @router.put("/{user_id}", response_model=UserSchema)
-def update_user(user_id: str, update: UserUpdateRequest = Body(...), db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.id == user_id).first()
+def update_user(
+    user_id: str,
+    update: UserUpdateRequest = Body(...),
+    batch: str = Depends(get_batch),
+    db: Session = Depends(get_db)
+):
+    user = db.query(User).filter(User.id == user_id, User.batch == batch).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     if update.username:
         # Check for username conflict
-        if db.query(User).filter(User.username == update.username, User.id != user_id).first():
+        if db.query(User).filter(User.batch == batch, User.username == update.username, User.id != user_id).first():
             raise HTTPException(status_code=400, detail="Username already taken")
         user.username = update.username
     if update.password:
         user.password = get_password_hash(update.password)
+        # Sessions started with the old password must not outlive it
+        refresh_tokens.revoke_user(db, user.id)
     if update.name:
         user.name = update.name
     if update.email:
         # Check for email conflict
-        if db.query(User).filter(User.email == update.email, User.id != user_id).first():
+        if db.query(User).filter(User.batch == batch, User.email == update.email, User.id != user_id).first():
             raise HTTPException(status_code=400, detail="Email already taken")
         user.email = update.email
     if update.role:
         user.role = update.role
+    refresh_directory(db, user_ids=[user_id])
     db.commit()
+    directory_cache.scoped(batch).invalidate()
     db.refresh(user)
     return user
 
@@ -235,12 +370,13 @@ def read_all_users_admin(
     skip: int = 0, 
     limit: int = 100, 
     token: str = Depends(oauth2_scheme),
+    batch: str = Depends(get_batch),
     db: Session = Depends(get_db)
 ):
     """Get all users with their member information (admin only)"""
     # Verify authentication and admin role
-    username = decode_access_token(token)
-    current_user = get_user_by_username(db, username)
+    username = decode_access_token(token, batch)
+    current_user = get_user_by_username(db, username, batch)
     if not current_user:
         raise HTTPException(status_code=401, detail="Invalid authentication")
     
@@ -248,7 +384,7 @@ def read_all_users_admin(
         raise HTTPException(status_code=403, detail="Admin access required")
     
     # Get all users with their member profiles
-    users = db.query(User).offset(skip).limit(limit).all()
+    users = db.query(User).filter(User.batch == batch).offset(skip).limit(limit).all()
     
     result = []
     for user in users:
@@ -286,28 +422,88 @@ def read_all_users_admin(
     
     return result
 
-@router.put("/profile")
-def update_own_user_profile(
-    update: UserUpdateRequest = Body(...),
+def require_admin(token: str, batch: str, db: Session) -> User:
+    username = decode_access_token(token, batch)
+    current_user = get_user_by_username(db, username, batch)
+    if not current_user:
+        raise HTTPException(status_code=401, detail="Invalid authentication")
+    if current_user.role != "ADMIN":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return current_user
+
+class BulkUserSelection(BaseModel):
+    ids: Optional[List[str]] = None
+    role: Optional[str] = None
+    created_before: Optional[datetime] = None
+
+    def conditions(self, batch: str):
+        """WHERE clauses for the selection within batch, at least one criterion is required"""
+        conditions = []
+        if self.ids is not None:
+            conditions.append(User.id.in_(self.ids))
+        if self.role is not None:
+            conditions.append(User.role == self.role)
+        if self.created_before is not None:
+            conditions.append(User.created_at < self.created_before)
+        if not conditions:
+            raise HTTPException(status_code=400, detail="Provide ids or at least one filter")
+        return conditions + [User.batch == batch]
+
+class BulkRoleUpdateRequest(BulkUserSelection):
+    new_role: str
+
+@router.post("/admin/bulk/role")
+def bulk_update_role(
+    request: BulkRoleUpdateRequest,
     token: str = Depends(oauth2_scheme),
-    db: Session = Depends(get_db),
+    batch: str = Depends(get_batch),
+    db: Session = Depends(get_db)
 ):
-    username = decode_access_token(token)
-    user = get_user_by_username(db, username)
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    if update.username:
-        if db.query(User).filter(User.username == update.username, User.id != user.id).first():
-            raise HTTPException(status_code=400, detail="Username already taken")
-        user.username = update.username
-    if update.password:
-        user.password = get_password_hash(update.password)
-    if update.name:
-        user.name = update.name
-    if update.email:
-        if db.query(User).filter(User.email == update.email, User.id != user.id).first():
-            raise HTTPException(status_code=400, detail="Email already taken")
-        user.email = update.email
+    """Change the role of every selected user in a single UPDATE (admin only)"""
+    current_user = require_admin(token, batch, db)
+    # Like bulk delete, never let an admin demote themselves through a filter
+    conditions = request.conditions(batch) + [User.id != current_user.id]
+    result = db.execute(
+        update(User)
+        .where(*conditions)
+        .values(role=request.new_role)
+        .execution_options(synchronize_session=False)
+    )
+    # A role filter no longer matches once applied: the selected users now have the new role
+    updated = request.copy(update={"role": request.new_role}).conditions(batch) + [User.id != current_user.id]
+    refresh_directory(db, user_ids=select(User.id).where(*updated))
     db.commit()
-    db.refresh(user)
-    return user
+    directory_cache.scoped(batch).invalidate()
+    return {"updated": result.rowcount}
+
+@router.post("/admin/bulk/delete")
+def bulk_delete_users(
+    request: BulkUserSelection,
+    token: str = Depends(oauth2_scheme),
+    batch: str = Depends(get_batch),
+    db: Session = Depends(get_db)
+):
+    """Delete every selected user and their member profile in one transaction (admin only)"""
+    current_user = require_admin(token, batch, db)
+    # Never let an admin delete their own account through a filter
+    conditions = request.conditions(batch) + [User.id != current_user.id]
+    selected_ids = select(User.id).where(*conditions)
+    # Log the removals for the changes feed while the directory rows still exist
+    record_user_deletes(db, selected_ids)
+    avatars = db.execute(
+        select(Member.user_id, Member.avatar_url)
+        .where(Member.user_id.in_(selected_ids), Member.avatar_url.isnot(None))
+    ).all()
+    for user_id, avatar_url in avatars:
+        tasks.enqueue(db, "remove_avatar_file", avatar_url=avatar_url, user_id=user_id, batch=batch)
+    # Databases created before members.user_id had ON DELETE CASCADE need the explicit delete;
+    # member_directory rows go with their members through its own cascade
+    members_result = db.execute(
+        delete(Member).where(Member.user_id.in_(selected_ids)).execution_options(synchronize_session=False)
+    )
+    users_result = db.execute(
+        delete(User).where(*conditions).execution_options(synchronize_session=False)
+    )
+    db.commit()
+    directory_cache.scoped(batch).invalidate()
+    return {"deleted_users": users_result.rowcount, "deleted_members": members_result.rowcount}